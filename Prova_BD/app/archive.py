@@ -0,0 +1,241 @@
+"""
+Arquivamento por tempo da coleção `messages`.
+
+Mensagens mais antigas que ARCHIVE_AFTER_DAYS saem da coleção quente para
+coleções mensais (`messages_archive_AAAAMM`, pelo instante do `_id`), cada
+uma com o mesmo índice {room: 1, _id: -1}. Assim a coleção quente e seu
+índice ficam do tamanho do período recente e cabem em memória.
+
+A cópia é feita em lotes, do `_id` mais antigo para o mais novo, com pausa
+entre eles para não competir com o tráfego ao vivo. Cada lote é inserido no
+arquivo (duplicatas ignoradas) e só então removido da coleção quente: uma
+interrupção no meio deixa, no máximo, cópias repetidas, descartadas na
+leitura e na próxima execução.
+
+As leituras do histórico (`find_tiered`, `iter_tiered`) percorrem as camadas
+em ordem de `_id` e pulam os meses fora do intervalo pedido, de modo que
+um cursor atravessa a fronteira quente/arquivo de forma transparente.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from config import (
+    ARCHIVE_ENABLED,
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_INTERVAL,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_PAUSE_MS,
+)
+from metrics import MONGO_SECONDS
+from persistence import DUPLICATE_KEY
+
+# ______________________________________________________________________________________________________
+
+HOT_COLLECTION = "messages"
+ARCHIVE_PREFIX = "messages_archive_"
+
+# Validade (s) da lista de coleções de arquivo (outros workers podem criar meses novos)
+TIERS_TTL = 60.0
+
+_ARCHIVE_SECONDS = MONGO_SECONDS.labels("archive_batch")
+
+# ______________________________________________________________________________________________________
+
+def archive_name(oid: ObjectId) -> str:
+    """Coleção de arquivo do mês em que o `_id` foi gerado."""
+    return f"{ARCHIVE_PREFIX}{oid.generation_time:%Y%m}"
+
+def _month_range(name: str):
+    """Limites de `_id` [início, fim) do mês de uma coleção de arquivo."""
+    year, month = int(name[-6:-2]), int(name[-2:])
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    return ObjectId.from_datetime(start), ObjectId.from_datetime(end)
+
+def _overlaps(name: str, bounds: Optional[dict]) -> bool:
+    """Indica se o mês da coleção pode conter `_id` dentro dos limites do filtro."""
+    if not isinstance(bounds, dict):
+        return True
+    start, end = _month_range(name)
+    lower = bounds.get("$gt", bounds.get("$gte"))
+    upper = bounds.get("$lt", bounds.get("$lte"))
+    if lower is not None and end <= lower:
+        return False
+    if upper is not None and start > upper:
+        return False
+    return True
+
+# ______________________________________________________________________________________________________
+
+# Coleções de arquivo conhecidas (mais antigas primeiro) e instante da última listagem
+_tiers: List[str] = []
+_tiers_at = 0.0
+
+async def archive_tiers(db, refresh: bool = False) -> List[str]:
+    """Coleções de arquivo existentes, da mais antiga para a mais nova."""
+    global _tiers, _tiers_at
+    if refresh or time.monotonic() - _tiers_at > TIERS_TTL:
+        names = await db.list_collection_names(filter={"name": {"$regex": f"^{ARCHIVE_PREFIX}\\d{{6}}$"}})
+        _tiers = sorted(names)
+        _tiers_at = time.monotonic()
+    return _tiers
+
+async def _collections(db, query: dict, direction: int) -> List[str]:
+    """Camadas a consultar, na ordem da paginação, sem os meses fora do intervalo."""
+    archives = [n for n in await archive_tiers(db) if _overlaps(n, query.get("_id"))]
+    if direction == -1:
+        return [HOT_COLLECTION] + archives[::-1]
+    return archives + [HOT_COLLECTION]
+
+# ______________________________________________________________________________________________________
+
+async def find_tiered(db, query: dict, direction: int, limit: int, projection: Optional[dict] = None) -> list:
+    """
+    Até `limit` documentos ordenados por `_id` (direction -1 ou 1) lendo a
+    coleção quente e os meses arquivados até completar a página.
+    """
+    docs: list = []
+    seen = set()
+    for name in await _collections(db, query, direction):
+        cursor = db[name].find(query, projection).sort("_id", direction).limit(limit - len(docs))
+        async for doc in cursor:
+            if doc["_id"] not in seen:
+                seen.add(doc["_id"])
+                docs.append(doc)
+        if len(docs) >= limit:
+            break
+    return docs[:limit]
+
+async def iter_tiered(db, query: dict, projection: Optional[dict] = None, batch_size: int = 1000) -> AsyncIterator[dict]:
+    """Todos os documentos do filtro em ordem cronológica, do arquivo à coleção quente."""
+    last = None
+    for name in await _collections(db, query, 1):
+        cursor = db[name].find(query, projection).sort("_id", 1).batch_size(batch_size)
+        async for doc in cursor:
+            # cópias repetidas de um lote interrompido aparecem em duas camadas
+            if last is not None and doc["_id"] <= last:
+                continue
+            last = doc["_id"]
+            yield doc
+
+# ______________________________________________________________________________________________________
+
+class Archiver:
+    """Tarefa periódica que move mensagens antigas para as coleções mensais."""
+
+    def __init__(
+        self,
+        db,
+        after_days: float = ARCHIVE_AFTER_DAYS,
+        interval: float = ARCHIVE_INTERVAL,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        pause_ms: int = ARCHIVE_PAUSE_MS,
+    ):
+        # Função que retorna o banco (cliente MongoDB compartilhado, inicializado sob demanda)
+        self.db = db
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause_ms / 1000
+        self._task: Optional[asyncio.Task] = None
+        self._indexed = set()
+
+        # métricas acumuladas
+        self.archived = 0
+        self.batches = 0
+        self.runs = 0
+        self.errors = 0
+        self.last_run: Optional[str] = None
+
+    # __________________________________________________________________________________________________
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                # qualquer falha (MongoDB, documento inesperado) não encerra a tarefa
+                self.errors += 1
+                print(f"Erro no arquivamento de mensagens: {e}")
+            await asyncio.sleep(self.interval)
+
+    # __________________________________________________________________________________________________
+
+    async def run_once(self) -> int:
+        """Move em lotes tudo o que passou da idade de arquivamento; retorna o total movido."""
+        db = self.db()
+        cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(days=self.after_days))
+        moved = 0
+        while True:
+            cursor = (
+                db[HOT_COLLECTION].find({"_id": {"$lt": cutoff}})
+                .sort("_id", 1)
+                .limit(self.batch_size)
+            )
+            batch = await cursor.to_list(length=self.batch_size)
+            if not batch:
+                break
+            t0 = time.perf_counter()
+            await self._move(db, batch)
+            _ARCHIVE_SECONDS.observe(time.perf_counter() - t0)
+            moved += len(batch)
+            if len(batch) < self.batch_size:
+                break
+            # cede o banco ao tráfego ao vivo entre os lotes
+            await asyncio.sleep(self.pause)
+        self.runs += 1
+        self.last_run = datetime.now(timezone.utc).isoformat()
+        if moved:
+            await archive_tiers(db, refresh=True)
+        return moved
+
+    async def _move(self, db, batch: list):
+        """Insere o lote nas coleções do mês e remove da coleção quente."""
+        by_month = {}
+        for doc in batch:
+            by_month.setdefault(archive_name(doc["_id"]), []).append(doc)
+        for name, docs in by_month.items():
+            if name not in self._indexed:
+                await db[name].create_index([("room", 1), ("_id", -1)], name="room_1__id_-1")
+                self._indexed.add(name)
+            try:
+                await db[name].insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # duplicatas: lote anterior interrompido entre a cópia e a remoção
+                if any(err.get("code") != DUPLICATE_KEY for err in e.details.get("writeErrors", [])):
+                    raise
+        await db[HOT_COLLECTION].delete_many({"_id": {"$in": [d["_id"] for d in batch]}})
+        self.archived += len(batch)
+        self.batches += 1
+
+    # __________________________________________________________________________________________________
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ARCHIVE_ENABLED,
+            "after_days": self.after_days,
+            "archived": self.archived,
+            "batches": self.batches,
+            "runs": self.runs,
+            "errors": self.errors,
+            "last_run": self.last_run,
+            "tiers": list(_tiers),
+        }
@@ -2,19 +2,61 @@
 # Importações de módulos padrão e terceiros
 import os
 import json
+import time
 import asyncio
 from datetime import datetime
 from models import MessageIn, MessageOut
+from persistence import MessageWriter
+from pubsub import RedisSubscriber
+from ratelimit import RateLimiter, TOKEN_BUCKET
+from presence import PresenceService
+from metrics import MESSAGES_IN, REDIS_SECONDS, SEND_FAILURES, SEND_DISCONNECTS
+from database import get_db
+from keepalive import get_keepalive, IDLE_CLOSE_CODE
+from ws_manager import Connection
 
 import redis.asyncio as redis                # Cliente Redis assíncrono (Pub/Sub, presença, histórico)
-from motor.motor_asyncio import AsyncIOMotorClient  # Cliente MongoDB assíncrono
+from motor.motor_asyncio import AsyncIOMotorDatabase  # Banco MongoDB assíncrono
 from fastapi import WebSocket                # WebSocket do FastAPI
 
 # ======================================================================================================
 # Configurações via variáveis de ambiente com valores padrão
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-MONGO_DB = os.getenv("MONGO_DB", "chatdb")
+
+# Assina "chat:*" por padrão (uma assinatura) em vez de um canal por sala
+CHAT_PUBSUB_PATTERN = os.getenv("CHAT_PUBSUB_PATTERN", "false").lower() in ("1", "true", "yes")
+
+# Tempo máximo (s) para enviar uma mensagem Pub/Sub a um cliente
+CHAT_SEND_TIMEOUT = float(os.getenv("CHAT_SEND_TIMEOUT", "5"))
+
+# Mensagens aguardando envio por conexão (cheia: descarta a mais antiga)
+CHAT_SEND_QUEUE_SIZE = int(os.getenv("CHAT_SEND_QUEUE_SIZE", "256"))
+
+# Tamanho do histórico no Redis
+HISTORY_LEN = 50
+
+# Ping de aplicação enviado pelo keepalive às conexões ociosas
+PING_JSON = json.dumps({"type": "ping"})
+
+# ======================================================================================================
+# Script Lua: rate limit (token bucket), publicação e histórico em uma única ida ao Redis (atômico)
+# KEYS: bucket_key, recent_key | ARGV: capacidade, reposição/s, custo, canal, mensagem, tamanho do histórico
+SEND_SCRIPT = TOKEN_BUCKET + """
+if allowed == 0 then
+    return {0, tostring(tokens)}
+end
+redis.call('PUBLISH', ARGV[4], ARGV[5])
+redis.call('LPUSH', KEYS[2], ARGV[5])
+redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[6]) - 1)
+return {1, tostring(tokens)}
+"""
+
+# Séries das métricas do ChatManager (resolvidas uma única vez)
+_MESSAGES_IN = MESSAGES_IN.labels("chat")
+_SEND_SCRIPT_SECONDS = REDIS_SECONDS.labels("send_script")
+_HISTORY_SECONDS = REDIS_SECONDS.labels("lrange_history")
+_SEND_FAILURES = SEND_FAILURES.labels("chat_manager")
+_FAILURE_DISCONNECTS = SEND_DISCONNECTS.labels("send_failure")
 
 # ======================================================================================================
 class ChatManager:
@@ -23,74 +65,170 @@ class ChatManager:
     publicação/assinatura via Redis Pub/Sub e persistência em MongoDB.
     """
 
-    def __init__(self):
+    def __init__(self, database: AsyncIOMotorDatabase = None):
         # Cliente Redis (async) com resposta em string
         self.redis = redis.from_url(REDIS_URL, decode_responses=True)
 
-        # Cliente MongoDB async para o banco definido
-        self.mongo = AsyncIOMotorClient(MONGO_URL)[MONGO_DB]
+        # Banco MongoDB injetado (padrão: cliente compartilhado do processo, database.py)
+        self.mongo = database if database is not None else get_db()
+
+        # Gravação write-behind das mensagens no MongoDB
+        self.writer = MessageWriter(lambda: self.mongo.messages)
+
+        # Dicionário: sala -> {WebSocket: Connection} (fila de saída e tarefa escritora)
+        self.active_connections: dict[str, dict[WebSocket, Connection]] = {}
+
+        # Mensagens descartadas por fila de saída cheia
+        self.dropped = 0
+
+        # Assinante Pub/Sub único do processo (salas por contagem de referência)
+        self.subscriber = RedisSubscriber(self.redis, self.dispatch, pattern=CHAT_PUBSUB_PATTERN)
+
+        # Script de envio registrado (EVALSHA, com fallback automático para EVAL)
+        self.send_script = self.redis.register_script(SEND_SCRIPT)
 
-        # Dicionário: sala -> conjunto de conexões WebSocket ativas
-        self.active_connections: dict[str, set[WebSocket]] = {}
+        # Parâmetros do token bucket (o saldo fica no Redis: o script de envio é quem decide)
+        self.limiter = RateLimiter()
+
+        # Presença por conexão (sorted set por último heartbeat, gravado em lote)
+        self.presence = PresenceService(self.redis)
+
+        # Pings e recolhimento de conexões ociosas (agendador compartilhado do processo)
+        self.keepalive = get_keepalive()
+
+    # __________________________________________________________________________________________________
+
+    async def close(self):
+        """Grava as mensagens e a presença pendentes e encerra o assinante Pub/Sub."""
+        await self.keepalive.stop()
+        await self.writer.stop()
+        await self.presence.stop()
+        await self.subscriber.close()
+
+    # __________________________________________________________________________________________________
+
+    @staticmethod
+    def member(websocket: WebSocket) -> str:
+        """Identifica a conexão na presença (IP do cliente + conexão)."""
+        return PresenceService.member(websocket.client.host, f"{id(websocket):x}")
 
     # __________________________________________________________________________________________________
 
     async def connect(self, websocket: WebSocket, room: str):
         """
-        Aceita conexão WebSocket, registra na sala, marca usuário online,
-        envia histórico e inicia escuta Pub/Sub para o cliente.
+        Aceita conexão WebSocket, registra na sala, marca a conexão online,
+        envia histórico e assina a sala no Pub/Sub compartilhado.
         """
         await websocket.accept()
 
-        # Adiciona conexão ativa para a sala
-        self.active_connections.setdefault(room, set()).add(websocket)
+        # Adiciona conexão ativa para a sala (mensagens do Pub/Sub vão para a fila de saída)
+        conn = Connection(websocket, room, CHAT_SEND_QUEUE_SIZE)
+        self.active_connections.setdefault(room, {})[websocket] = conn
 
-        # Marca usuário online no Redis (set com expiração)
-        user_id = websocket.client.host
-        online_key = f"chat:{room}:online"
-        await self.redis.sadd(online_key, user_id)
-        await self.redis.expire(online_key, 60)
+        # Registra a conexão no assinante Pub/Sub do processo
+        await self.subscriber.subscribe(room)
+
+        # Marca a conexão online (gravada no próximo lote da presença)
+        self.presence.join(room, self.member(websocket))
+
+        # Acompanha a conexão no keepalive (ping quando ociosa, recolhida se não responder)
+        self.keepalive.register(
+            websocket,
+            lambda: self.ping(websocket, room),
+            lambda: self.reap(websocket, room),
+        )
+
+        # Lê o histórico recente (até 50 mensagens)
+        t0 = time.perf_counter()
+        history = await self.redis.lrange(f"chat:{room}:recent", 0, HISTORY_LEN - 1)
+        _HISTORY_SECONDS.observe(time.perf_counter() - t0)
 
-        # Envia histórico recente (até 50 mensagens)
-        recent_key = f"chat:{room}:recent"
-        history = await self.redis.lrange(recent_key, 0, 49)
+        # Envia histórico recente
         for msg_json in reversed(history):
             await websocket.send_text(msg_json)
 
-        # Inicia tarefa para escutar mensagens Pub/Sub e enviar ao cliente
-        asyncio.create_task(self.listen_pubsub(room, websocket))
+        # Só então a tarefa escritora envia o que chegou do Pub/Sub (após o histórico)
+        if self.active_connections.get(room, {}).get(websocket) is conn:
+            conn.task = asyncio.create_task(self._writer(conn))
 
     # __________________________________________________________________________________________________
 
     async def disconnect(self, websocket: WebSocket, room: str):
         """
-        Remove conexão ativa e marca usuário offline no Redis.
+        Remove conexão ativa, libera a assinatura da sala e marca a conexão offline.
         """
-        if room in self.active_connections:
-            self.active_connections[room].discard(websocket)
+        self.keepalive.unregister(websocket)
+        conns = self.active_connections.get(room)
+        if conns is not None and websocket in conns:
+            conn = conns.pop(websocket)
+            if not conns:
+                self.active_connections.pop(room, None)
+            if conn.task is not None and conn.task is not asyncio.current_task():
+                conn.task.cancel()
+            await self.subscriber.unsubscribe(room)
 
-        user_id = websocket.client.host
-        online_key = f"chat:{room}:online"
-        await self.redis.srem(online_key, user_id)
+        self.presence.leave(room, self.member(websocket))
+
+    # __________________________________________________________________________________________________
+
+    async def ping(self, websocket: WebSocket, room: str):
+        """
+        Ping do keepalive pela fila de saída (sem envio concorrente ao da
+        tarefa escritora). Falha se a conexão já saiu da sala ou se um envio
+        está parado há mais de CHAT_SEND_TIMEOUT.
+        """
+        conn = self.active_connections.get(room, {}).get(websocket)
+        if conn is None or (conn.task is not None and conn.task.done()):
+            raise ConnectionError("Conexão encerrada")
+        if conn.sending_since is not None and time.monotonic() - conn.sending_since > CHAT_SEND_TIMEOUT:
+            raise TimeoutError("Envio parado")
+        self._enqueue(conn, PING_JSON)
+
+    # __________________________________________________________________________________________________
+
+    async def reap(self, websocket: WebSocket, room: str):
+        """Recolhe uma conexão sem resposta ao ping: desconecta e fecha o socket."""
+        await self.disconnect(websocket, room)
+        try:
+            await websocket.close(code=IDLE_CLOSE_CODE)
+        except Exception:
+            pass
+
+    # __________________________________________________________________________________________________
+
+    async def publish(self, room: str, user_id: str, msg_json: str) -> bool:
+        """
+        Aplica o rate limit, publica no canal da sala e atualiza o histórico
+        no Redis em uma única chamada. Retorna False se o limite foi excedido.
+        """
+        bucket_key = f"chat:{room}:bucket:{user_id}"
+        t0 = time.perf_counter()
+        allowed, tokens = await self.send_script(
+            keys=[bucket_key, f"chat:{room}:recent"],
+            args=[
+                self.limiter.capacity, self.limiter.refill, 1,
+                f"chat:{room}", msg_json, HISTORY_LEN,
+            ],
+        )
+        _SEND_SCRIPT_SECONDS.observe(time.perf_counter() - t0)
+        return bool(int(allowed))
 
     # __________________________________________________________________________________________________
 
     async def handle_message(self, room: str, data: dict, websocket: WebSocket):
         """
         Processa mensagem recebida:
-        - Aplica rate limit
-        - Publica no canal Redis
-        - Salva histórico no Redis
+        - Aplica rate limit, publica no canal Redis e salva histórico (um script Lua)
         - Persiste no MongoDB
         """
         user_id = websocket.client.host
-        rate_key = f"chat:{room}:rate:{user_id}"
 
-        # Rate limiting simples: max 5 mensagens a cada 10 segundos
-        if await self.redis.incr(rate_key) > 5:
-            await websocket.send_text("Rate limit exceeded")
+        # Toda mensagem recebida conta como heartbeat da conexão (presença e keepalive)
+        self.presence.heartbeat(room, self.member(websocket))
+        self.keepalive.touch(websocket)
+        if data.get("type") in ("ping", "pong"):
             return
-        await self.redis.expire(rate_key, 10)
+        _MESSAGES_IN.value += 1
 
         msg = {
             "user": user_id,
@@ -100,34 +238,51 @@ class ChatManager:
 
         msg_json = json.dumps(msg)
 
-        # Publica mensagem no canal Pub/Sub do Redis
-        await self.redis.publish(f"chat:{room}", msg_json)
-
-        # Atualiza histórico no Redis (lista limitada a 50)
-        recent_key = f"chat:{room}:recent"
-        await self.redis.lpush(recent_key, msg_json)
-        await self.redis.ltrim(recent_key, 0, 49)
+        # Rate limit (token bucket), Pub/Sub e histórico
+        if not await self.publish(room, user_id, msg_json):
+            await websocket.send_text("Rate limit exceeded")
+            return
 
-        # Persiste mensagem no MongoDB
-        await self.mongo.messages.insert_one({"room": room, **msg})
+        # Persiste mensagem no MongoDB (em lote, sem aguardar a gravação)
+        await self.writer.submit({"room": room, **msg})
 
     # __________________________________________________________________________________________________
 
-    async def listen_pubsub(self, room: str, websocket: WebSocket):
+    async def dispatch(self, room: str, data: str):
         """
-        Escuta mensagens no canal Pub/Sub do Redis e envia ao cliente via WebSocket.
+        Entrega uma mensagem recebida do Pub/Sub às conexões locais da sala.
+        Apenas enfileira (sem aguardar sockets): um cliente lento não atrasa
+        o assinante compartilhado nem as demais salas do processo.
         """
-        pubsub = self.redis.pubsub()
-        await pubsub.subscribe(f"chat:{room}")
+        for conn in list(self.active_connections.get(room, {}).values()):
+            self._enqueue(conn, data)
 
+    def _enqueue(self, conn: Connection, data: str):
+        try:
+            conn.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # cliente lento: descarta a mensagem mais antiga da fila
+            conn.queue.get_nowait()
+            conn.queue.put_nowait(data)
+            conn.dropped += 1
+            self.dropped += 1
+
+    # __________________________________________________________________________________________________
+
+    async def _writer(self, conn: Connection):
+        """
+        Envia ao cliente as mensagens da fila da conexão; em falha ou após
+        CHAT_SEND_TIMEOUT, remove a conexão da sala.
+        """
         try:
             while True:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-                if message and "data" in message:
-                    await websocket.send_text(message["data"])
-                await asyncio.sleep(0.01)  # Pequena pausa para evitar uso excessivo da CPU
-        except Exception as e:
-            print(f"Erro no listen_pubsub: {e}")
-        finally:
-            await pubsub.unsubscribe(f"chat:{room}")
-            await pubsub.close()
\ No newline at end of file
+                data = await conn.queue.get()
+                conn.sending_since = time.monotonic()
+                await asyncio.wait_for(conn.ws.send_text(data), CHAT_SEND_TIMEOUT)
+                conn.sending_since = None
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            _SEND_FAILURES.value += 1
+            _FAILURE_DISCONNECTS.value += 1
+            await self.disconnect(conn.ws, conn.room)
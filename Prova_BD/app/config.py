@@ -9,5 +9,181 @@ from models import MessageIn, MessageOut
 # URL de conexão com o MongoDB (padrão: localhost)
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 
-# Nome do banco de dados MongoDB (padrão: chat_db)
-MONGO_DB = os.getenv("MONGO_DB", "chat_db")
\ No newline at end of file
+# Nome do banco de dados MongoDB (padrão: chatdb, o mesmo usado pelo app e pelo ChatManager)
+MONGO_DB = os.getenv("MONGO_DB", "chatdb")
+
+# Pool de conexões do cliente compartilhado: tamanho máximo/mínimo, ociosidade (ms),
+# timeouts (ms) de seleção de servidor, conexão, socket e espera por conexão livre
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", "300000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+
+# Compressão do protocolo, em ordem de preferência (usadas só as disponíveis no ambiente)
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib")
+
+# ______________________________________________________________________________________________________
+
+# Tamanho máximo da fila de saída de cada conexão WebSocket
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+
+# Política para cliente lento com fila cheia: drop_oldest | coalesce | disconnect
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+
+# ______________________________________________________________________________________________________
+
+# Gravação write-behind de mensagens: tamanho do lote, intervalo máximo (ms),
+# limite de mensagens pendentes (backpressure) e tentativas por lote
+MONGO_WRITE_BATCH_SIZE = int(os.getenv("MONGO_WRITE_BATCH_SIZE", "500"))
+MONGO_WRITE_FLUSH_MS = int(os.getenv("MONGO_WRITE_FLUSH_MS", "50"))
+MONGO_WRITE_MAX_PENDING = int(os.getenv("MONGO_WRITE_MAX_PENDING", "10000"))
+MONGO_WRITE_MAX_RETRIES = int(os.getenv("MONGO_WRITE_MAX_RETRIES", "5"))
+
+# ______________________________________________________________________________________________________
+
+# URL de conexão com o Redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Backend de fan-out do WebSocket: inprocess | pubsub | streams
+FANOUT_BACKEND = os.getenv("FANOUT_BACKEND", "inprocess")
+
+# Identificador do worker (grupo de consumo no modo streams); deve ser único por processo
+# e estável entre reinícios para o worker retomar o stream de onde parou
+FANOUT_WORKER_ID = os.getenv("FANOUT_WORKER_ID", "")
+
+# Tamanho aproximado máximo de cada stream de sala e bloqueio (ms) do XREADGROUP
+FANOUT_STREAM_MAXLEN = int(os.getenv("FANOUT_STREAM_MAXLEN", "10000"))
+FANOUT_STREAM_BLOCK_MS = int(os.getenv("FANOUT_STREAM_BLOCK_MS", "200"))
+
+# ______________________________________________________________________________________________________
+
+# Cria os índices na inicialização e, se exigido, falha quando algum estiver ausente
+MONGO_CREATE_INDEXES = os.getenv("MONGO_CREATE_INDEXES", "true").lower() in ("1", "true", "yes")
+MONGO_REQUIRE_INDEXES = os.getenv("MONGO_REQUIRE_INDEXES", "false").lower() in ("1", "true", "yes")
+
+# ______________________________________________________________________________________________________
+
+# Cache de histórico recente: mensagens por sala, máximo de salas, TTL (s) de sala ociosa
+# e espelhamento opcional no Redis
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "50"))
+HISTORY_CACHE_ROOMS = int(os.getenv("HISTORY_CACHE_ROOMS", "1000"))
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", "300"))
+HISTORY_CACHE_REDIS = os.getenv("HISTORY_CACHE_REDIS", "false").lower() in ("1", "true", "yes")
+
+# ______________________________________________________________________________________________________
+
+# Rate limit por remetente (token bucket): backend local | redis, capacidade (rajada),
+# reposição em fichas por segundo e máximo de baldes locais em memória
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+RATE_LIMIT_CAPACITY = float(os.getenv("RATE_LIMIT_CAPACITY", "5"))
+RATE_LIMIT_REFILL = float(os.getenv("RATE_LIMIT_REFILL", "0.5"))
+RATE_LIMIT_LOCAL_KEYS = int(os.getenv("RATE_LIMIT_LOCAL_KEYS", "100000"))
+
+# ______________________________________________________________________________________________________
+
+# Tamanho máximo de página do histórico REST e parâmetros da exportação NDJSON
+# (documentos por lote do cursor e bytes por bloco enviado)
+HISTORY_MAX_PAGE = int(os.getenv("HISTORY_MAX_PAGE", "500"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+
+# ______________________________________________________________________________________________________
+
+# Presença por conexão: backend local | redis, tempo (s) sem heartbeat até a conexão
+# ser considerada offline, intervalo (s) de gravação em lote e validade (s) do cache de consultas
+PRESENCE_BACKEND = os.getenv("PRESENCE_BACKEND", "local")
+PRESENCE_TTL = float(os.getenv("PRESENCE_TTL", "60"))
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "5"))
+PRESENCE_CACHE_TTL = float(os.getenv("PRESENCE_CACHE_TTL", "2"))
+
+# ______________________________________________________________________________________________________
+
+# Intervalo (s) da medição do atraso do loop de eventos exposta em /metrics
+METRICS_LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+
+# ______________________________________________________________________________________________________
+
+# permessage-deflate (servidor iniciado com --ws ws_protocol:ChatWebSocketProtocol):
+# negotiated (só clientes que pedem via subprotocolo/query) | always | off,
+# nível de compressão, memLevel do zlib, janela (bits) e reinício do contexto a cada mensagem
+WS_DEFLATE = os.getenv("WS_DEFLATE", "negotiated")
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", "5"))
+WS_DEFLATE_WINDOW_BITS = int(os.getenv("WS_DEFLATE_WINDOW_BITS", "12"))
+WS_DEFLATE_NO_CONTEXT_TAKEOVER = os.getenv("WS_DEFLATE_NO_CONTEXT_TAKEOVER", "false").lower() in ("1", "true", "yes")
+
+# ______________________________________________________________________________________________________
+
+# Agrupamento adaptativo de mensagens por sala: liga/desliga, taxa (mensagens/s) a partir da
+# qual a janela é ativada, limites da janela (ms), mensagens alvo por lote e máximo por lote
+WS_BATCH = os.getenv("WS_BATCH", "false").lower() in ("1", "true", "yes")
+WS_BATCH_THRESHOLD = float(os.getenv("WS_BATCH_THRESHOLD", "50"))
+WS_BATCH_MIN_MS = float(os.getenv("WS_BATCH_MIN_MS", "10"))
+WS_BATCH_MAX_MS = float(os.getenv("WS_BATCH_MAX_MS", "50"))
+WS_BATCH_TARGET = int(os.getenv("WS_BATCH_TARGET", "10"))
+WS_BATCH_MAX_ITEMS = int(os.getenv("WS_BATCH_MAX_ITEMS", "200"))
+
+# ______________________________________________________________________________________________________
+
+# Registro de salas: invalidação do cache entre workers via Redis, validade (s) do cache de
+# sala inexistente, iterações do PBKDF2 das senhas, exigência de sala registrada no WebSocket
+# (desligada por padrão: clientes existentes entram em qualquer sala) e salas públicas
+# criadas na inicialização (separadas por vírgula)
+ROOM_CACHE_REDIS = os.getenv("ROOM_CACHE_REDIS", "false").lower() in ("1", "true", "yes")
+ROOM_NEGATIVE_TTL = float(os.getenv("ROOM_NEGATIVE_TTL", "5"))
+ROOM_PASSWORD_ITERATIONS = int(os.getenv("ROOM_PASSWORD_ITERATIONS", "200000"))
+# Validade (s) de uma senha já verificada por sala (evita refazer o PBKDF2 a cada reconexão)
+ROOM_AUTH_CACHE_TTL = float(os.getenv("ROOM_AUTH_CACHE_TTL", "300"))
+ROOMS_ENFORCE = os.getenv("ROOMS_ENFORCE", "false").lower() in ("1", "true", "yes")
+ROOMS_DEFAULT = os.getenv("ROOMS_DEFAULT", "sala1")
+
+# ______________________________________________________________________________________________________
+
+# Busca textual: idioma do índice de texto do MongoDB, índice invertido em memória para as
+# salas buscadas (liga/desliga, salas mantidas e mensagens por sala), tempo máximo de cada
+# consulta (ms) e tamanho máximo da página
+SEARCH_LANGUAGE = os.getenv("SEARCH_LANGUAGE", "portuguese")
+SEARCH_INDEX = os.getenv("SEARCH_INDEX", "false").lower() in ("1", "true", "yes")
+SEARCH_INDEX_ROOMS = int(os.getenv("SEARCH_INDEX_ROOMS", "100"))
+SEARCH_INDEX_SIZE = int(os.getenv("SEARCH_INDEX_SIZE", "5000"))
+SEARCH_MAX_TIME_MS = int(os.getenv("SEARCH_MAX_TIME_MS", "500"))
+SEARCH_MAX_PAGE = int(os.getenv("SEARCH_MAX_PAGE", "50"))
+
+# ______________________________________________________________________________________________________
+
+# Ingestão em massa (POST /rooms/{room}/messages/bulk): mensagens por insert_many/broadcast,
+# máximo de itens por requisição, tamanho máximo (bytes) do corpo em array JSON e de cada linha NDJSON
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(16 * 1024 * 1024)))
+BULK_MAX_LINE_BYTES = int(os.getenv("BULK_MAX_LINE_BYTES", str(64 * 1024)))
+
+# ______________________________________________________________________________________________________
+
+# Reconexão do WebSocket com `last_id`: máximo de mensagens reenviadas (acima disso o cliente
+# recebe as mais recentes com `complete: false`)
+WS_REPLAY_MAX = int(os.getenv("WS_REPLAY_MAX", "500"))
+
+# ______________________________________________________________________________________________________
+
+# Arquivamento: liga/desliga (ative em um único worker), idade (dias) a partir da qual as
+# mensagens vão para as coleções mensais, intervalo entre execuções (s), mensagens por lote
+# e pausa entre lotes (ms)
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() in ("1", "true", "yes")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_PAUSE_MS = int(os.getenv("ARCHIVE_PAUSE_MS", "50"))
+
+# ______________________________________________________________________________________________________
+
+# Keepalive das conexões WebSocket: liga/desliga, segundos sem nenhum frame do cliente até o
+# ping de aplicação, prazo (s) para qualquer resposta antes de recolher a conexão e
+# intervalo (s) entre as verificações do agendador
+WS_KEEPALIVE = os.getenv("WS_KEEPALIVE", "true").lower() in ("1", "true", "yes")
+WS_KEEPALIVE_INTERVAL = float(os.getenv("WS_KEEPALIVE_INTERVAL", "30"))
+WS_KEEPALIVE_TIMEOUT = float(os.getenv("WS_KEEPALIVE_TIMEOUT", "15"))
+WS_KEEPALIVE_TICK = float(os.getenv("WS_KEEPALIVE_TICK", "1"))
@@ -1,29 +1,147 @@
 """
 Conexão com MongoDB e funções auxiliares.
+
+Um único `AsyncIOMotorClient` por processo, compartilhado pelo app (REST e
+WebSocket), pelas rotas e pelo `ChatManager`. O pool, os timeouts e a
+compressão vêm do ambiente; `start` aquece o pool na inicialização (ping e
+primeira consulta) e `close` grava o que estiver pendente e fecha o cliente.
 """
-from motor.motor_asyncio import AsyncIOMotorClient
-from config import MONGO_URL, MONGO_DB
+import asyncio
+import importlib.util
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from config import (
+    MONGO_URL,
+    MONGO_DB,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_MAX_IDLE_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    MONGO_COMPRESSORS,
+)
 from models import MessageIn, MessageOut
+from persistence import MessageWriter
+from archive import HOT_COLLECTION, find_tiered
+
+# ______________________________________________________________________________________________________
+
+# Módulo Python exigido por cada compressor (zlib faz parte da biblioteca padrão)
+_COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": None}
+
+def available_compressors(names: str = MONGO_COMPRESSORS) -> list:
+    """Compressores pedidos cujo módulo está instalado, na ordem de preferência."""
+    result = []
+    for name in (n.strip() for n in names.split(",")):
+        if name not in _COMPRESSOR_MODULES:
+            continue
+        module = _COMPRESSOR_MODULES[name]
+        if module is None or importlib.util.find_spec(module) is not None:
+            result.append(name)
+    return result
+
+# ______________________________________________________________________________________________________
+
+class Mongo:
+    """Cliente MongoDB compartilhado do processo."""
+
+    def __init__(self, url: str = MONGO_URL, name: str = MONGO_DB):
+        self.url = url
+        self.name = name
+        self.client: Optional[AsyncIOMotorClient] = None
+
+    # __________________________________________________________________________________________________
+
+    def connect(self) -> AsyncIOMotorClient:
+        """Cria o cliente (uma única vez) com as opções de pool do ambiente."""
+        if self.client is None:
+            options = dict(
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            )
+            compressors = available_compressors()
+            if compressors:
+                options["compressors"] = ",".join(compressors)
+            self.client = AsyncIOMotorClient(self.url, **options)
+        return self.client
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        """Banco da aplicação (conecta sob demanda se `start` não foi chamado)."""
+        return self.connect()[self.name]
+
+    # __________________________________________________________________________________________________
+
+    async def start(self):
+        """
+        Conecta e aquece o pool: pings concorrentes abrem até `minPoolSize`
+        conexões e uma leitura no histórico carrega a coleção e o índice,
+        tirando esse custo do primeiro WebSocket após o deploy.
+        """
+        self.connect()
+        warm = max(1, min(MONGO_MIN_POOL_SIZE, MONGO_MAX_POOL_SIZE))
+        await asyncio.gather(*(self.client.admin.command("ping") for _ in range(warm)))
+        await self.db["messages"].find_one({}, sort=[("_id", -1)])
+
+    async def close(self):
+        """Grava o que estiver pendente nos gravadores e fecha o cliente."""
+        await close_writers()
+        if self.client is not None:
+            self.client.close()
+            self.client = None
 
 # ______________________________________________________________________________________________________
 
-# Cliente MongoDB assíncrono
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[MONGO_DB]
+# Instância compartilhada do processo
+mongo = Mongo()
+
+def get_db() -> AsyncIOMotorDatabase:
+    """Dependência do FastAPI: banco de dados compartilhado."""
+    return mongo.db
+
+# ______________________________________________________________________________________________________
+
+# Gravadores write-behind por coleção
+_writers: dict = {}
+
+def get_writer(collection: str) -> MessageWriter:
+    """Retorna (criando se necessário) o gravador em lote da coleção."""
+    if collection not in _writers:
+        _writers[collection] = MessageWriter(lambda: mongo.db[collection])
+    return _writers[collection]
+
+async def close_writers():
+    """Grava as mensagens pendentes de todas as coleções."""
+    for writer in _writers.values():
+        await writer.stop()
 
 # ______________________________________________________________________________________________________
 
 async def save_message(collection: str, message: dict):
-    """Salva uma mensagem no MongoDB."""
+    """
+    Salva uma mensagem no MongoDB (write-behind).
+    O `_id` é gerado localmente e retornado antes da gravação em lote.
+    """
     if not message.get("content"):
         raise ValueError("Mensagem não pode ser vazia")
-    result = await db[collection].insert_one(message)
-    return result.inserted_id
+    doc = await get_writer(collection).submit(message)
+    return doc["_id"]
 
 # ______________________________________________________________________________________________________
 
 async def get_messages(collection: str, limit: int = 50, before_id: str = None):
-    """Recupera mensagens do MongoDB com limite e filtro opcional."""
+    """
+    Recupera mensagens do MongoDB com limite e filtro opcional.
+    Em `messages`, continua pelas coleções de arquivo quando a página passa da coleção quente.
+    """
     query = {}
     if before_id:
         from bson import ObjectId
@@ -31,5 +149,7 @@ async def get_messages(collection: str, limit: int = 50, before_id: str = None):
             query["_id"] = {"$lt": ObjectId(before_id)}
         except Exception:
             raise ValueError("ID inválido")
-    cursor = db[collection].find(query).sort("_id", -1).limit(limit)
-    return await cursor.to_list(length=limit)
\ No newline at end of file
+    if collection == HOT_COLLECTION:
+        return await find_tiered(mongo.db, query, -1, limit)
+    cursor = mongo.db[collection].find(query).sort("_id", -1).limit(limit)
+    return await cursor.to_list(length=limit)
@@ -0,0 +1,301 @@
+"""
+Backends de fan-out para o WebSocket de `main.py`.
+
+- inprocess: entrega apenas às conexões do próprio processo;
+- pubsub: publica no Redis Pub/Sub e cada worker entrega às suas conexões;
+- streams: publica em um Redis Stream por sala e cada worker lê com seu
+  próprio grupo de consumo, retomando do último ID confirmado após perda
+  de conexão com o Redis ou reinício do worker (FANOUT_WORKER_ID estável).
+"""
+import asyncio
+import os
+import socket
+from typing import Dict, Optional, Set
+
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+from config import (
+    REDIS_URL,
+    FANOUT_BACKEND,
+    FANOUT_WORKER_ID,
+    FANOUT_STREAM_MAXLEN,
+    FANOUT_STREAM_BLOCK_MS,
+)
+from frames import Frame, encode_frame
+from pubsub import RedisSubscriber
+from ws_manager import WSManager
+
+# ______________________________________________________________________________________________________
+
+FANOUT_BACKENDS = ("inprocess", "pubsub", "streams")
+
+# Prefixo dos canais/streams usados pelo fan-out (separado do "chat:" do ChatManager)
+CHANNEL_PREFIX = "ws:"
+
+# ______________________________________________________________________________________________________
+
+def worker_id() -> str:
+    """Identificador único do processo (host:pid), salvo se definido no ambiente."""
+    return FANOUT_WORKER_ID or f"{socket.gethostname()}:{os.getpid()}"
+
+def stable_worker_id() -> bool:
+    """Indica se o identificador sobrevive a reinícios (definido em FANOUT_WORKER_ID)."""
+    return bool(FANOUT_WORKER_ID)
+
+# ______________________________________________________________________________________________________
+
+class InProcessFanout:
+    """Fan-out local: publicar equivale a enfileirar nas conexões da sala."""
+
+    def __init__(self, manager: WSManager):
+        self.manager = manager
+        # Funções chamadas com (room, frame) para cada frame entregue neste processo
+        self.listeners: list = []
+
+    def add_listener(self, fn):
+        """Registra uma função chamada a cada frame entregue localmente."""
+        self.listeners.append(fn)
+
+    async def _deliver_local(self, room: str, frame: Frame):
+        """Notifica os ouvintes e enfileira o frame nas conexões locais da sala."""
+        for fn in self.listeners:
+            fn(room, frame)
+        await self.manager.broadcast(room, frame)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def join(self, room: str):
+        pass
+
+    async def leave(self, room: str):
+        pass
+
+    def subscribed(self, room: str) -> bool:
+        """Indica se as mensagens da sala chegam a este processo (todas, no modo local)."""
+        return True
+
+    async def publish(self, room: str, payload):
+        await self._deliver_local(room, encode_frame(payload))
+
+# ______________________________________________________________________________________________________
+
+class RedisPubSubFanout(InProcessFanout):
+    """
+    Fan-out via Redis Pub/Sub: o frame é codificado uma vez, publicado em
+    `ws:{room}` e repassado sem recodificação às conexões locais de cada worker.
+    """
+
+    def __init__(self, manager: WSManager, client: redis.Redis):
+        super().__init__(manager)
+        self.redis = client
+        self.subscriber = RedisSubscriber(client, self._deliver, prefix=CHANNEL_PREFIX)
+
+    async def _deliver(self, room: str, data: str):
+        await self._deliver_local(room, Frame.from_text(data))
+
+    async def stop(self):
+        await self.subscriber.close()
+
+    async def join(self, room: str):
+        await self.subscriber.subscribe(room)
+
+    async def leave(self, room: str):
+        await self.subscriber.unsubscribe(room)
+
+    def subscribed(self, room: str) -> bool:
+        return room in self.subscriber.refs
+
+    async def publish(self, room: str, payload):
+        await self.redis.publish(f"{CHANNEL_PREFIX}{room}", encode_frame(payload).text)
+
+# ______________________________________________________________________________________________________
+
+class RedisStreamsFanout(InProcessFanout):
+    """
+    Fan-out via Redis Streams com um grupo de consumo por worker.
+
+    Cada sala é o stream `ws:stream:{room}` (limitado por MAXLEN aproximado).
+    O worker lê com XREADGROUP e confirma com XACK após entregar localmente;
+    se a conexão com o Redis cair, relê primeiro as mensagens pendentes
+    ("0") e depois continua a partir do último ID entregue ao grupo (">").
+
+    O grupo tem o nome do worker (FANOUT_WORKER_ID) e só é criado no fim do
+    stream ("$") quando ainda não existe: um worker reiniciado com o mesmo
+    identificador continua de onde parou. Sem FANOUT_WORKER_ID o grupo é
+    do processo (host:pid), não pode ser retomado e é removido no stop().
+    """
+
+    def __init__(
+        self,
+        manager: WSManager,
+        client: redis.Redis,
+        maxlen: int = FANOUT_STREAM_MAXLEN,
+        block_ms: int = FANOUT_STREAM_BLOCK_MS,
+    ):
+        super().__init__(manager)
+        self.redis = client
+        self.maxlen = maxlen
+        self.block_ms = block_ms
+        self.consumer = worker_id()
+        self.group = f"{CHANNEL_PREFIX}{self.consumer}"
+        self.durable = stable_worker_id()
+        self.refs: Dict[str, int] = {}
+        # salas com grupo criado, lidas pelo XREADGROUP
+        self.active: Set[str] = set()
+        self._joined = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    # __________________________________________________________________________________________________
+
+    @staticmethod
+    def _stream(room: str) -> str:
+        return f"{CHANNEL_PREFIX}stream:{room}"
+
+    # __________________________________________________________________________________________________
+
+    async def _ensure_group(self, room: str):
+        """
+        Cria o grupo do worker no fim do stream da sala, se ainda não existir;
+        um grupo existente mantém a posição (retomada após reinício).
+        """
+        try:
+            await self.redis.xgroup_create(self._stream(room), self.group, id="$", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    # __________________________________________________________________________________________________
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if not self.durable:
+            # grupo de host:pid: nenhum processo futuro o retomará
+            for room in list(self.active):
+                try:
+                    await self.redis.xgroup_destroy(self._stream(room), self.group)
+                except Exception:
+                    pass
+        self.refs.clear()
+        self.active.clear()
+
+    # __________________________________________________________________________________________________
+
+    async def join(self, room: str):
+        self.refs[room] = self.refs.get(room, 0) + 1
+        if self.refs[room] > 1:
+            return
+        try:
+            await self._ensure_group(room)
+        except Exception:
+            await self.leave(room)
+            raise
+        # a sala só entra na leitura com o grupo criado (evita NOGROUP no XREADGROUP)
+        if room in self.refs:
+            self.active.add(room)
+            self._joined.set()
+
+    async def leave(self, room: str):
+        count = self.refs.get(room, 0) - 1
+        if count > 0:
+            self.refs[room] = count
+        else:
+            self.refs.pop(room, None)
+            self.active.discard(room)
+
+    def subscribed(self, room: str) -> bool:
+        return room in self.active
+
+    # __________________________________________________________________________________________________
+
+    async def publish(self, room: str, payload):
+        await self.redis.xadd(
+            self._stream(room),
+            {"d": encode_frame(payload).text},
+            maxlen=self.maxlen,
+            approximate=True,
+        )
+
+    # __________________________________________________________________________________________________
+
+    async def _read(self, start_id: str) -> int:
+        """
+        Lê um lote dos streams das salas locais, entrega e confirma.
+        Retorna o número de entradas lidas.
+        """
+        if not self.active:
+            self._joined.clear()
+            await self._joined.wait()
+            return 0
+        streams = {self._stream(room): start_id for room in self.active}
+        block = self.block_ms if start_id == ">" else None
+        response = await self.redis.xreadgroup(
+            self.group, self.consumer, streams, count=500, block=block
+        )
+        read = 0
+        for stream, entries in response or []:
+            room = stream[len(CHANNEL_PREFIX) + len("stream:"):]
+            ids = []
+            for entry_id, fields in entries:
+                ids.append(entry_id)
+                if fields and room in self.active:
+                    await self._deliver_local(room, Frame.from_text(fields["d"]))
+            if ids:
+                await self.redis.xack(stream, self.group, *ids)
+                read += len(ids)
+        return read
+
+    # __________________________________________________________________________________________________
+
+    async def _run(self):
+        """Loop de leitura; após erro, recupera pendentes antes de voltar a ">"."""
+        catch_up = True
+        while not self._closing:
+            try:
+                if catch_up:
+                    # Relê o que foi entregue a este consumidor mas não confirmado
+                    while await self._read("0"):
+                        pass
+                    catch_up = False
+                await self._read(">")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Erro no fan-out via Redis Streams: {e}")
+                catch_up = True
+                await asyncio.sleep(1.0)
+                try:
+                    for room in list(self.active):
+                        await self._ensure_group(room)
+                except Exception:
+                    pass
+
+# ______________________________________________________________________________________________________
+
+def create_fanout(manager: WSManager, backend: str = FANOUT_BACKEND, redis_url: str = REDIS_URL):
+    """Cria o backend de fan-out configurado."""
+    if backend not in FANOUT_BACKENDS:
+        raise ValueError(f"Backend de fan-out inválido: {backend}")
+    if backend == "inprocess":
+        return InProcessFanout(manager)
+    client = redis.from_url(redis_url, decode_responses=True)
+    if backend == "pubsub":
+        return RedisPubSubFanout(manager, client)
+    return RedisStreamsFanout(manager, client)
@@ -0,0 +1,215 @@
+"""
+Codificação de frames WebSocket: o payload é serializado uma única vez
+e o mesmo texto é reutilizado para todos os destinatários.
+
+Dois codecs, escolhidos por conexão (`negotiate`):
+- json (padrão, usado pelo static/chat.js): frames de texto;
+- msgpack: frames binários MessagePack com chaves curtas (COMPACT_KEYS),
+  `_id` em 12 bytes, `created_at` em milissegundos desde a época e sem o
+  campo `room` (implícito na conexão).
+Objetos `PreEncoded` (message.Message) trazem as próprias codificações,
+que são embutidas nos frames sem nova serialização.
+A compressão permessage-deflate é negociada no handshake (ws_protocol.py).
+"""
+import json
+from datetime import datetime
+from urllib.parse import parse_qs
+
+try:
+    import orjson  # Encoder JSON rápido (opcional)
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack  # Codec binário (opcional; sem ele só JSON é oferecido)
+except ImportError:
+    msgpack = None
+
+# ______________________________________________________________________________________________________
+
+# Subprotocolos aceitos -> (codec, deflate)
+SUBPROTOCOLS = {
+    "chat.v1.json": ("json", False),
+    "chat.v1.json+deflate": ("json", True),
+    "chat.v1.msgpack": ("msgpack", False),
+    "chat.v1.msgpack+deflate": ("msgpack", True),
+}
+
+# Chaves longas -> curtas no codec msgpack
+COMPACT_KEYS = {
+    "type": "t",
+    "items": "i",
+    "item": "m",
+    "detail": "d",
+    "username": "u",
+    "content": "c",
+    "avatar": "a",
+    "_id": "id",
+    "created_at": "ts",
+}
+EXPANDED_KEYS = {v: k for k, v in COMPACT_KEYS.items()}
+
+# ______________________________________________________________________________________________________
+
+class PreEncoded:
+    """Objeto que guarda as próprias codificações (`json` em texto e `packed` em msgpack compacto)."""
+    __slots__ = ()
+
+def _embeds(obj) -> bool:
+    """Indica se um dict/lista contém objetos PreEncoded (no primeiro nível ou em listas)."""
+    values = obj.values() if isinstance(obj, dict) else obj
+    for v in values:
+        if isinstance(v, PreEncoded):
+            return True
+        if isinstance(v, list) and any(isinstance(i, PreEncoded) for i in v):
+            return True
+    return False
+
+def _dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+def dumps(obj) -> str:
+    """
+    Serializa para JSON usando orjson quando disponível. Objetos PreEncoded
+    entram com o JSON já gerado (ex.: {"type": "history", "items": [Message, ...]}).
+    """
+    if isinstance(obj, PreEncoded):
+        return obj.json
+    if isinstance(obj, dict) and _embeds(obj):
+        return "{" + ",".join(_dumps(str(k)) + ":" + dumps(v) for k, v in obj.items()) + "}"
+    if isinstance(obj, list) and _embeds(obj):
+        return "[" + ",".join(dumps(v) for v in obj) + "]"
+    return _dumps(obj)
+
+def loads(data):
+    """Decodifica JSON usando orjson quando disponível."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# ______________________________________________________________________________________________________
+
+def _epoch_ms(value: str):
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except ValueError:
+        return value
+
+def compact(obj):
+    """Converte um payload para a forma compacta do codec msgpack."""
+    if isinstance(obj, dict):
+        out = {}
+        for k, v in obj.items():
+            if k == "room":
+                continue
+            if k == "_id" and isinstance(v, str) and len(v) == 24:
+                v = bytes.fromhex(v)
+            elif k == "created_at" and isinstance(v, str):
+                v = _epoch_ms(v)
+            else:
+                v = compact(v)
+            out[COMPACT_KEYS.get(k, k)] = v
+        return out
+    if isinstance(obj, list):
+        return [compact(v) for v in obj]
+    return obj
+
+def pack(obj) -> bytes:
+    """
+    Codifica um payload no msgpack compacto. Objetos PreEncoded entram com os
+    bytes já gerados: mapas e listas msgpack são cabeçalho + elementos concatenados.
+    """
+    if isinstance(obj, PreEncoded):
+        return obj.packed
+    if isinstance(obj, dict) and _embeds(obj):
+        items = [(k, v) for k, v in obj.items() if k != "room"]
+        return msgpack.Packer().pack_map_header(len(items)) + b"".join(
+            msgpack.packb(COMPACT_KEYS.get(k, k)) + pack(v) for k, v in items
+        )
+    if isinstance(obj, list) and _embeds(obj):
+        return msgpack.Packer().pack_array_header(len(obj)) + b"".join(pack(v) for v in obj)
+    return msgpack.packb(compact(obj), default=str)
+
+def expand(obj):
+    """Converte um payload compacto (enviado pelo cliente msgpack) para as chaves longas."""
+    if isinstance(obj, dict):
+        return {EXPANDED_KEYS.get(k, k): expand(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [expand(v) for v in obj]
+    return obj
+
+def decode_binary(data: bytes) -> dict:
+    """Decodifica um frame binário do cliente (MessagePack compacto)."""
+    if msgpack is None:
+        raise ValueError("Codec msgpack indisponível")
+    return expand(msgpack.unpackb(data, raw=False))
+
+# ______________________________________________________________________________________________________
+
+def negotiate(scope: dict) -> tuple:
+    """
+    Escolhe (codec, deflate, subprotocolo) da conexão: primeiro subprotocolo
+    conhecido oferecido pelo cliente ou, sem ele, os parâmetros de query
+    `codec=json|msgpack` e `compress=deflate`. O padrão é JSON sem compressão.
+    """
+    for name in scope.get("subprotocols") or ():
+        if name in SUBPROTOCOLS:
+            codec, deflate = SUBPROTOCOLS[name]
+            if codec == "msgpack" and msgpack is None:
+                continue
+            return codec, deflate, name
+    query = parse_qs((scope.get("query_string") or b"").decode("latin-1"))
+    codec = query.get("codec", ["json"])[0]
+    if codec != "msgpack" or msgpack is None:
+        codec = "json"
+    deflate = query.get("compress", [""])[0] == "deflate"
+    return codec, deflate, None
+
+# ______________________________________________________________________________________________________
+
+class Frame:
+    """
+    Frame pré-codificado: guarda o payload original e suas codificações
+    (texto JSON e binário msgpack), geradas sob demanda e apenas uma vez.
+    Frames recebidos já codificados (ex.: via Redis) guardam o texto e só
+    decodificam o payload se preciso.
+    """
+    __slots__ = ("_payload", "_text", "_binary")
+
+    def __init__(self, payload: dict = None, text: str = None):
+        self._payload = payload
+        self._text = text
+        self._binary = None
+
+    @classmethod
+    def from_text(cls, text: str) -> "Frame":
+        """Cria um Frame a partir de JSON já codificado."""
+        return cls(text=text)
+
+    @property
+    def payload(self) -> dict:
+        if self._payload is None:
+            self._payload = loads(self._text)
+        return self._payload
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = dumps(self._payload)
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = pack(self.payload)
+        return self._binary
+
+# ______________________________________________________________________________________________________
+
+def encode_frame(payload) -> Frame:
+    """Retorna um Frame para o payload (reaproveita se já for um Frame)."""
+    if isinstance(payload, Frame):
+        return payload
+    return Frame(payload)
@@ -0,0 +1,252 @@
+"""
+Cache de histórico recente por sala (read-through / write-through).
+
+Cada sala mantém um buffer circular com as últimas mensagens (message.Message).
+A primeira página do histórico é servida da memória; em falta, consulta
+o Redis (se habilitado) e por fim o MongoDB, com uma única consulta por sala
+mesmo sob rajadas de reconexão. Salas ociosas saem por LRU e TTL.
+
+O buffer só é mantido enquanto as mensagens da sala chegam a este processo
+(`tracked`, a assinatura do fan-out): sem ela, outros workers publicariam
+sem atualizar a memória, e a sala é lida direto do Redis/MongoDB.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+import redis.asyncio as redis
+
+from config import HISTORY_CACHE_SIZE, HISTORY_CACHE_ROOMS, HISTORY_CACHE_TTL
+from frames import dumps
+from message import Message
+
+# ______________________________________________________________________________________________________
+
+class _RoomEntry:
+    """Buffer de uma sala; `ready` indica que o carregamento inicial terminou."""
+    __slots__ = ("items", "ready", "touched")
+
+    def __init__(self, size: int):
+        self.items: deque = deque(maxlen=size)
+        self.ready: Optional[asyncio.Future] = None
+        self.touched = time.monotonic()
+
+# ______________________________________________________________________________________________________
+
+class RoomHistoryCache:
+    """
+    Histórico recente por sala em memória, opcionalmente espelhado no Redis
+    (lista `ws:history:{room}`, mais recente primeiro).
+    """
+
+    def __init__(
+        self,
+        size: int = HISTORY_CACHE_SIZE,
+        max_rooms: int = HISTORY_CACHE_ROOMS,
+        ttl: float = HISTORY_CACHE_TTL,
+        client: Optional[redis.Redis] = None,
+        tracked: Optional[Callable[[str], bool]] = None,
+    ):
+        self.size = size
+        self.max_rooms = max_rooms
+        self.ttl = ttl
+        self.redis = client
+        # Indica se as mensagens da sala são entregues a este processo (padrão: todas)
+        self.tracked = tracked or (lambda room: True)
+        self._rooms: "OrderedDict[str, _RoomEntry]" = OrderedDict()
+
+        # métricas acumuladas
+        self.hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+        self.evictions = 0
+        self.replay_hits = 0
+        self.replay_misses = 0
+
+    # __________________________________________________________________________________________________
+
+    @staticmethod
+    def _key(room: str) -> str:
+        return f"ws:history:{room}"
+
+    # __________________________________________________________________________________________________
+
+    def _evict(self):
+        """Remove salas expiradas por TTL e, se necessário, as menos usadas (LRU)."""
+        now = time.monotonic()
+        while self._rooms:
+            room, entry = next(iter(self._rooms.items()))
+            expired = now - entry.touched > self.ttl
+            if not expired and len(self._rooms) <= self.max_rooms:
+                break
+            self._rooms.popitem(last=False)
+            self.evictions += 1
+
+    def drop(self, room: str):
+        """Descarta o buffer da sala (ex.: última conexão local saiu e o fan-out deixou de assiná-la)."""
+        if self._rooms.pop(room, None) is not None:
+            self.evictions += 1
+
+    # __________________________________________________________________________________________________
+
+    async def recent(self, room: str, limit: int, loader: Callable[[int], Awaitable[list]]) -> list:
+        """
+        Retorna as últimas `limit` mensagens da sala em ordem cronológica.
+        `loader(n)` busca as n mais recentes no MongoDB (ordem cronológica)
+        e só é chamado uma vez por sala em caso de falta.
+        """
+        if limit > self.size:
+            self.misses += 1
+            return await loader(limit)
+
+        if not self.tracked(room):
+            # sem assinatura o buffer não receberia as mensagens de outros workers
+            self.drop(room)
+            self.misses += 1
+            return (await self._load(room, loader))[-limit:]
+
+        entry = self._rooms.get(room)
+        if entry is not None and time.monotonic() - entry.touched > self.ttl and entry.ready.done():
+            self._rooms.pop(room, None)
+            self.evictions += 1
+            entry = None
+
+        if entry is not None:
+            self._rooms.move_to_end(room)
+            entry.touched = time.monotonic()
+            if entry.ready.done():
+                self.hits += 1
+            else:
+                # outra conexão já está carregando esta sala
+                self.misses += 1
+                await asyncio.shield(entry.ready)
+            entry.ready.result()
+            return list(entry.items)[-limit:]
+
+        self.misses += 1
+        entry = _RoomEntry(self.size)
+        entry.ready = asyncio.get_running_loop().create_future()
+        self._rooms[room] = entry
+        self._evict()
+        try:
+            loaded = await self._load(room, loader)
+        except Exception as e:
+            self._rooms.pop(room, None)
+            entry.ready.set_exception(e)
+            # evita "exception was never retrieved" quando ninguém mais aguarda
+            entry.ready.exception()
+            raise
+
+        # mensagens anexadas durante o carregamento (ainda não visíveis no MongoDB)
+        seen = {item.oid for item in loaded}
+        pending = [item for item in entry.items if item.oid not in seen]
+        entry.items.clear()
+        entry.items.extend(sorted(loaded + pending, key=lambda i: i.oid))
+        entry.ready.set_result(None)
+        return list(entry.items)[-limit:]
+
+    # __________________________________________________________________________________________________
+
+    async def _load(self, room: str, loader) -> list:
+        """Carrega o histórico do Redis (se existir) ou do MongoDB."""
+        if self.redis is not None:
+            try:
+                raw = await self.redis.lrange(self._key(room), 0, self.size - 1)
+                if raw:
+                    self.redis_hits += 1
+                    return [Message.from_json(r) for r in reversed(raw)]
+            except Exception as e:
+                print(f"Erro ao ler histórico do Redis: {e}")
+
+        items = await loader(self.size)
+        if self.redis is not None and items:
+            try:
+                key = self._key(room)
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.delete(key)
+                    pipe.lpush(key, *[dumps(i) for i in items])
+                    pipe.expire(key, int(self.ttl))
+                    await pipe.execute()
+            except Exception as e:
+                print(f"Erro ao gravar histórico no Redis: {e}")
+        return items
+
+    # __________________________________________________________________________________________________
+
+    def since(self, room: str, oid) -> tuple:
+        """
+        Mensagens da sala posteriores a `oid` no buffer local e se o buffer cobre
+        todo o intervalo (contém `oid` ou nunca descartou mensagens). Sem cobertura,
+        o restante deve vir do MongoDB. Sala sem assinatura no fan-out nunca é
+        coberta: o buffer pode ter perdido mensagens de outros workers.
+        """
+        entry = self._rooms.get(room)
+        if not self.tracked(room):
+            self.drop(room)
+            entry = None
+        if entry is None or entry.ready is None or not entry.ready.done() or entry.ready.exception():
+            self.replay_misses += 1
+            return [], False
+        items = entry.items
+        covered = len(items) < items.maxlen or (bool(items) and items[0].oid <= oid)
+        if covered:
+            self.replay_hits += 1
+        else:
+            self.replay_misses += 1
+        return [i for i in items if i.oid > oid], covered
+
+    # __________________________________________________________________________________________________
+
+    def append(self, room: str, item: Message):
+        """
+        Anexa uma mensagem ao buffer local da sala, se ela estiver em cache.
+        Mensagens já presentes (reentregues pelo fan-out ao retomar um stream)
+        são ignoradas.
+        """
+        entry = self._rooms.get(room)
+        if entry is None:
+            return
+        items = entry.items
+        if items and item.oid <= items[-1].oid and any(i.oid == item.oid for i in items):
+            return
+        items.append(item)
+
+    # __________________________________________________________________________________________________
+
+    async def write_through(self, room: str, item: Message):
+        """
+        Anexa a mensagem à lista do Redis, somente se ela já existir
+        (LPUSHX: lista presente significa histórico completo).
+        """
+        await self.write_through_many(room, [item])
+
+    async def write_through_many(self, room: str, items: list):
+        """Como `write_through`, para várias mensagens em ordem cronológica (um único LPUSHX)."""
+        if self.redis is None or not items:
+            return
+        key = self._key(room)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.lpushx(key, *[dumps(i) for i in items[-self.size:]])
+                pipe.ltrim(key, 0, self.size - 1)
+                pipe.expire(key, int(self.ttl), xx=True)
+                await pipe.execute()
+        except Exception as e:
+            print(f"Erro ao gravar histórico no Redis: {e}")
+
+    # __________________________________________________________________________________________________
+
+    def stats(self) -> dict:
+        """Contadores de acerto/falta e ocupação do cache."""
+        total = self.hits + self.misses
+        return {
+            "rooms": len(self._rooms),
+            "hits": self.hits,
+            "misses": self.misses,
+            "redis_hits": self.redis_hits,
+            "evictions": self.evictions,
+            "replay_hits": self.replay_hits,
+            "replay_misses": self.replay_misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
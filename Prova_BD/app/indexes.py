@@ -0,0 +1,103 @@
+"""
+Índices do MongoDB exigidos pelas consultas da aplicação.
+
+Na inicialização os índices são criados (se configurado) e verificados, e
+as consultas de histórico passam por um `explain` para detectar varredura
+de coleção (COLLSCAN) ou ordenação em memória (SORT).
+"""
+from bson import ObjectId
+
+from config import MONGO_CREATE_INDEXES, MONGO_REQUIRE_INDEXES, SEARCH_LANGUAGE
+
+# ______________________________________________________________________________________________________
+
+# coleção -> lista de (nome, chaves[, opções])
+REQUIRED_INDEXES = {
+    "messages": [
+        # Histórico por sala, do mais recente para o mais antigo (paginação por _id)
+        ("room_1__id_-1", [("room", 1), ("_id", -1)]),
+        # Busca textual por sala (GET /rooms/{room}/search)
+        ("room_1_content_text", [("room", 1), ("content", "text")], {"default_language": SEARCH_LANGUAGE}),
+    ],
+    "rooms": [
+        # Registro de salas: uma sala por nome
+        ("name_1", [("name", 1)], {"unique": True}),
+    ],
+}
+
+# Consultas representativas verificadas com explain: (coleção, filtro, ordenação)
+CHECKED_QUERIES = [
+    ("messages", {"room": "__explain__"}, [("_id", -1)]),
+    ("messages", {"room": "__explain__", "_id": {"$lt": ObjectId("f" * 24)}}, [("_id", -1)]),
+]
+
+# Estágios do plano que indicam consulta sem índice adequado
+BAD_STAGES = ("COLLSCAN", "SORT")
+
+# ______________________________________________________________________________________________________
+
+def _stages(plan) -> set:
+    """Coleta recursivamente os nomes de estágio de um plano de execução."""
+    found = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            found.add(plan["stage"])
+        for value in plan.values():
+            found |= _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            found |= _stages(item)
+    return found
+
+# ______________________________________________________________________________________________________
+
+async def ensure_indexes(db, create: bool = MONGO_CREATE_INDEXES) -> list:
+    """
+    Cria (opcionalmente) e verifica os índices exigidos.
+    Retorna a lista de índices ausentes como "coleção.nome".
+    """
+    missing = []
+    for collection, specs in REQUIRED_INDEXES.items():
+        if create:
+            for name, keys, *options in specs:
+                await db[collection].create_index(keys, name=name, **(options[0] if options else {}))
+        existing = await db[collection].index_information()
+        existing_keys = [[tuple(k) for k in info["key"]] for info in existing.values()]
+        for name, keys, *_ in specs:
+            # índices de texto são descritos por _fts/_ftsx: basta o nome
+            if keys not in existing_keys and name not in existing:
+                missing.append(f"{collection}.{name}")
+    return missing
+
+# ______________________________________________________________________________________________________
+
+async def check_queries(db) -> list:
+    """
+    Executa `explain` nas consultas representativas e retorna as que usam
+    varredura de coleção ou ordenação em memória.
+    """
+    problems = []
+    for collection, query, sort in CHECKED_QUERIES:
+        plan = await db[collection].find(query).sort(sort).limit(20).explain()
+        stages = _stages(plan.get("queryPlanner", {}).get("winningPlan", {}))
+        bad = sorted(stages & set(BAD_STAGES))
+        if bad:
+            problems.append({"collection": collection, "filter": list(query), "stages": bad})
+    return problems
+
+# ______________________________________________________________________________________________________
+
+async def bootstrap_indexes(db, strict: bool = MONGO_REQUIRE_INDEXES) -> dict:
+    """
+    Garante os índices e reporta consultas sem índice.
+    Com `strict`, falha a inicialização se algo estiver ausente.
+    """
+    missing = await ensure_indexes(db)
+    problems = await check_queries(db)
+    for name in missing:
+        print(f"Índice obrigatório ausente: {name}")
+    for p in problems:
+        print(f"Consulta sem índice adequado em {p['collection']} {p['filter']}: {p['stages']}")
+    if strict and (missing or problems):
+        raise RuntimeError("Índices obrigatórios ausentes; veja o log de inicialização")
+    return {"missing": missing, "unindexed_queries": problems}
@@ -0,0 +1,201 @@
+"""
+Ingestão em massa de mensagens (POST /rooms/{room}/messages/bulk).
+
+Usada por integrações que reenviam históricos (pontes de IRC, importadores
+do Slack). O corpo é NDJSON, lido em streaming, ou um array JSON. Os itens
+são validados com `MessageIn` e gravados em blocos de BULK_CHUNK_SIZE com
+`insert_many(ordered=False)`: uma falha não interrompe o restante do bloco.
+Cada bloco gravado é entregue a `on_chunk` (broadcast em um único frame
+`batch`), e a resposta traz o resultado de cada item na ordem de envio.
+"""
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from config import BULK_CHUNK_SIZE, BULK_MAX_ITEMS, BULK_MAX_BYTES, BULK_MAX_LINE_BYTES
+from frames import loads
+from message import Message
+from metrics import MONGO_SECONDS
+from models import MessageIn
+from persistence import DUPLICATE_KEY, prepare
+
+# ______________________________________________________________________________________________________
+
+_BULK_INSERT_SECONDS = MONGO_SECONDS.labels("insert_many_bulk")
+
+# (posição, item decodificado ou None, erro de decodificação)
+RawItem = Tuple[int, Optional[dict], Optional[str]]
+
+class BulkTooLarge(Exception):
+    """Corpo do array JSON acima de BULK_MAX_BYTES."""
+
+# ______________________________________________________________________________________________________
+
+async def iter_ndjson(stream: AsyncIterator[bytes], max_line: int = BULK_MAX_LINE_BYTES) -> AsyncIterator[RawItem]:
+    """
+    Decodifica NDJSON conforme os bytes chegam (linhas vazias são ignoradas).
+    Cada pedaço é varrido uma única vez; uma linha acima de `max_line` bytes
+    vira um item com erro e é descartada até a próxima quebra de linha, de
+    modo que o buffer nunca passa de `max_line` mais um pedaço.
+    """
+    index = 0
+    buffer = bytearray()
+    # descartando o restante de uma linha longa demais
+    skipping = False
+    too_long = f"Linha acima de {max_line} bytes"
+    async for chunk in stream:
+        scan = len(buffer)
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", scan)
+            if end == -1:
+                break
+            if skipping:
+                skipping = False
+            elif end - start > max_line:
+                yield index, None, too_long
+                index += 1
+            elif buffer[start:end].strip():
+                yield _decode(index, bytes(buffer[start:end]))
+                index += 1
+            start = scan = end + 1
+        del buffer[:start]
+        if len(buffer) > max_line:
+            if not skipping:
+                yield index, None, too_long
+                index += 1
+                skipping = True
+            buffer.clear()
+    if buffer.strip() and not skipping:
+        yield _decode(index, bytes(buffer))
+
+def _decode(index: int, line: bytes) -> RawItem:
+    try:
+        return index, loads(line), None
+    except ValueError:
+        return index, None, "JSON inválido"
+
+async def iter_json_array(stream: AsyncIterator[bytes], max_bytes: int = BULK_MAX_BYTES) -> AsyncIterator[RawItem]:
+    """Lê um array JSON inteiro (até `max_bytes`); ValueError se não for um array."""
+    body = bytearray()
+    async for chunk in stream:
+        body += chunk
+        if len(body) > max_bytes:
+            raise BulkTooLarge(f"Corpo acima de {max_bytes} bytes; use NDJSON")
+    try:
+        items = loads(bytes(body))
+    except ValueError:
+        raise ValueError("JSON inválido")
+    if not isinstance(items, list):
+        raise ValueError("Esperado um array JSON de mensagens")
+    for index, item in enumerate(items):
+        yield index, item, None
+
+# ______________________________________________________________________________________________________
+
+def validate(room: str, item: Optional[dict]) -> Tuple[Optional[dict], Optional[str]]:
+    """Valida um item com `MessageIn`; retorna (documento pronto para gravar, erro)."""
+    if not isinstance(item, dict):
+        return None, "Esperado um objeto JSON"
+    try:
+        message = MessageIn(**item)
+    except ValidationError as e:
+        first = e.errors()[0]
+        field = ".".join(str(p) for p in first.get("loc", ()))
+        return None, f"{field}: {first.get('msg')}" if field else first.get("msg")
+    except (TypeError, ValueError, AttributeError) as e:
+        # item malformado que escapou dos validadores: erro só deste item
+        return None, str(e) or "Item inválido"
+    doc = {"room": room, "username": message.username, "content": message.content}
+    if message.avatar is not None:
+        doc["avatar"] = message.avatar
+    return prepare(doc), None
+
+async def insert_chunk(collection, docs: List[dict]) -> Tuple[dict, Optional[str]]:
+    """
+    Grava o bloco com `insert_many(ordered=False)`.
+    Retorna (posição no bloco -> erro dos documentos rejeitados, falha geral).
+    Chave duplicada conta como gravado; a falha geral (timeout, queda de
+    conexão) deixa o bloco em estado desconhecido e interrompe a ingestão.
+    """
+    t0 = time.perf_counter()
+    try:
+        await collection.insert_many(docs, ordered=False)
+        return {}, None
+    except BulkWriteError as e:
+        return {
+            err["index"]: err.get("errmsg", "Erro de gravação")
+            for err in e.details.get("writeErrors", [])
+            if err.get("code") != DUPLICATE_KEY
+        }, None
+    except PyMongoError as e:
+        print(f"Erro na ingestão em massa: {e}")
+        return {}, f"Falha ao gravar no MongoDB: {e}"
+    finally:
+        _BULK_INSERT_SECONDS.observe(time.perf_counter() - t0)
+
+# ______________________________________________________________________________________________________
+
+async def ingest(
+    collection,
+    room: str,
+    items: AsyncIterator[RawItem],
+    on_chunk: Callable[[List[Message]], Awaitable[None]],
+    chunk_size: int = BULK_CHUNK_SIZE,
+    max_items: int = BULK_MAX_ITEMS,
+) -> dict:
+    """
+    Valida, grava e entrega os itens em blocos. Além de `max_items`, ou se um
+    bloco falhar por erro do MongoDB, a leitura para e a resposta sai com
+    `truncated` (os blocos anteriores continuam gravados e entregues).
+    """
+    results: List[dict] = []
+    pending: List[Tuple[int, dict]] = []
+    truncated = False
+
+    async def flush() -> bool:
+        """Grava o bloco pendente; retorna False se ele falhou por inteiro."""
+        docs = [doc for _, doc in pending]
+        errors, failure = await insert_chunk(collection, docs)
+        written = []
+        for pos, (index, doc) in enumerate(pending):
+            if failure is not None:
+                results.append({"index": index, "ok": False, "error": failure})
+            elif pos in errors:
+                results.append({"index": index, "ok": False, "error": errors[pos]})
+            else:
+                written.append(Message.from_doc(doc))
+                results.append({"index": index, "ok": True, "_id": str(doc["_id"])})
+        pending.clear()
+        if written:
+            await on_chunk(written)
+        return failure is None
+
+    async for index, item, error in items:
+        if index >= max_items:
+            truncated = True
+            break
+        doc = None
+        if error is None:
+            doc, error = validate(room, item)
+        if error is not None:
+            results.append({"index": index, "ok": False, "error": error})
+            continue
+        pending.append((index, doc))
+        if len(pending) >= chunk_size and not await flush():
+            truncated = True
+            break
+    if pending and not await flush():
+        truncated = True
+
+    results.sort(key=lambda r: r["index"])
+    accepted = sum(1 for r in results if r["ok"])
+    return {
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "truncated": truncated,
+        "results": results,
+    }
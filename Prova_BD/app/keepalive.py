@@ -0,0 +1,217 @@
+"""
+Keepalive central das conexões WebSocket.
+
+Uma única tarefa por processo acompanha todas as conexões (WSManager e
+ChatManager) em um heap ordenado pelo próximo prazo de verificação, em vez
+de uma tarefa por socket. Registrar atividade (`touch`) só atualiza um
+instante; o heap é corrigido de forma preguiçosa quando o prazo vence:
+
+- conexão com atividade recente: volta ao heap para `last_seen + interval`;
+- ociosa por `interval`: recebe um ping de aplicação ({"type": "ping"});
+- sem nenhuma resposta `timeout` segundos após o ping (ou ping com erro):
+  é recolhida junto com as demais do mesmo ciclo, e o `reap` de cada uma
+  encerra tarefas, presença e assinaturas e fecha o socket.
+
+O ping deve falhar (exceção) quando a conexão já não consegue enviar, e
+`expire` antecipa o recolhimento de uma conexão que o dono sabe estar
+perdida (ex.: removida por falha de envio ou cliente lento).
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+from config import (
+    WS_KEEPALIVE,
+    WS_KEEPALIVE_INTERVAL,
+    WS_KEEPALIVE_TIMEOUT,
+    WS_KEEPALIVE_TICK,
+)
+from metrics import SEND_DISCONNECTS
+
+# ______________________________________________________________________________________________________
+
+# Código de fechamento das conexões recolhidas ("going away")
+IDLE_CLOSE_CODE = 1001
+
+_IDLE_DISCONNECTS = SEND_DISCONNECTS.labels("idle")
+
+# ______________________________________________________________________________________________________
+
+class _Entry:
+    """Conexão acompanhada: instantes de atividade e do último ping, e callbacks."""
+    __slots__ = ("key", "last_seen", "pinged_at", "ping", "reap", "active", "expired")
+
+    def __init__(self, key: Hashable, ping: Callable[[], Awaitable], reap: Callable[[], Awaitable], now: float):
+        self.key = key
+        self.last_seen = now
+        self.pinged_at: Optional[float] = None
+        self.ping = ping
+        self.reap = reap
+        self.active = True
+        self.expired = False
+
+# ______________________________________________________________________________________________________
+
+class KeepaliveScheduler:
+    """Pings e recolhimento de conexões ociosas/mortas com um heap de prazos."""
+
+    def __init__(
+        self,
+        interval: float = WS_KEEPALIVE_INTERVAL,
+        timeout: float = WS_KEEPALIVE_TIMEOUT,
+        tick: float = WS_KEEPALIVE_TICK,
+        enabled: bool = WS_KEEPALIVE,
+    ):
+        self.interval = interval
+        self.timeout = timeout
+        self.tick = tick
+        self.enabled = enabled
+        self._entries: Dict[Hashable, _Entry] = {}
+        # (prazo, sequência, entrada); entradas removidas são descartadas ao sair do heap
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+        # métricas acumuladas
+        self.pings = 0
+        self.ping_failures = 0
+        self.reaped = 0
+
+    # __________________________________________________________________________________________________
+
+    def register(self, key: Hashable, ping: Callable[[], Awaitable], reap: Callable[[], Awaitable]):
+        """
+        Passa a acompanhar a conexão. `ping()` envia o ping de aplicação;
+        `reap()` libera tudo o que pertence à conexão (deve ser idempotente).
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        entry = _Entry(key, ping, reap, now)
+        old = self._entries.get(key)
+        if old is not None:
+            old.active = False
+        self._entries[key] = entry
+        self._push(now + self.interval, entry)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def touch(self, key: Hashable):
+        """Registra atividade da conexão (qualquer frame recebido, inclusive pong)."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.last_seen = time.monotonic()
+
+    def unregister(self, key: Hashable):
+        """Deixa de acompanhar a conexão (a entrada sai do heap quando vencer)."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.active = False
+
+    def expire(self, key: Hashable):
+        """Recolhe a conexão no próximo ciclo, sem esperar ping nem timeout."""
+        entry = self._entries.get(key)
+        if entry is not None and not entry.expired:
+            entry.expired = True
+            self._push(time.monotonic(), entry)
+
+    def _push(self, deadline: float, entry: _Entry):
+        heapq.heappush(self._heap, (deadline, next(self._seq), entry))
+
+    # __________________________________________________________________________________________________
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"Erro no keepalive das conexões: {e}")
+
+    # __________________________________________________________________________________________________
+
+    async def check(self):
+        """Processa os prazos vencidos: reagenda, envia pings e recolhe em lote."""
+        now = time.monotonic()
+        to_ping: List[_Entry] = []
+        to_reap: List[_Entry] = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, _, entry = heapq.heappop(heap)
+            if not entry.active:
+                continue
+            if entry.expired:
+                # pode estar duas vezes no heap (prazo normal e expire)
+                entry.active = False
+                to_reap.append(entry)
+            elif entry.pinged_at is not None and entry.last_seen < entry.pinged_at:
+                if now - entry.pinged_at >= self.timeout:
+                    to_reap.append(entry)
+                else:
+                    self._push(entry.pinged_at + self.timeout, entry)
+            elif now - entry.last_seen >= self.interval:
+                to_ping.append(entry)
+            else:
+                self._push(entry.last_seen + self.interval, entry)
+
+        if to_ping:
+            results = await asyncio.gather(
+                *(asyncio.wait_for(e.ping(), self.timeout) for e in to_ping),
+                return_exceptions=True,
+            )
+            self.pings += len(to_ping)
+            for entry, result in zip(to_ping, results):
+                if isinstance(result, Exception):
+                    self.ping_failures += 1
+                    to_reap.append(entry)
+                else:
+                    entry.pinged_at = now
+                    self._push(now + self.timeout, entry)
+
+        if to_reap:
+            await self._reap(to_reap)
+
+    async def _reap(self, entries: List[_Entry]):
+        """Recolhe as conexões de uma vez; falhas de uma não impedem as demais."""
+        for entry in entries:
+            self.unregister(entry.key)
+        results = await asyncio.gather(*(e.reap() for e in entries), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Erro ao recolher conexão ociosa: {result}")
+        self.reaped += len(entries)
+        _IDLE_DISCONNECTS.value += len(entries)
+
+    # __________________________________________________________________________________________________
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "tracked": len(self._entries),
+            "heap": len(self._heap),
+            "pings": self.pings,
+            "ping_failures": self.ping_failures,
+            "reaped": self.reaped,
+        }
+
+# ______________________________________________________________________________________________________
+
+_keepalive: Optional[KeepaliveScheduler] = None
+
+def get_keepalive() -> KeepaliveScheduler:
+    """Agendador de keepalive compartilhado do processo (WSManager e ChatManager)."""
+    global _keepalive
+    if _keepalive is None:
+        _keepalive = KeepaliveScheduler()
+    return _keepalive
@@ -1,16 +1,17 @@
 from __future__ import annotations
 import os
-from typing import Optional, Dict, Set
+from contextlib import asynccontextmanager
+from typing import Optional
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Body
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Body, Request, HTTPException, Depends
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
-from datetime import datetime, timezone
+from datetime import datetime
 from pathlib import Path
 
 # ______________________________________________________________________________________________________
@@ -21,14 +22,91 @@ load_dotenv(dotenv_path=ROOT / ".env")
 
 # ______________________________________________________________________________________________________
 
-# Configurações de conexão com MongoDB
-MONGO_URL = os.getenv("MONGO_URL", "")
-MONGO_DB = os.getenv("MONGO_DB", "chatdb")
+# Módulos locais (importados após o .env para herdarem suas variáveis)
+from database import mongo, get_db, get_writer
+from persistence import utcnow_ms
+from ws_manager import WSManager
+from fanout import create_fanout
+from indexes import bootstrap_indexes
+from history_cache import RoomHistoryCache
+from ratelimit import get_limiter
+from presence import PresenceService
+from rooms import get_registry
+from search import SearchIndex, SearchTimeout
+from ingest import ingest, iter_ndjson, iter_json_array, BulkTooLarge
+from archive import Archiver, archive_tiers, find_tiered, iter_tiered
+from keepalive import get_keepalive, IDLE_CLOSE_CODE
+from routes.rooms import router as rooms_router
+from pagination import history_query, parse_cursor, MESSAGE_PROJECTION
+from frames import dumps, loads, decode_binary, negotiate
+from message import Message
+from metrics import REGISTRY, MESSAGES_IN, MONGO_SECONDS, LoopLagMonitor
+from config import (
+    MONGO_REQUIRE_INDEXES,
+    HISTORY_CACHE_REDIS,
+    HISTORY_MAX_PAGE,
+    EXPORT_BATCH_SIZE,
+    EXPORT_CHUNK_BYTES,
+    REDIS_URL,
+    PRESENCE_BACKEND,
+    ROOMS_ENFORCE,
+    ROOMS_DEFAULT,
+    SEARCH_MAX_PAGE,
+    WS_REPLAY_MAX,
+    ARCHIVE_ENABLED,
+)
+from uuid import uuid4
+import time
+import redis.asyncio as redis
 
 # ______________________________________________________________________________________________________
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Inicialização: conecta e aquece o pool do MongoDB, cria/verifica os índices,
+    carrega o registro de salas e as camadas de arquivo e inicia o fan-out, a
+    medição do loop e o arquivamento. Encerramento: para o fan-out e o
+    arquivamento, grava as mensagens e a presença pendentes e fecha o cliente
+    do MongoDB.
+    """
+    try:
+        await mongo.start()
+    except Exception as e:
+        print(f"Não foi possível aquecer a conexão com o MongoDB: {e}")
+    try:
+        await bootstrap_indexes(mongo.db)
+    except Exception as e:
+        if MONGO_REQUIRE_INDEXES:
+            raise
+        print(f"Não foi possível verificar os índices: {e}")
+    try:
+        await registry.seed(ROOMS_DEFAULT)
+        await registry.start()
+    except Exception as e:
+        print(f"Não foi possível carregar o registro de salas: {e}")
+    try:
+        await archive_tiers(mongo.db, refresh=True)
+    except Exception as e:
+        print(f"Não foi possível listar as coleções de arquivo: {e}")
+    await fanout.start()
+    lag_monitor.start()
+    if ARCHIVE_ENABLED:
+        archiver.start()
+    try:
+        yield
+    finally:
+        await fanout.stop()
+        await keepalive.stop()
+        await archiver.stop()
+        await registry.stop()
+        await presence.stop()
+        await lag_monitor.stop()
+        # grava os lotes pendentes (get_writer) e fecha o pool
+        await mongo.close()
+
 # Instância principal do FastAPI
-app = FastAPI(title="FastAPI Chat + MongoDB Atlas (fix datetime)")
+app = FastAPI(title="FastAPI Chat + MongoDB Atlas (fix datetime)", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -36,62 +114,183 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.include_router(rooms_router)
 
 # ______________________________________________________________________________________________________
 
-# --- DB helpers ---
-_client: Optional[AsyncIOMotorClient] = None
-
-def db():
-    """Retorna instância do banco de dados MongoDB."""
-    global _client
-    if _client is None:
-        if not MONGO_URL:
-            raise RuntimeError("Defina MONGO_URL no .env (string do MongoDB Atlas).")
-        _client = AsyncIOMotorClient(MONGO_URL)
-    return _client[MONGO_DB]
-
-def iso(dt: datetime) -> str:
-    """Converte datetime para string ISO-8601 com timezone UTC."""
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.isoformat()
-
-def serialize(doc: dict) -> dict:
-    """Serializa documento MongoDB para formato JSON-safe."""
-    d = dict(doc)
-    if "_id" in d:
-        d["_id"] = str(d["_id"])
-    if "created_at" in d and isinstance(d["created_at"], datetime):
-        d["created_at"] = iso(d["created_at"])
-    return d
+# --- WebSocket room manager ---
+manager = WSManager()
+
+# Fan-out entre workers (FANOUT_BACKEND: inprocess | pubsub | streams)
+fanout = create_fanout(manager)
+
+# Gravação write-behind das mensagens recebidas via WebSocket (gravador compartilhado da coleção)
+writer = get_writer("messages")
+
+# Histórico recente por sala em memória (opcionalmente espelhado no Redis),
+# mantido só para as salas cujas mensagens o fan-out entrega a este processo
+history = RoomHistoryCache(
+    client=redis.from_url(REDIS_URL, decode_responses=True) if HISTORY_CACHE_REDIS else None,
+    tracked=fanout.subscribed,
+)
+
+# Busca textual (índice de texto do MongoDB + índice invertido local opcional)
+search = SearchIndex(lambda: mongo.db["messages"], tracked=fanout.subscribed)
+
+def cache_delivered(room: str, frame):
+    """Mantém o cache de histórico e o índice de busca atualizados com as mensagens entregues."""
+    kind = frame.payload.get("type")
+    if kind == "message":
+        items = [frame.payload["item"]]
+    elif kind == "batch":
+        items = frame.payload["items"]
+    else:
+        return
+    for item in items:
+        # local: a própria Message; via Redis: a forma serializada do frame
+        item = Message.coerce(item)
+        history.append(room, item)
+        search.add(room, item)
+
+fanout.add_listener(cache_delivered)
+
+# Registro de salas (MongoDB + cache em memória), consultado a cada entrada no WebSocket
+registry = get_registry()
+
+# Rate limit por remetente (sala + IP do cliente)
+limiter = get_limiter()
+
+# Presença por usuário e conexão (PRESENCE_BACKEND: local | redis)
+presence = PresenceService(
+    client=redis.from_url(REDIS_URL, decode_responses=True) if PRESENCE_BACKEND == "redis" else None
+)
+
+# Pings e recolhimento de conexões ociosas ou mortas (um único agendador por processo);
+# conexões removidas pelo WSManager (falha de envio, cliente lento) são recolhidas já
+keepalive = get_keepalive()
+manager.on_drop = lambda room, ws: keepalive.expire(ws)
+
+# Arquivamento das mensagens antigas em coleções mensais (ARCHIVE_ENABLED)
+archiver = Archiver(lambda: mongo.db)
 
 # ______________________________________________________________________________________________________
 
-# --- WebSocket room manager ---
-class WSManager:
-    def __init__(self):
-        self.rooms: Dict[str, Set[WebSocket]] = {}
-
-    async def connect(self, room: str, ws: WebSocket):
-        await ws.accept()
-        self.rooms.setdefault(room, set()).add(ws)
-
-    def disconnect(self, room: str, ws: WebSocket):
-        conns = self.rooms.get(room)
-        if conns and ws in conns:
-            conns.remove(ws)
-            if not conns:
-                self.rooms.pop(room, None)
-
-    async def broadcast(self, room: str, payload: dict):
-        for ws in list(self.rooms.get(room, [])):
-            try:
-                await ws.send_json(payload)
-            except Exception:
-                self.disconnect(room, ws)
+# --- Métricas (/metrics) ---
+lag_monitor = LoopLagMonitor()
 
-manager = WSManager()
+_WS_MESSAGES_IN = MESSAGES_IN.labels("ws")
+_REST_MESSAGES_IN = MESSAGES_IN.labels("rest")
+_FIND_SECONDS = MONGO_SECONDS.labels("find")
+_INSERT_ONE_SECONDS = MONGO_SECONDS.labels("insert_one")
+
+REGISTRY.collector(
+    "chat_ws_connections", "gauge", "WebSockets ativos por sala",
+    lambda: (((room,), len(conns)) for room, conns in manager.rooms.items()),
+    ("room",),
+)
+REGISTRY.collector("chat_messages_out_total", "counter", "Frames enviados aos WebSockets", lambda: manager.sent)
+REGISTRY.collector("chat_ws_dropped_total", "counter", "Frames descartados por fila cheia", lambda: manager.dropped)
+REGISTRY.collector(
+    "chat_ws_queue_depth", "gauge", "Frames nas filas de saída",
+    lambda: sum(c.queue.qsize() for conns in manager.rooms.values() for c in conns.values()),
+)
+REGISTRY.collector("chat_writer_pending", "gauge", "Mensagens aguardando gravação", lambda: writer.queue.qsize())
+REGISTRY.collector("chat_writer_written_total", "counter", "Mensagens gravadas em lote", lambda: writer.written)
+REGISTRY.collector("chat_writer_failed_total", "counter", "Mensagens descartadas após reenvios", lambda: writer.failed)
+REGISTRY.collector("chat_history_cache_hits_total", "counter", "Acertos do cache de histórico", lambda: history.hits)
+REGISTRY.collector("chat_history_cache_misses_total", "counter", "Faltas do cache de histórico", lambda: history.misses)
+REGISTRY.collector(
+    "chat_ratelimit_rejected_total", "counter", "Mensagens rejeitadas pelo rate limit",
+    lambda: limiter.rejected_local + limiter.rejected_remote,
+)
+REGISTRY.collector("chat_event_loop_lag_last_seconds", "gauge", "Último atraso medido do loop", lambda: lag_monitor.last)
+
+async def load_history(database: AsyncIOMotorDatabase, room: str, limit: int) -> list:
+    """Busca as últimas `limit` mensagens da sala no MongoDB (ordem cronológica, atravessando o arquivo)."""
+    t0 = time.perf_counter()
+    items = [Message.from_doc(d) for d in await find_tiered(database, {"room": room}, -1, limit)]
+    _FIND_SECONDS.observe(time.perf_counter() - t0)
+    items.reverse()
+    return items
+
+async def replay_since(database: AsyncIOMotorDatabase, room: str, last_id, limit: int = WS_REPLAY_MAX) -> tuple:
+    """
+    Mensagens posteriores a `last_id` para uma reconexão: do buffer da sala
+    quando ele cobre o intervalo; senão, as `limit` mais recentes do intervalo
+    no MongoDB (índice room + _id) somadas às do buffer ainda não gravadas.
+    Retorna (mensagens em ordem cronológica, intervalo completo).
+    """
+    # carrega a sala no cache uma única vez, mesmo em rajadas de reconexão
+    await history.recent(room, 1, lambda n: load_history(database, room, n))
+    buffered, covered = history.since(room, last_id)
+    if covered and len(buffered) <= limit:
+        return buffered, True
+
+    t0 = time.perf_counter()
+    cursor = (
+        database["messages"].find({"room": room, "_id": {"$gt": last_id}}, MESSAGE_PROJECTION)
+        .sort("_id", -1)
+        .limit(limit + 1)
+    )
+    raw = await cursor.to_list(length=limit + 1)
+    _FIND_SECONDS.observe(time.perf_counter() - t0)
+    complete = len(raw) <= limit
+    items = [Message.from_doc(d) for d in reversed(raw[:limit])]
+    newest = items[-1].oid if items else last_id
+    items.extend(i for i in buffered if i.oid > newest)
+    return items[-limit:], complete
+
+# ______________________________________________________________________________________________________
+
+@app.get("/stats/ws")
+async def ws_stats():
+    """Métricas das filas de saída dos WebSockets (profundidade e descartes)."""
+    return manager.stats()
+
+@app.get("/stats/writer")
+async def writer_stats():
+    """Métricas da gravação write-behind (pendentes, gravadas, falhas)."""
+    return writer.stats()
+
+@app.get("/stats/history")
+async def history_stats():
+    """Métricas do cache de histórico (acertos, faltas, despejos)."""
+    return history.stats()
+
+@app.get("/stats/ratelimit")
+async def ratelimit_stats():
+    """Métricas do rate limiter (permitidas, rejeitadas local/Redis)."""
+    return limiter.stats()
+
+@app.get("/stats/rooms")
+async def rooms_stats():
+    """Métricas do cache do registro de salas (salas, acertos, faltas, invalidações)."""
+    return registry.stats()
+
+@app.get("/stats/search")
+async def search_stats():
+    """Métricas da busca (consultas em memória/MongoDB, estouros de tempo, salas indexadas)."""
+    return search.stats()
+
+@app.get("/stats/keepalive")
+async def keepalive_stats():
+    """Métricas do keepalive (conexões acompanhadas, pings, conexões recolhidas)."""
+    return keepalive.stats()
+
+@app.get("/stats/archive")
+async def archive_stats():
+    """Métricas do arquivamento (mensagens movidas, lotes, camadas existentes)."""
+    return archiver.stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas no formato texto do Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/rooms/{room}/presence")
+async def room_presence(room: str, limit: int = Query(100, ge=1, le=1000)):
+    """Conexões online na sala e os usuários vistos mais recentemente."""
+    return await presence.online(room, limit)
 
 # ______________________________________________________________________________________________________
 
@@ -108,67 +307,269 @@ async def index():
 # --- REST ---
 @app.get("/rooms/{room}/messages")
 async def get_messages(
-    room: str, limit: int = Query(20, ge=1, le=100), before_id: str | None = Query(None)
+    room: str,
+    limit: int = Query(20, ge=1, le=HISTORY_MAX_PAGE),
+    before_id: str | None = Query(None),
+    after_id: str | None = Query(None),
+    since: datetime | None = Query(None),
+    until: datetime | None = Query(None),
+    database: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    """Retorna mensagens da sala via REST (paginado)."""
-    query = {"room": room}
-    if before_id:
+    """
+    Retorna mensagens da sala via REST, paginadas por cursor (`_id`).
+    `before_id` volta no tempo, `after_id` avança; `since`/`until` filtram por data.
+    """
+    if not (before_id or after_id or since or until):
+        # primeira página: servida pelo cache de histórico
+        docs = await history.recent(room, limit, lambda n: load_history(database, room, n))
+        has_more = None
+    else:
         try:
-            query["_id"] = {"$lt": ObjectId(before_id)}
-        except Exception:
-            pass
+            query, direction = history_query(room, before_id, after_id, since, until)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # coleção quente e, se o cursor passar da fronteira, os meses arquivados
+        t0 = time.perf_counter()
+        raw = await find_tiered(database, query, direction, limit + 1, MESSAGE_PROJECTION)
+        _FIND_SECONDS.observe(time.perf_counter() - t0)
+        has_more = len(raw) > limit
+        docs = [Message.from_doc(d) for d in raw[:limit]]
+        if direction == -1:
+            docs.reverse()
 
-    cursor = db()["messages"].find(query).sort("_id", -1).limit(limit)
-    docs = [serialize(d) async for d in cursor]
-    docs.reverse()
-    next_cursor = docs[0]["_id"] if docs else None
-    return {"items": docs, "next_cursor": next_cursor}
+    # resposta montada com o JSON já cacheado de cada mensagem
+    body = {
+        "items": docs,
+        "next_cursor": docs[0].id if docs else None,
+        "before_cursor": docs[0].id if docs else None,
+        "after_cursor": docs[-1].id if docs else None,
+        "has_more": has_more,
+    }
+    return Response(dumps(body), media_type="application/json")
+
+@app.get("/rooms/{room}/export")
+async def export_messages(
+    room: str,
+    since: datetime | None = Query(None),
+    until: datetime | None = Query(None),
+    database: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """
+    Exporta todo o histórico da sala (ou o intervalo pedido) como NDJSON,
+    em ordem cronológica, lendo do cursor do MongoDB em lotes (memória constante).
+    """
+    query, _ = history_query(room, since=since, until=until)
+    # meses arquivados (mais antigos) seguidos da coleção quente
+    cursor = iter_tiered(database, query, MESSAGE_PROJECTION, EXPORT_BATCH_SIZE)
+
+    async def lines():
+        chunk = []
+        size = 0
+        async for doc in cursor:
+            line = Message.from_doc(doc).json + "\n"
+            chunk.append(line)
+            size += len(line)
+            if size >= EXPORT_CHUNK_BYTES:
+                yield "".join(chunk)
+                chunk, size = [], 0
+        if chunk:
+            yield "".join(chunk)
+
+    filename = f"{room}.ndjson"
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/rooms/{room}/search")
+async def search_messages(
+    room: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_PAGE),
+    cursor: str | None = Query(None),
+):
+    """
+    Busca textual na sala, do resultado mais relevante ao menos relevante.
+    `next_cursor` traz a página seguinte; cada consulta ao MongoDB é limitada
+    por SEARCH_MAX_TIME_MS (504 se exceder).
+    """
+    try:
+        return await search.search(room, q, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SearchTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
 
 @app.post("/rooms/{room}/messages", status_code=201)
 async def post_message(
     room: str,
+    request: Request,
     username: str = Body(..., embed=True),
     content: str = Body(..., embed=True),
+    database: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    """Cria uma nova mensagem na sala via REST."""
+    """
+    Cria uma nova mensagem na sala via REST e a publica no fan-out, como as
+    do WebSocket: conexões da sala (em qualquer worker) a recebem ao vivo e
+    o cache de histórico e o índice de busca de cada worker são atualizados
+    por `cache_delivered`.
+    """
+    if not await limiter.allow(room, limiter.sender(request.client.host)):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    _REST_MESSAGES_IN.value += 1
     doc = {
         "room": room,
         "username": username[:50],
         "content": content[:1000],
-        "created_at": datetime.now(timezone.utc),
+        "created_at": utcnow_ms(),
     }
-    res = await db()["messages"].insert_one(doc)
+    t0 = time.perf_counter()
+    res = await database["messages"].insert_one(doc)
+    _INSERT_ONE_SECONDS.observe(time.perf_counter() - t0)
     doc["_id"] = res.inserted_id
-    return serialize(doc)
+    item = Message.from_doc(doc)
+    await fanout.publish(room, {"type": "message", "item": item})
+    await history.write_through(room, item)
+    return item.to_dict()
+
+@app.post("/rooms/{room}/messages/bulk")
+async def bulk_messages(
+    room: str,
+    request: Request,
+    database: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """
+    Ingestão em massa: corpo NDJSON (application/x-ndjson, lido em streaming)
+    ou array JSON. Grava em blocos com insert_many(ordered=False), envia cada
+    bloco aos WebSockets da sala em um único frame `batch` e retorna o
+    resultado de cada item (`index`, `ok`, `_id` ou `error`).
+    """
+    if not await limiter.allow(room, limiter.sender(request.client.host)):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        items = iter_ndjson(request.stream())
+    else:
+        items = iter_json_array(request.stream())
+
+    async def deliver(chunk: list):
+        _REST_MESSAGES_IN.value += len(chunk)
+        await fanout.publish(room, {"type": "batch", "items": chunk})
+        await history.write_through_many(room, chunk)
+
+    try:
+        return await ingest(database["messages"], room, items, deliver)
+    except BulkTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # ______________________________________________________________________________________________________
 
 # --- WS ---
+async def receive_payload(ws: WebSocket) -> dict:
+    """Recebe um frame do cliente: texto JSON ou binário MessagePack compacto."""
+    message = await ws.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return decode_binary(message["bytes"])
+    return loads(message["text"])
+
 @app.websocket("/ws/{room}")
-async def ws_room(ws: WebSocket, room: str):
-    """Gerencia conexão WebSocket da sala."""
-    await manager.connect(room, ws)
+async def ws_room(
+    ws: WebSocket,
+    room: str,
+    username: str = Query("anon"),
+    password: Optional[str] = Query(None),
+    last_id: Optional[str] = Query(None),
+    database: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """
+    Gerencia conexão WebSocket da sala. O codec (JSON ou MessagePack) e a
+    compressão são negociados por subprotocolo ou query (frames.negotiate).
+    Salas privadas do registro exigem a senha correta; com ROOMS_ENFORCE, a
+    sala também precisa existir no registro (sem ele, salas não registradas
+    continuam abertas). Sem acesso, o handshake é recusado antes do accept.
+    Na reconexão, `last_id` (última mensagem recebida) troca o histórico
+    inicial por um frame `replay` só com as mensagens perdidas.
+    Conexões sem nenhum frame recebido após o ping do keepalive são
+    recolhidas pelo agendador (keepalive.py) com a mesma limpeza do fim normal.
+    """
+    try:
+        since_id = parse_cursor(last_id, "last_id") if last_id else None
+    except ValueError:
+        since_id = None
+    access = await registry.check_access(room, password)
+    if access is False or (access is None and ROOMS_ENFORCE):
+        await ws.close(code=4404 if access is None else 4403)
+        return
+    codec, _, subprotocol = negotiate(ws.scope)
+    await manager.connect(room, ws, codec, subprotocol)
+    await fanout.join(room)
+    member = PresenceService.member(username[:50], uuid4().hex[:12])
+    # balde do rate limit: IP do cliente (o mesmo das rotas REST)
+    sender = limiter.sender(ws.client.host)
+    presence.join(room, member)
+    closed = False
+
+    async def cleanup():
+        """Libera escritor, presença, fan-out e keepalive da conexão (uma única vez)."""
+        nonlocal closed
+        if closed:
+            return
+        closed = True
+        keepalive.unregister(ws)
+        manager.disconnect(room, ws)
+        presence.leave(room, member)
+        await fanout.leave(room)
+        if not fanout.subscribed(room):
+            # sem assinatura o buffer e o índice da sala deixariam de receber as mensagens dos outros workers
+            history.drop(room)
+            search.drop(room)
+
+    async def reap():
+        await cleanup()
+        await manager.close(room, ws, IDLE_CLOSE_CODE)
+
+    keepalive.register(ws, lambda: manager.ping(room, ws, {"type": "ping"}, keepalive.timeout), reap)
     try:
-        # histórico inicial
-        cursor = db()["messages"].find({"room": room}).sort("_id", -1).limit(20)
-        items = [serialize(d) async for d in cursor]
-        items.reverse()
-        await ws.send_json({"type": "history", "items": items})
+        if since_id is not None:
+            # reconexão: apenas o intervalo perdido (complete=false se excedeu WS_REPLAY_MAX)
+            items, complete = await replay_since(database, room, since_id)
+            await manager.send(room, ws, {"type": "replay", "items": items, "complete": complete})
+        else:
+            # histórico inicial (cache em memória; MongoDB apenas em falta)
+            items = await history.recent(room, 20, lambda n: load_history(database, room, n))
+            await manager.send(room, ws, {"type": "history", "items": items})
 
         while True:
-            payload = await ws.receive_json()
+            payload = await receive_payload(ws)
+            # toda mensagem recebida (inclusive "ping"/"pong") conta como heartbeat
+            presence.heartbeat(room, member)
+            keepalive.touch(ws)
+            if payload.get("type") in ("ping", "pong"):
+                continue
             username = str(payload.get("username", "anon"))[:50]
             content = str(payload.get("content", "")).strip()
             if not content:
                 continue
+            _WS_MESSAGES_IN.value += 1
+            if not await limiter.allow(room, sender):
+                await manager.send(room, ws, {"type": "error", "detail": "Rate limit exceeded"})
+                continue
             doc = {
                 "room": room,
                 "username": username,
                 "content": content,
-                "created_at": datetime.now(timezone.utc),
             }
-            res = await db()["messages"].insert_one(doc)
-            doc["_id"] = res.inserted_id
-            await manager.broadcast(room, {"type": "message", "item": serialize(doc)})
+            # _id e created_at são gerados localmente; a gravação ocorre em lote
+            await writer.submit(doc)
+            item = Message.from_doc(doc)
+            await fanout.publish(room, {"type": "message", "item": item})
+            await history.write_through(room, item)
     except WebSocketDisconnect:
-        manager.disconnect(room, ws)
\ No newline at end of file
+        pass
+    finally:
+        await cleanup()
\ No newline at end of file
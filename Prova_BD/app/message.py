@@ -0,0 +1,134 @@
+"""
+Representação canônica de uma mensagem em memória.
+
+`Message` substitui os dicionários serializados (`_id` em texto, `created_at`
+em ISO) que circulavam entre histórico, cache, busca e broadcast: guarda os
+campos em slots, com `_id` como ObjectId e a data como datetime, e gera sob
+demanda, uma única vez, o texto ISO da data, o JSON e o MessagePack compacto
+da mensagem. Os frames (frames.dumps / frames.pack) embutem essas formas já
+codificadas em vez de serializar a mensagem de novo a cada envio.
+"""
+from datetime import datetime, timezone
+from typing import Optional, Union
+
+from bson import ObjectId
+
+from frames import PreEncoded, compact, dumps, loads, msgpack
+
+# ______________________________________________________________________________________________________
+
+class Message(PreEncoded):
+    """Mensagem de chat com codificações cacheadas (JSON, ISO e msgpack)."""
+    __slots__ = (
+        "oid", "room", "username", "content", "avatar",
+        "_created_at", "_iso", "_json", "_packed",
+    )
+
+    def __init__(
+        self,
+        oid: ObjectId,
+        room: str,
+        username: str,
+        content: str,
+        avatar: Optional[str] = None,
+        created_at: Optional[datetime] = None,
+        iso: Optional[str] = None,
+    ):
+        self.oid = oid
+        self.room = room
+        self.username = username
+        self.content = content
+        self.avatar = avatar
+        self._created_at = created_at
+        self._iso = iso
+        self._json: Optional[str] = None
+        self._packed: Optional[bytes] = None
+
+    # __________________________________________________________________________________________________
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "Message":
+        """Cria a partir de um documento do MongoDB (ou do gravador em lote)."""
+        return cls(
+            doc["_id"],
+            doc.get("room"),
+            doc.get("username"),
+            doc.get("content"),
+            doc.get("avatar"),
+            created_at=doc.get("created_at"),
+        )
+
+    @classmethod
+    def from_item(cls, item: dict) -> "Message":
+        """Cria a partir da forma serializada (`_id` em texto, `created_at` em ISO)."""
+        return cls(
+            ObjectId(item["_id"]),
+            item.get("room"),
+            item.get("username"),
+            item.get("content"),
+            item.get("avatar"),
+            iso=item.get("created_at"),
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> "Message":
+        """Cria a partir do JSON gerado por `json`, reaproveitando o texto."""
+        message = cls.from_item(loads(text))
+        message._json = text
+        return message
+
+    @classmethod
+    def coerce(cls, value: Union["Message", dict]) -> "Message":
+        """Aceita uma Message ou a forma serializada (ex.: recebida via Redis)."""
+        return value if isinstance(value, cls) else cls.from_item(value)
+
+    # __________________________________________________________________________________________________
+
+    @property
+    def id(self) -> str:
+        return str(self.oid)
+
+    @property
+    def created_at(self) -> datetime:
+        if self._created_at is None:
+            self._created_at = (
+                datetime.fromisoformat(self._iso) if self._iso else self.oid.generation_time
+            )
+        return self._created_at
+
+    @property
+    def iso(self) -> str:
+        """Data em ISO-8601 com timezone UTC (calculada uma vez)."""
+        if self._iso is None:
+            dt = self.created_at
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            self._iso = dt.isoformat()
+        return self._iso
+
+    # __________________________________________________________________________________________________
+
+    def to_dict(self) -> dict:
+        """Forma serializada (JSON-safe) usada pelos clientes e pelas respostas REST."""
+        d = {
+            "_id": self.id,
+            "room": self.room,
+            "username": self.username,
+            "content": self.content,
+        }
+        if self.avatar is not None:
+            d["avatar"] = self.avatar
+        d["created_at"] = self.iso
+        return d
+
+    @property
+    def json(self) -> str:
+        if self._json is None:
+            self._json = dumps(self.to_dict())
+        return self._json
+
+    @property
+    def packed(self) -> bytes:
+        if self._packed is None:
+            self._packed = msgpack.packb(compact(self.to_dict()), default=str)
+        return self._packed
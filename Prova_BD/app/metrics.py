@@ -0,0 +1,225 @@
+"""
+Métricas no formato texto do Prometheus, sem dependências externas.
+
+Contadores e histogramas são atributos numéricos atualizados pelo próprio
+loop de eventos (sem locks); os histogramas têm baldes fixos pré-alocados e
+cada observação só incrementa posições de uma lista. Valores que já existem
+em outros componentes (filas do WSManager, writer, cache, rate limiter) são
+lidos apenas no momento da coleta, por funções registradas com `collector`.
+"""
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from config import METRICS_LOOP_LAG_INTERVAL
+
+# ______________________________________________________________________________________________________
+
+# Baldes (s) para latências de E/S e (conexões) para o tamanho do fan-out
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# ______________________________________________________________________________________________________
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# ______________________________________________________________________________________________________
+
+class Counter:
+    """Contador monotônico."""
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+class Histogram:
+    """Histograma com baldes fixos: observe() não aloca."""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# ______________________________________________________________________________________________________
+
+class Family:
+    """Métrica com nome, ajuda e filhos por combinação de rótulos."""
+
+    def __init__(self, kind: str, name: str, help: str, labelnames: Tuple[str, ...], factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children: Dict[tuple, object] = {}
+        if not labelnames:
+            self._children[()] = factory()
+
+    def labels(self, *values: str):
+        """Filho dos rótulos; criado uma vez e reutilizado (guarde a referência)."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._factory()
+        return child
+
+    # atalhos para métricas sem rótulos
+    def inc(self, n: int = 1):
+        self._children[()].value += n
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def render(self, out: list):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        for values, child in self._children.items():
+            if self.kind == "counter":
+                out.append(f"{self.name}{_labels(self.labelnames, values)} {child.value}")
+                continue
+            cumulative = 0
+            for bound, n in zip(child.bounds + (float("inf"),), child.counts):
+                cumulative += n
+                names = self.labelnames + ("le",)
+                out.append(
+                    f"{self.name}_bucket{_labels(names, values + (_num(bound),))} {cumulative}"
+                )
+            lbl = _labels(self.labelnames, values)
+            out.append(f"{self.name}_sum{lbl} {child.sum}")
+            out.append(f"{self.name}_count{lbl} {child.count}")
+
+# ______________________________________________________________________________________________________
+
+class Registry:
+    """Conjunto de métricas do processo e coletores lidos na exposição."""
+
+    def __init__(self):
+        self._families: Dict[str, Family] = {}
+        self._collectors: list = []
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Family:
+        return self._add(Family("counter", name, help, tuple(labelnames), Counter))
+
+    def histogram(
+        self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+        labelnames: Iterable[str] = (),
+    ) -> Family:
+        return self._add(Family("histogram", name, help, tuple(labelnames), lambda: Histogram(buckets)))
+
+    def _add(self, family: Family) -> Family:
+        if family.name in self._families:
+            return self._families[family.name]
+        self._families[family.name] = family
+        return family
+
+    def collector(self, name: str, kind: str, help: str, fn: Callable, labelnames: Iterable[str] = ()):
+        """
+        Registra uma métrica lida sob demanda: `fn()` retorna um número ou,
+        com rótulos, um iterável de (tupla de rótulos, valor).
+        """
+        self._collectors.append((name, kind, help, fn, tuple(labelnames)))
+
+    def render(self) -> str:
+        out: list = []
+        for family in self._families.values():
+            family.render(out)
+        for name, kind, help, fn, labelnames in self._collectors:
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"Erro ao coletar métrica {name}: {e}")
+                continue
+            out.append(f"# HELP {name} {help}")
+            out.append(f"# TYPE {name} {kind}")
+            if labelnames:
+                for values, v in value:
+                    out.append(f"{name}{_labels(labelnames, values)} {_num(v)}")
+            else:
+                out.append(f"{name} {_num(value)}")
+        out.append("")
+        return "\n".join(out)
+
+REGISTRY = Registry()
+
+# ______________________________________________________________________________________________________
+# Métricas do caminho das mensagens
+
+MESSAGES_IN = REGISTRY.counter(
+    "chat_messages_in_total", "Mensagens recebidas de clientes", ("transport",)
+)
+BROADCAST_FANOUT = REGISTRY.histogram(
+    "chat_broadcast_fanout_connections", "Conexões alcançadas por broadcast", FANOUT_BUCKETS
+)
+BROADCAST_SECONDS = REGISTRY.histogram(
+    "chat_broadcast_duration_seconds", "Tempo para enfileirar um broadcast em todas as conexões"
+)
+MONGO_SECONDS = REGISTRY.histogram(
+    "chat_mongo_op_duration_seconds", "Latência das operações no MongoDB",
+    labelnames=("op",),
+)
+REDIS_SECONDS = REGISTRY.histogram(
+    "chat_redis_op_duration_seconds", "Latência das chamadas ao Redis",
+    labelnames=("op",),
+)
+SEND_FAILURES = REGISTRY.counter(
+    "chat_ws_send_failures_total", "Falhas de envio a WebSockets", ("component",)
+)
+SEND_DISCONNECTS = REGISTRY.counter(
+    "chat_ws_disconnects_total", "Conexões removidas por falha de envio ou lentidão", ("reason",)
+)
+LOOP_LAG = REGISTRY.histogram(
+    "chat_event_loop_lag_seconds", "Atraso do loop de eventos em relação ao agendado"
+)
+
+# ______________________________________________________________________________________________________
+
+class LoopLagMonitor:
+    """Mede o atraso do loop: quanto um sleep de `interval` passa do previsto."""
+
+    def __init__(self, interval: float = METRICS_LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        observe = LOOP_LAG.observe
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, time.perf_counter() - t0 - self.interval)
+            observe(self.last)
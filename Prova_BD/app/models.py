@@ -1,10 +1,8 @@
 # ______________________________________________________________________________________________________
 # Importações de módulos e tipos
 from pydantic import BaseModel, Field, validator
-from datetime import datetime, timezone
 from typing import Optional
 from bson import ObjectId
-from fastapi import APIRouter, HTTPException
 
 # ______________________________________________________________________________________________________
 # Helpers
@@ -24,29 +22,6 @@ class PyObjectId(ObjectId):
         except Exception:
             raise ValueError("Invalid ObjectId")
 
-def iso(dt: datetime) -> str:
-    """Converte datetime para string ISO-8601 com timezone UTC."""
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.isoformat()
-
-def serialize(doc: dict) -> dict:
-    """Serializa documentos MongoDB em JSON-safe."""
-    return {
-        "id": str(doc["_id"]),
-        "room": doc["room"],
-        "username": doc["username"],
-        "content": doc["content"],
-        "avatar": doc.get("avatar"),
-        "created_at": iso(doc["created_at"]),
-    }
-
-# ______________________________________________________________________________________________________
-# Router e Mock DB
-
-router = APIRouter()
-rooms_db = []  # ⚠️ Mock local, substitua por MongoDB real
-
 # ______________________________________________________________________________________________________
 # Room Models
 
@@ -64,25 +39,6 @@ class RoomJoin(BaseModel):
     """Modelo para entrar em sala privada."""
     password: Optional[str] = None
 
-@router.post("/rooms")
-async def create_room(room: RoomCreate):
-    """Cria uma sala nova."""
-    if any(r['name'] == room.name for r in rooms_db):
-        raise HTTPException(status_code=400, detail="Sala já existe")
-    rooms_db.append(room.dict())
-    return {"success": True}
-
-@router.post("/rooms/{room_name}/join")
-async def join_private_room(room_name: str, data: RoomJoin):
-    """Entra em sala (verifica senha se for privada)."""
-    room = next((r for r in rooms_db if r['name'] == room_name), None)
-    if not room:
-        raise HTTPException(status_code=404, detail="Sala não encontrada")
-    if room['is_private']:
-        if not data.password or data.password != room['password']:
-            raise HTTPException(status_code=403, detail="Senha incorreta")
-    return {"success": True}
-
 # ______________________________________________________________________________________________________
 # Message Models
 
@@ -95,11 +51,15 @@ class MessageIn(BaseModel):
     @validator("username", pre=True, always=True)
     def clean_username(cls, v):
         """Garante username válido e tamanho máximo."""
+        if v is not None and not isinstance(v, str):
+            raise ValueError("username deve ser texto")
         return (v or "anon").strip()[:50]
 
     @validator("content", pre=True, always=True)
     def clean_content(cls, v):
         """Garante conteúdo válido e tamanho máximo."""
+        if v is not None and not isinstance(v, str):
+            raise ValueError("content deve ser texto")
         return (v or "").strip()[:1000]
 
 class MessageOut(BaseModel):
@@ -0,0 +1,78 @@
+"""
+Paginação por cursor (keyset) do histórico de mensagens.
+
+Os cursores são `_id` (ObjectId) e os filtros de tempo são convertidos em
+limites de `_id` (o ObjectId carrega o instante de criação), de modo que
+todas as consultas usam o índice {room: 1, _id: -1} e custam O(limit).
+"""
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# ______________________________________________________________________________________________________
+
+# Campos retornados nas consultas de histórico e exportação
+MESSAGE_PROJECTION = {
+    "room": 1,
+    "username": 1,
+    "content": 1,
+    "avatar": 1,
+    "created_at": 1,
+}
+
+# ______________________________________________________________________________________________________
+
+def parse_cursor(value: str, name: str) -> ObjectId:
+    """Converte o cursor em ObjectId; ValueError se for inválido."""
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise ValueError(f"Cursor inválido em '{name}': {value}")
+
+def _as_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+# ______________________________________________________________________________________________________
+
+def history_query(
+    room: str,
+    before_id: Optional[str] = None,
+    after_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Tuple[dict, int]:
+    """
+    Monta o filtro e a direção de ordenação (-1 mais recentes primeiro,
+    1 mais antigos primeiro) de uma página do histórico da sala.
+
+    - before_id: mensagens anteriores ao cursor (página mais antiga);
+    - after_id: mensagens posteriores ao cursor (página mais nova);
+    - since/until: intervalo de tempo [since, until).
+    """
+    bounds = {}
+    if before_id:
+        bounds["$lt"] = parse_cursor(before_id, "before_id")
+    if after_id:
+        bounds["$gt"] = parse_cursor(after_id, "after_id")
+    if since:
+        lower = ObjectId.from_datetime(_as_utc(since))
+        if "$gt" not in bounds:
+            bounds["$gte"] = lower
+        elif bounds["$gt"] < lower:
+            bounds = {k: v for k, v in bounds.items() if k != "$gt"}
+            bounds["$gte"] = lower
+    if until:
+        upper = ObjectId.from_datetime(_as_utc(until))
+        if "$lt" not in bounds or upper < bounds["$lt"]:
+            bounds["$lt"] = upper
+
+    query = {"room": room}
+    if bounds:
+        query["_id"] = bounds
+    # Só "after_id" pagina para frente; o restante parte das mais recentes
+    direction = 1 if after_id and not before_id else -1
+    return query, direction
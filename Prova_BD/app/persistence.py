@@ -0,0 +1,234 @@
+"""
+Persistência write-behind de mensagens no MongoDB.
+
+O `_id` e o `created_at` são atribuídos localmente, a mensagem é liberada
+para broadcast imediatamente e as gravações são agrupadas em `insert_many`
+quando o lote atinge o tamanho ou o tempo máximo configurado. O `created_at`
+é truncado em milissegundos, a precisão do BSON, para que a cópia em cache
+e a gravada no MongoDB sejam idênticas.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from metrics import MONGO_SECONDS
+from config import (
+    MONGO_WRITE_BATCH_SIZE,
+    MONGO_WRITE_FLUSH_MS,
+    MONGO_WRITE_MAX_PENDING,
+    MONGO_WRITE_MAX_RETRIES,
+)
+
+# ______________________________________________________________________________________________________
+
+# Código de erro do MongoDB para chave duplicada (documento já gravado)
+DUPLICATE_KEY = 11000
+
+# Latência do insert_many em lote
+_INSERT_MANY_SECONDS = MONGO_SECONDS.labels("insert_many")
+
+# ______________________________________________________________________________________________________
+
+def utcnow_ms() -> datetime:
+    """Instante atual em UTC truncado em milissegundos (precisão do MongoDB)."""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def prepare(doc: dict) -> dict:
+    """Atribui `_id` e `created_at` localmente, se ainda não existirem."""
+    doc.setdefault("_id", ObjectId())
+    doc.setdefault("created_at", utcnow_ms())
+    return doc
+
+# ______________________________________________________________________________________________________
+
+class MessageWriter:
+    """
+    Fila de gravação assíncrona para uma coleção.
+
+    - `submit` aguarda apenas quando a fila está cheia (backpressure);
+    - os lotes são gravados com `insert_many(ordered=False)`;
+    - falhas são reenviadas, e duplicatas do `_id` gerado no cliente são
+      tratadas como sucesso (a gravação anterior já foi aplicada);
+    - `stop` grava tudo o que estiver pendente antes de encerrar; mensagens
+      enviadas depois disso são descartadas (com aviso), sem erro ao chamador.
+    """
+
+    def __init__(
+        self,
+        collection: Callable,
+        batch_size: int = MONGO_WRITE_BATCH_SIZE,
+        flush_ms: int = MONGO_WRITE_FLUSH_MS,
+        max_pending: int = MONGO_WRITE_MAX_PENDING,
+        max_retries: int = MONGO_WRITE_MAX_RETRIES,
+    ):
+        # Função que retorna a coleção (permite inicialização preguiçosa do cliente)
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_retries = max_retries
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # métricas acumuladas
+        self.written = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.batches = 0
+        self.dropped = 0
+
+    # __________________________________________________________________________________________________
+
+    def start(self):
+        """Inicia a tarefa de gravação (idempotente)."""
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    # __________________________________________________________________________________________________
+
+    async def submit(self, doc: dict) -> dict:
+        """
+        Prepara o documento e o coloca na fila de gravação.
+        Retorna o documento já com `_id` e `created_at`. Após `stop` (desligamento)
+        o documento não é gravado.
+        """
+        prepare(doc)
+        if self._closing:
+            self.dropped += 1
+            print(f"MessageWriter encerrado: mensagem {doc['_id']} não será gravada")
+            return doc
+        self.start()
+        await self.queue.put(doc)
+        if self._closing and (self._task is None or self._task.done()):
+            # ficou bloqueado na fila cheia durante o `stop` e a tarefa já terminou
+            for late in self._drain():
+                self.dropped += 1
+                print(f"MessageWriter encerrado: mensagem {late['_id']} não será gravada")
+        return doc
+
+    # __________________________________________________________________________________________________
+
+    async def stop(self):
+        """Grava o que estiver pendente e encerra a tarefa de gravação."""
+        self._closing = True
+        if self._task is None:
+            return
+        await self._task
+        self._task = None
+        # `submit` que estavam bloqueados na fila cheia podem ter enfileirado depois
+        # que a tarefa viu a fila vazia
+        late = self._drain()
+        if late:
+            await self._flush(late)
+
+    def _drain(self) -> list:
+        """Retira da fila tudo o que estiver pendente."""
+        items = []
+        while not self.queue.empty():
+            items.append(self.queue.get_nowait())
+        return items
+
+    # __________________________________________________________________________________________________
+
+    async def _run(self):
+        """Agrupa documentos da fila em lotes por tamanho ou tempo e grava."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                first = await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                if self._closing and self.queue.empty():
+                    return
+                continue
+
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0 or self._closing:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # a tarefa de gravação não pode morrer: a fila encheria e `submit` travaria
+                self.failed += len(batch)
+                print(f"Erro ao gravar lote de mensagens: {e}")
+
+    # __________________________________________________________________________________________________
+
+    async def _flush(self, batch: list):
+        """Grava o lote com reenvio; duplicatas de `_id` contam como gravadas."""
+        self.batches += 1
+        pending = batch
+        for attempt in range(self.max_retries + 1):
+            try:
+                t0 = time.perf_counter()
+                await self.collection().insert_many(pending, ordered=False)
+                _INSERT_MANY_SECONDS.observe(time.perf_counter() - t0)
+                self.written += len(pending)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                dup = {err["index"] for err in errors if err.get("code") == DUPLICATE_KEY}
+                failed = {err["index"] for err in errors} - dup
+                self.duplicates += len(dup)
+                self.written += len(pending) - len(failed)
+                if not failed:
+                    return
+                pending = [pending[i] for i in sorted(failed)]
+            except PyMongoError as e:
+                print(f"Erro ao gravar lote de mensagens (tentativa {attempt + 1}): {e}")
+            except Exception as e:
+                # erro fora do MongoDB (ex.: InvalidDocument): reenviar o lote não adianta;
+                # grava um a um para perder só os documentos com problema
+                print(f"Erro inesperado ao gravar lote de mensagens: {e}")
+                await self._flush_each(pending)
+                return
+            await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0))
+
+        self.failed += len(pending)
+        print(f"Descartando {len(pending)} mensagens após {self.max_retries} tentativas")
+
+    # __________________________________________________________________________________________________
+
+    async def _flush_each(self, docs: list):
+        """Grava documento a documento; os que falharem são contados em `failed`."""
+        for doc in docs:
+            try:
+                await self.collection().insert_one(doc)
+                self.written += 1
+            except DuplicateKeyError:
+                self.duplicates += 1
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Descartando mensagem {doc.get('_id')}: {e}")
+
+    # __________________________________________________________________________________________________
+
+    def stats(self) -> dict:
+        """Métricas da fila de gravação."""
+        return {
+            "pending": self.queue.qsize(),
+            "written": self.written,
+            "duplicates": self.duplicates,
+            "failed": self.failed,
+            "batches": self.batches,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,188 @@
+"""
+Presença por usuário e conexão com heartbeats.
+
+Cada conexão é um membro `usuario|conexao` do sorted set `presence:{room}`
+com o instante do último heartbeat como score. Os heartbeats são anotados
+em memória (sem rede) e gravados em lote a cada `flush_interval`; entradas
+mais antigas que `ttl` são removidas em lote com ZREMRANGEBYSCORE.
+As consultas de presença são servidas de um cache local de vida curta.
+Sem cliente Redis, a presença fica restrita ao processo.
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+import redis.asyncio as redis
+
+from config import PRESENCE_TTL, PRESENCE_FLUSH_INTERVAL, PRESENCE_CACHE_TTL
+from metrics import REDIS_SECONDS
+
+# Latência do pipeline de gravação da presença
+_FLUSH_SECONDS = REDIS_SECONDS.labels("presence_flush")
+
+# ______________________________________________________________________________________________________
+
+class PresenceService:
+    """Registro de presença por sala com heartbeats agrupados."""
+
+    def __init__(
+        self,
+        client: Optional[redis.Redis] = None,
+        ttl: float = PRESENCE_TTL,
+        flush_interval: float = PRESENCE_FLUSH_INTERVAL,
+        cache_ttl: float = PRESENCE_CACHE_TTL,
+    ):
+        self.redis = client
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        # sala -> {membro: último heartbeat} das conexões deste processo
+        self._local: Dict[str, Dict[str, float]] = {}
+        # heartbeats e saídas ainda não gravados no Redis
+        self._dirty: Dict[str, Dict[str, float]] = {}
+        self._left: Dict[str, set] = {}
+        # (sala, limite) -> (expira_em, resposta)
+        self._cache: Dict[tuple, tuple] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # __________________________________________________________________________________________________
+
+    @staticmethod
+    def member(user: str, conn_id: str) -> str:
+        return f"{user}|{conn_id}"
+
+    @staticmethod
+    def _key(room: str) -> str:
+        return f"presence:{room}"
+
+    # __________________________________________________________________________________________________
+
+    def join(self, room: str, member: str):
+        """Registra a conexão na sala (equivale ao primeiro heartbeat)."""
+        self.heartbeat(room, member)
+        if self.redis is not None and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._flusher())
+
+    def heartbeat(self, room: str, member: str):
+        """Anota o heartbeat da conexão; gravado no próximo flush."""
+        now = time.time()
+        self._local.setdefault(room, {})[member] = now
+        if self.redis is not None:
+            self._dirty.setdefault(room, {})[member] = now
+            left = self._left.get(room)
+            if left:
+                left.discard(member)
+
+    def leave(self, room: str, member: str):
+        """Remove a conexão da sala."""
+        conns = self._local.get(room)
+        if conns is not None:
+            conns.pop(member, None)
+            if not conns:
+                self._local.pop(room, None)
+        if self.redis is not None:
+            dirty = self._dirty.get(room)
+            if dirty:
+                dirty.pop(member, None)
+            self._left.setdefault(room, set()).add(member)
+
+    # __________________________________________________________________________________________________
+
+    async def flush(self):
+        """
+        Grava heartbeats e saídas pendentes e remove entradas expiradas,
+        tudo em um único pipeline.
+        """
+        if self.redis is None:
+            return
+        dirty, self._dirty = self._dirty, {}
+        left, self._left = self._left, {}
+        # salas com conexões locais também são aparadas (TTL de conexões mortas)
+        rooms = set(dirty) | set(left) | set(self._local)
+        if not rooms:
+            return
+        cutoff = time.time() - self.ttl
+        t0 = time.perf_counter()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for room in rooms:
+                key = self._key(room)
+                if dirty.get(room):
+                    pipe.zadd(key, dirty[room])
+                if left.get(room):
+                    pipe.zrem(key, *left[room])
+                pipe.zremrangebyscore(key, "-inf", cutoff)
+                pipe.expire(key, int(self.ttl * 2))
+            await pipe.execute()
+        _FLUSH_SECONDS.observe(time.perf_counter() - t0)
+
+    async def _flusher(self):
+        """Grava periodicamente os heartbeats pendentes."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Erro ao gravar presença: {e}")
+
+    async def stop(self):
+        """Encerra o flush periódico gravando o que estiver pendente."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # conexões deste processo deixam de estar online
+        for room, conns in self._local.items():
+            for member in conns:
+                self._left.setdefault(room, set()).add(member)
+            self._dirty.pop(room, None)
+        self._local.clear()
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Erro ao gravar presença: {e}")
+
+    # __________________________________________________________________________________________________
+
+    async def online(self, room: str, limit: int = 100) -> dict:
+        """
+        Retorna o número de conexões online e até `limit` usuários distintos
+        (os mais recentes), servido do cache local por `cache_ttl` segundos.
+        """
+        now = time.time()
+        cached = self._cache.get((room, limit))
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        cutoff = now - self.ttl
+        if self.redis is None:
+            conns = self._local.get(room, {})
+            alive = sorted(
+                ((ts, m) for m, ts in conns.items() if ts >= cutoff), reverse=True
+            )
+            count = len(alive)
+            members = [m for _, m in alive[: limit * 4]]
+        else:
+            key = self._key(room)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zcount(key, cutoff, "+inf")
+                pipe.zrevrangebyscore(key, "+inf", cutoff, start=0, num=limit * 4)
+                count, members = await pipe.execute()
+
+        users = []
+        seen = set()
+        for m in members:
+            user = m.rsplit("|", 1)[0]
+            if user not in seen:
+                seen.add(user)
+                users.append(user)
+                if len(users) >= limit:
+                    break
+
+        result = {"room": room, "connections": count, "users": users}
+        self._cache[(room, limit)] = (now + self.cache_ttl, result)
+        if len(self._cache) > 10000:
+            self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+        return result
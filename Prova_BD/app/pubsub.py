@@ -0,0 +1,133 @@
+"""
+Assinante Redis Pub/Sub compartilhado pelo processo.
+
+Uma única conexão `pubsub()` atende todas as salas locais: cada sala é
+assinada por contagem de referências e as mensagens chegam por iterador
+assíncrono (`listen`), sem polling.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+import redis.asyncio as redis
+
+# ______________________________________________________________________________________________________
+
+class RedisSubscriber:
+    """
+    Mantém uma conexão Pub/Sub por processo e despacha cada mensagem
+    recebida para `on_message(room, data)`.
+
+    Com `pattern=True` assina `{prefix}*` uma única vez e filtra localmente
+    as salas sem conexões, útil quando há muitas salas ativas por processo.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        on_message: Callable[[str, str], Awaitable[None]],
+        prefix: str = "chat:",
+        pattern: bool = False,
+    ):
+        self.client = client
+        self.on_message = on_message
+        self.prefix = prefix
+        self.pattern = pattern
+        self.refs: Dict[str, int] = {}
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    # __________________________________________________________________________________________________
+
+    def _channel(self, room: str) -> str:
+        return f"{self.prefix}{room}"
+
+    # __________________________________________________________________________________________________
+
+    async def subscribe(self, room: str):
+        """Incrementa a referência da sala e assina o canal na primeira."""
+        async with self._lock:
+            self.refs[room] = self.refs.get(room, 0) + 1
+            if self.refs[room] > 1:
+                return
+            if self._pubsub is None:
+                self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            if self.pattern:
+                if len(self.refs) == 1:
+                    await self._pubsub.psubscribe(f"{self.prefix}*")
+            else:
+                await self._pubsub.subscribe(self._channel(room))
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self._run())
+
+    # __________________________________________________________________________________________________
+
+    async def unsubscribe(self, room: str):
+        """Decrementa a referência e cancela a assinatura quando chega a zero."""
+        async with self._lock:
+            count = self.refs.get(room, 0) - 1
+            if count > 0:
+                self.refs[room] = count
+                return
+            if self.refs.pop(room, None) is None or self._pubsub is None:
+                return
+            if self.pattern:
+                if not self.refs:
+                    await self._pubsub.punsubscribe(f"{self.prefix}*")
+            else:
+                await self._pubsub.unsubscribe(self._channel(room))
+
+    # __________________________________________________________________________________________________
+
+    async def _resubscribe(self):
+        """Refaz as assinaturas após perda da conexão com o Redis."""
+        if self.pattern:
+            await self._pubsub.psubscribe(f"{self.prefix}*")
+        else:
+            await self._pubsub.subscribe(*[self._channel(r) for r in self.refs])
+
+    # __________________________________________________________________________________________________
+
+    async def _run(self):
+        """Consome as mensagens do Pub/Sub e despacha para as salas locais."""
+        while self.refs:
+            try:
+                async for message in self._pubsub.listen():
+                    if message["type"] not in ("message", "pmessage"):
+                        continue
+                    room = message["channel"][len(self.prefix):]
+                    if room not in self.refs:
+                        continue
+                    try:
+                        await self.on_message(room, message["data"])
+                    except Exception as e:
+                        print(f"Erro ao despachar mensagem Pub/Sub: {e}")
+                # listen() termina quando não há mais assinaturas
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Erro no assinante Pub/Sub: {e}")
+                await asyncio.sleep(1.0)
+                try:
+                    async with self._lock:
+                        if self.refs:
+                            await self._resubscribe()
+                except Exception:
+                    pass
+
+    # __________________________________________________________________________________________________
+
+    async def close(self):
+        """Encerra a tarefa de escuta e a conexão Pub/Sub."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+        self.refs.clear()
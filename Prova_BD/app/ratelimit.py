@@ -0,0 +1,190 @@
+"""
+Rate limiter distribuído por token bucket.
+
+Cada remetente (sala + cliente) tem um balde com `capacity` fichas que se
+repõem a `refill` fichas por segundo. O remetente (`sender`) é o IP do
+cliente: o nome de usuário é escolhido pelo próprio cliente (query ou
+corpo) e trocá-lo a cada envio daria um balde novo a cada mensagem. Todas
+as rotas e o WebSocket usam o mesmo `sender`, então o mesmo cliente tem
+um único balde por sala.
+
+Com Redis, a verificação é um único script Lua (uma ida ao servidor,
+atômica, com o relógio do próprio Redis). Um balde local por processo
+rejeita rajadas óbvias sem consultar o Redis: ele é igualado ao saldo
+global a cada resposta do script e se repõe no mesmo ritmo, então nunca
+fica abaixo do global (as mensagens de outros workers só baixam o global)
+e, se está vazio, o global também está. Com o Redis indisponível, vale a
+decisão local; sem Redis, os baldes locais decidem sozinhos.
+"""
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import redis.asyncio as redis
+
+from config import (
+    REDIS_URL,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_CAPACITY,
+    RATE_LIMIT_REFILL,
+    RATE_LIMIT_LOCAL_KEYS,
+)
+
+# ______________________________________________________________________________________________________
+
+# Trecho Lua do token bucket.
+# KEYS[1]: chave do balde (hash tokens/ts) | ARGV[1]: capacidade, ARGV[2]: reposição/s, ARGV[3]: custo
+# Define as variáveis locais `allowed` (0/1) e `tokens` (saldo após a verificação).
+TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill) + 1)
+"""
+
+RATE_LIMIT_SCRIPT = TOKEN_BUCKET + "return {allowed, tostring(tokens)}\n"
+
+# ______________________________________________________________________________________________________
+
+class RateLimiter:
+    """
+    Token bucket com verificação local (sem rede) seguida do Redis.
+    Sem cliente Redis, funciona apenas com os baldes locais.
+    """
+
+    def __init__(
+        self,
+        client: Optional[redis.Redis] = None,
+        capacity: float = RATE_LIMIT_CAPACITY,
+        refill: float = RATE_LIMIT_REFILL,
+        max_local_keys: int = RATE_LIMIT_LOCAL_KEYS,
+    ):
+        self.redis = client
+        self.capacity = capacity
+        self.refill = refill
+        self.max_local_keys = max_local_keys
+        # chave -> [fichas, instante da última atualização]
+        self._local: "OrderedDict[str, list]" = OrderedDict()
+        self._script = client.register_script(RATE_LIMIT_SCRIPT) if client is not None else None
+
+        # métricas acumuladas
+        self.allowed = 0
+        self.rejected_local = 0
+        self.rejected_remote = 0
+
+    # __________________________________________________________________________________________________
+
+    @staticmethod
+    def key(room: str, user: str) -> str:
+        return f"rl:{room}:{user}"
+
+    @staticmethod
+    def sender(host: Optional[str]) -> str:
+        """Identidade do remetente: o IP do cliente (não pode ser escolhido por ele)."""
+        return f"ip:{host or 'unknown'}"
+
+    # __________________________________________________________________________________________________
+
+    def _bucket(self, key: str) -> list:
+        """Retorna o balde local da chave, já reposto até o instante atual."""
+        now = time.monotonic()
+        bucket = self._local.get(key)
+        if bucket is None:
+            bucket = [self.capacity, now]
+            self._local[key] = bucket
+            if len(self._local) > self.max_local_keys:
+                self._local.popitem(last=False)
+        else:
+            self._local.move_to_end(key)
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill)
+            bucket[1] = now
+        return bucket
+
+    # __________________________________________________________________________________________________
+
+    def local_allow(self, key: str, cost: float = 1.0) -> bool:
+        """Consome do balde local; False significa limite certamente excedido."""
+        bucket = self._bucket(key)
+        if bucket[0] < cost:
+            self.rejected_local += 1
+            return False
+        bucket[0] -= cost
+        return True
+
+    # __________________________________________________________________________________________________
+
+    def sync(self, key: str, remote_tokens: float):
+        """Ajusta o balde local ao saldo global."""
+        bucket = self._bucket(key)
+        bucket[0] = remote_tokens
+
+    # __________________________________________________________________________________________________
+
+    async def allow(self, room: str, user: str, cost: float = 1.0) -> bool:
+        """
+        Verifica o limite do remetente (`sender`): balde local e, se passar,
+        o Redis (quando configurado), que dá a decisão final.
+        """
+        key = self.key(room, user)
+        if not self.local_allow(key, cost):
+            return False
+        if self._script is None:
+            self.allowed += 1
+            return True
+        try:
+            allowed, tokens = await self._script(
+                keys=[key], args=[self.capacity, self.refill, cost]
+            )
+        except Exception as e:
+            # Redis indisponível: vale a decisão local
+            print(f"Erro no rate limiter (Redis): {e}")
+            self.allowed += 1
+            return True
+        # o balde local passa a refletir o saldo global (já com outros workers)
+        self.sync(key, float(tokens))
+        if not int(allowed):
+            self.rejected_remote += 1
+            return False
+        self.allowed += 1
+        return True
+
+    # __________________________________________________________________________________________________
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis" if self.redis is not None else "local",
+            "local_keys": len(self._local),
+            "allowed": self.allowed,
+            "rejected_local": self.rejected_local,
+            "rejected_remote": self.rejected_remote,
+        }
+
+# ______________________________________________________________________________________________________
+
+_limiter: Optional[RateLimiter] = None
+
+def get_limiter() -> RateLimiter:
+    """Limiter compartilhado do processo (REST, WebSocket e rotas)."""
+    global _limiter
+    if _limiter is None:
+        client = None
+        if RATE_LIMIT_BACKEND == "redis":
+            client = redis.from_url(REDIS_URL, decode_responses=True)
+        _limiter = RateLimiter(client)
+    return _limiter
@@ -1,64 +1,354 @@
 import os
+import sys
+import gzip
 import json
+import zlib
+import argparse
+import threading
+import queue
 import redis
 from models import MessageIn, MessageOut
 
 # ______________________________________________________________________________________________________
 
-def read_value(r: redis.Redis, key: str, t: str):
+# Quantidade de elementos lidos/gravados por vez em coleções grandes
+CHUNK = 1000
+
+# Tipos com leitura paginada (o valor é emitido em várias partes)
+COLLECTIONS = ("hash", "list", "set", "zset", "stream")
+
+# ______________________________________________________________________________________________________
+
+def connect() -> redis.Redis:
+    """Conecta ao Redis usando as variáveis de ambiente."""
+    return redis.Redis(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        db=int(os.getenv("REDIS_DB", "0")),
+        password=os.getenv("REDIS_PASSWORD"),
+        decode_responses=True  # Retorna strings ao invés de bytes
+    )
+
+def open_output(path: str, compress: bool):
+    """Abre o destino do dump (stdout, arquivo ou arquivo gzip)."""
+    if path in (None, "-"):
+        if compress:
+            return gzip.open(sys.stdout.buffer, "wt", encoding="utf-8")
+        return sys.stdout
+    if compress or path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+def open_input(path: str):
+    """Abre o arquivo do dump (detecta gzip pela extensão)."""
+    if path in (None, "-"):
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+# ______________________________________________________________________________________________________
+
+def read_parts(r: redis.Redis, key: str, t: str, size: int):
     """
-    Lê o valor da chave no Redis de acordo com seu tipo.
+    Gera o valor de uma coleção grande em partes de até CHUNK elementos
+    (LRANGE em blocos, HSCAN, SSCAN, ZSCAN e XRANGE com continuação).
     """
-    if t == "string":
-        return r.get(key)
-    if t == "hash":
-        return r.hgetall(key)
     if t == "list":
-        return r.lrange(key, 0, -1)
-    if t == "set":
-        return sorted(r.smembers(key))
-    if t == "zset":
-        return r.zrange(key, 0, -1, withscores=True)
-    if t == "stream":
-        return r.xrange(key, min="-", max="+", count=100)
-    return f"<tipo '{t}' não tratado>"
+        for start in range(0, size, CHUNK):
+            part = r.lrange(key, start, start + CHUNK - 1)
+            if not part:
+                break
+            yield part
+    elif t == "hash":
+        cursor = 0
+        while True:
+            cursor, part = r.hscan(key, cursor, count=CHUNK)
+            if part:
+                yield part
+            if cursor == 0:
+                break
+    elif t == "set":
+        cursor = 0
+        while True:
+            cursor, part = r.sscan(key, cursor, count=CHUNK)
+            if part:
+                yield sorted(part)
+            if cursor == 0:
+                break
+    elif t == "zset":
+        cursor = 0
+        while True:
+            cursor, part = r.zscan(key, cursor, count=CHUNK)
+            if part:
+                yield [list(p) for p in part]
+            if cursor == 0:
+                break
+    elif t == "stream":
+        start = "-"
+        while True:
+            part = r.xrange(key, min=start, max="+", count=CHUNK)
+            if not part:
+                break
+            yield [list(p) for p in part]
+            if len(part) < CHUNK:
+                break
+            start = f"({part[-1][0]}"
+
+# ______________________________________________________________________________________________________
+
+def dump_batch(r: redis.Redis, keys: list, out):
+    """
+    Exporta um lote de chaves do SCAN:
+    1) TYPE e PTTL de todas as chaves em um pipeline;
+    2) tamanho de cada coleção (e o valor das strings) em outro pipeline;
+    3) coleções pequenas lidas inteiras em um terceiro pipeline;
+    coleções grandes são paginadas uma a uma.
+    """
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+        pipe.pttl(key)
+    meta = pipe.execute()
+    types = meta[0::2]
+    ttls = meta[1::2]
+
+    pipe = r.pipeline(transaction=False)
+    for key, t in zip(keys, types):
+        if t == "string":
+            pipe.get(key)
+        elif t == "hash":
+            pipe.hlen(key)
+        elif t == "list":
+            pipe.llen(key)
+        elif t == "set":
+            pipe.scard(key)
+        elif t == "zset":
+            pipe.zcard(key)
+        elif t == "stream":
+            pipe.xlen(key)
+        else:
+            pipe.exists(key)
+    info = pipe.execute()
+
+    small = [(k, t, ttl) for k, t, ttl, n in zip(keys, types, ttls, info)
+             if t in COLLECTIONS and n <= CHUNK]
+    pipe = r.pipeline(transaction=False)
+    for key, t, _ in small:
+        if t == "hash":
+            pipe.hgetall(key)
+        elif t == "list":
+            pipe.lrange(key, 0, -1)
+        elif t == "set":
+            pipe.smembers(key)
+        elif t == "zset":
+            pipe.zrange(key, 0, -1, withscores=True)
+        elif t == "stream":
+            pipe.xrange(key, min="-", max="+")
+    small_values = dict(zip([k for k, _, _ in small], pipe.execute())) if small else {}
+
+    for key, t, ttl, n in zip(keys, types, ttls, info):
+        if t == "none" or (t == "string" and n is None):
+            continue  # expirou entre o SCAN e a leitura (ou entre o TYPE e o GET)
+        # PTTL em ms ("pttl"); dumps antigos trazem "ttl" em segundos
+        record = {"key": key, "type": t, "pttl": ttl, "part": 0}
+        if t == "string":
+            record["value"] = n
+            write_record(out, record)
+        elif t not in COLLECTIONS:
+            record["value"] = None
+            record["error"] = f"<tipo '{t}' não tratado>"
+            write_record(out, record)
+        elif key in small_values:
+            value = small_values[key]
+            if t == "set":
+                value = sorted(value)
+            elif t in ("zset", "stream"):
+                value = [list(p) for p in value]
+            record["value"] = value
+            write_record(out, record)
+        else:
+            for i, part in enumerate(read_parts(r, key, t, n)):
+                record["part"] = i
+                record["value"] = part
+                write_record(out, record)
+
+def write_record(out, record: dict):
+    """Escreve um registro NDJSON."""
+    out.write(json.dumps(record, ensure_ascii=False))
+    out.write("\n")
+
+# ______________________________________________________________________________________________________
+
+def dump(args):
+    """
+    Percorre o keyspace com SCAN e escreve um registro NDJSON por chave
+    (ou por parte, em coleções grandes), sem acumular o dump em memória.
+    """
+    r = connect()
+    out = open_output(args.output, args.gzip)
+    try:
+        batch = []
+        # Itera com SCAN para evitar travar o servidor em bases grandes
+        for key in r.scan_iter(match=args.match, count=args.count):
+            batch.append(key)
+            if len(batch) >= args.count:
+                dump_batch(r, batch, out)
+                batch = []
+        if batch:
+            dump_batch(r, batch, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        else:
+            out.flush()
+
+# ______________________________________________________________________________________________________
+
+def restore_record(pipe, record: dict):
+    """Enfileira no pipeline os comandos que recriam um registro do dump."""
+    key, t, value = record["key"], record["type"], record.get("value")
+    first = record.get("part", 0) == 0
+    if first:
+        pipe.delete(key)
+    if t == "string":
+        if value is None:
+            return  # chave expirada gravada por dumps antigos
+        pipe.set(key, value)
+    elif t == "hash" and value:
+        pipe.hset(key, mapping=value)
+    elif t == "list" and value:
+        pipe.rpush(key, *value)
+    elif t == "set" and value:
+        pipe.sadd(key, *value)
+    elif t == "zset" and value:
+        pipe.zadd(key, {member: score for member, score in value})
+    elif t == "stream" and value:
+        for entry_id, fields in value:
+            pipe.xadd(key, fields, id=entry_id)
+    if "pttl" in record:
+        pttl = record["pttl"]
+    else:
+        # formato anterior: TTL em segundos
+        ttl = record.get("ttl")
+        pttl = ttl * 1000 if ttl is not None and ttl > 0 else None
+    if first and pttl is not None and pttl > 0:
+        pipe.pexpire(key, pttl)
+
+def restore_worker(q: queue.Queue, batch_size: int, counter: list, lock: threading.Lock,
+                   errors: list, failed: threading.Event):
+    """
+    Consome registros da fila e grava em pipelines de `batch_size` registros.
+    Em erro, registra a falha, sinaliza `failed` e continua esvaziando a fila
+    (sem gravar) para o leitor nunca ficar bloqueado no `put`.
+    """
+    pipe = None
+    pending = 0
+    while True:
+        record = q.get()
+        if record is None:
+            break
+        if failed.is_set():
+            continue
+        try:
+            if pipe is None:
+                pipe = connect().pipeline(transaction=False)
+            restore_record(pipe, record)
+            pending += 1
+            if pending >= batch_size:
+                pipe.execute()
+                with lock:
+                    counter[0] += pending
+                pending = 0
+        except Exception as e:
+            with lock:
+                errors.append(f"{record.get('key')}: {e}")
+            failed.set()
+    if pending and not failed.is_set():
+        try:
+            pipe.execute()
+            with lock:
+                counter[0] += pending
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            failed.set()
+
+def restore(args):
+    """
+    Restaura um dump NDJSON em paralelo. Cada chave vai sempre para o mesmo
+    worker (hash da chave), preservando a ordem das suas partes. Se algum
+    worker falhar, a leitura para e o processo termina com código 1.
+    """
+    queues = [queue.Queue(maxsize=args.batch * 4) for _ in range(args.workers)]
+    counter = [0]
+    lock = threading.Lock()
+    errors: list = []
+    failed = threading.Event()
+    threads = [
+        threading.Thread(
+            target=restore_worker, args=(q, args.batch, counter, lock, errors, failed), daemon=True
+        )
+        for q in queues
+    ]
+    for th in threads:
+        th.start()
+
+    src = open_input(args.input)
+    try:
+        for line in src:
+            if failed.is_set():
+                break
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("error"):
+                continue
+            shard = zlib.crc32(record["key"].encode("utf-8")) % args.workers
+            queues[shard].put(record)
+    finally:
+        for q in queues:
+            q.put(None)
+        for th in threads:
+            th.join()
+        if src is not sys.stdin:
+            src.close()
+    print(f"{counter[0]} registros restaurados", file=sys.stderr)
+    if errors:
+        for error in errors:
+            print(f"Erro ao restaurar: {error}", file=sys.stderr)
+        sys.exit(1)
 
 # ______________________________________________________________________________________________________
 
 def main():
     """
-    Conecta ao Redis, lê todas as chaves usando SCAN, coleta seus dados
-    (tipo, TTL, valor) e imprime um dump JSON formatado.
+    dump (padrão): exporta o Redis em NDJSON, opcionalmente gzip.
+    restore: recria as chaves a partir de um dump NDJSON.
     """
-    host = os.getenv("REDIS_HOST", "localhost")
-    port = int(os.getenv("REDIS_PORT", "6379"))
-    db = int(os.getenv("REDIS_DB", "0"))
-    password = os.getenv("REDIS_PASSWORD")
-
-    r = redis.Redis(
-        host=host,
-        port=port,
-        db=db,
-        password=password,
-        decode_responses=True  # Retorna strings ao invés de bytes
-    )
+    parser = argparse.ArgumentParser(description="Dump/restore incremental do Redis em NDJSON")
+    sub = parser.add_subparsers(dest="command")
 
-    dump = {}
+    p_dump = sub.add_parser("dump", help="exporta o keyspace")
+    p_dump.add_argument("-o", "--output", default="-", help="arquivo de saída (.gz comprime)")
+    p_dump.add_argument("--gzip", action="store_true", help="comprime a saída com gzip")
+    p_dump.add_argument("--match", default="*", help="padrão de chaves do SCAN")
+    p_dump.add_argument("--count", type=int, default=500, help="chaves por lote do SCAN")
 
-    # Itera com SCAN para evitar travar o servidor em bases grandes
-    for key in r.scan_iter(match="*", count=200):
-        t = r.type(key)
-        ttl = r.ttl(key)
-        dump[key] = {
-            "type": t,
-            "ttl": ttl,
-            "value": read_value(r, key, t),
-        }
+    p_restore = sub.add_parser("restore", help="restaura um dump NDJSON")
+    p_restore.add_argument("input", help="arquivo do dump (.gz descomprime)")
+    p_restore.add_argument("--workers", type=int, default=4)
+    p_restore.add_argument("--batch", type=int, default=500, help="registros por pipeline")
 
-    # Imprime JSON legível com indentação e suportando caracteres UTF-8
-    print(json.dumps(dump, ensure_ascii=False, indent=2))
+    args = parser.parse_args()
+    if args.command == "restore":
+        restore(args)
+    else:
+        if args.command is None:
+            args = p_dump.parse_args([])
+        dump(args)
 
 # ______________________________________________________________________________________________________
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,234 @@
+"""
+Registro de salas no MongoDB com cache em memória.
+
+As salas ficam na coleção `rooms` (índice único em `name`). Cada processo
+mantém um dicionário nome -> sala, carregado na inicialização e preenchido
+sob demanda, de modo que a verificação a cada entrada no WebSocket é uma
+consulta O(1) em memória. Criações são avisadas aos demais workers pelo
+canal Redis `rooms:invalidate` (opcional). Senhas de salas privadas são
+guardadas como hash PBKDF2 e verificadas em thread, fora do loop de eventos;
+verificações bem-sucedidas valem por ROOM_AUTH_CACHE_TTL, de modo que uma
+rajada de reconexões não refaz o PBKDF2 a cada entrada.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+import redis.asyncio as redis
+from pymongo.errors import DuplicateKeyError
+
+from config import (
+    REDIS_URL,
+    ROOM_CACHE_REDIS,
+    ROOM_NEGATIVE_TTL,
+    ROOM_PASSWORD_ITERATIONS,
+    ROOM_AUTH_CACHE_TTL,
+)
+from database import mongo
+from pubsub import RedisSubscriber
+
+# ______________________________________________________________________________________________________
+
+# Campos guardados no cache (o hash só é usado na verificação de senha)
+ROOM_PROJECTION = {"name": 1, "is_private": 1, "password_hash": 1, "created_at": 1}
+
+# Canal de invalidação: RedisSubscriber usa prefixo + "sala"
+INVALIDATE_PREFIX = "rooms:"
+INVALIDATE_CHANNEL = "invalidate"
+
+# ______________________________________________________________________________________________________
+
+def hash_password(password: str, iterations: int = ROOM_PASSWORD_ITERATIONS) -> str:
+    """Gera `pbkdf2_sha256$iterações$sal$hash` (bloqueante: use em thread)."""
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+def verify_password(password: str, encoded: str) -> bool:
+    """Compara a senha com o hash em tempo constante (bloqueante: use em thread)."""
+    try:
+        algorithm, iterations, salt, expected = encoded.split("$")
+    except (AttributeError, ValueError):
+        return False
+    if algorithm != "pbkdf2_sha256":
+        return False
+    digest = hashlib.pbkdf2_hmac(
+        "sha256", password.encode("utf-8"), bytes.fromhex(salt), int(iterations)
+    )
+    return hmac.compare_digest(digest.hex(), expected)
+
+# ______________________________________________________________________________________________________
+
+class RoomRegistry:
+    """Salas persistidas no MongoDB com cache local invalidado via Redis."""
+
+    def __init__(self, collection: Callable, client: Optional[redis.Redis] = None):
+        # Função que retorna a coleção (cliente MongoDB compartilhado, inicializado sob demanda)
+        self.collection = collection
+        self.redis = client
+        # nome -> documento da sala; ausências ficam em `_missing` (nome -> expira_em)
+        self._rooms: Dict[str, dict] = {}
+        self._missing: Dict[str, float] = {}
+        # senhas já verificadas: HMAC(hash da sala + senha) -> expira_em; a chave do
+        # HMAC é do processo e a senha nunca fica em memória em texto claro
+        self._verified: Dict[bytes, float] = {}
+        self._secret = os.urandom(32)
+        self._subscriber = (
+            RedisSubscriber(client, self._on_invalidate, prefix=INVALIDATE_PREFIX)
+            if client is not None else None
+        )
+
+        # métricas acumuladas
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.auth_hits = 0
+        self.auth_checks = 0
+
+    # __________________________________________________________________________________________________
+
+    async def start(self):
+        """Carrega todas as salas e passa a ouvir as invalidações dos outros workers."""
+        async for doc in self.collection().find({}, ROOM_PROJECTION):
+            self._rooms[doc["name"]] = doc
+        if self._subscriber is not None:
+            await self._subscriber.subscribe(INVALIDATE_CHANNEL)
+
+    async def seed(self, names: str):
+        """Garante as salas públicas padrão (nomes separados por vírgula)."""
+        for name in (n.strip() for n in names.split(",")):
+            if name and await self.get(name) is None:
+                try:
+                    await self.create(name)
+                except ValueError:
+                    pass
+
+    async def stop(self):
+        if self._subscriber is not None:
+            await self._subscriber.close()
+
+    # __________________________________________________________________________________________________
+
+    async def get(self, name: str) -> Optional[dict]:
+        """Retorna a sala (cache em memória; MongoDB apenas em falta)."""
+        room = self._rooms.get(name)
+        if room is not None:
+            self.hits += 1
+            return room
+        expires = self._missing.get(name)
+        if expires is not None and expires > time.monotonic():
+            self.hits += 1
+            return None
+        self.misses += 1
+        room = await self.collection().find_one({"name": name}, ROOM_PROJECTION)
+        if room is None:
+            self._missing[name] = time.monotonic() + ROOM_NEGATIVE_TTL
+            if len(self._missing) > 10000:
+                now = time.monotonic()
+                self._missing = {k: v for k, v in self._missing.items() if v > now}
+        else:
+            self._missing.pop(name, None)
+            self._rooms[name] = room
+        return room
+
+    # __________________________________________________________________________________________________
+
+    async def create(self, name: str, is_private: bool = False, password: Optional[str] = None) -> dict:
+        """
+        Cria a sala; ValueError se o nome já existir ou faltar senha em sala privada.
+        O hash da senha é calculado em thread.
+        """
+        if is_private and not password:
+            raise ValueError("Sala privada exige senha")
+        doc = {
+            "name": name,
+            "is_private": is_private,
+            "password_hash": None,
+            "created_at": datetime.now(timezone.utc),
+        }
+        if is_private:
+            doc["password_hash"] = await asyncio.to_thread(hash_password, password)
+        try:
+            await self.collection().insert_one(doc)
+        except DuplicateKeyError:
+            raise ValueError("Sala já existe")
+        self._rooms[name] = doc
+        self._missing.pop(name, None)
+        await self._publish(name)
+        return doc
+
+    # __________________________________________________________________________________________________
+
+    async def check_access(self, name: str, password: Optional[str] = None) -> Optional[bool]:
+        """
+        None se a sala não existe; True/False conforme o acesso
+        (salas públicas sempre; privadas com a senha correta).
+        """
+        room = await self.get(name)
+        if room is None:
+            return None
+        if not room.get("is_private"):
+            return True
+        encoded = room.get("password_hash")
+        if not password or not encoded:
+            return False
+        # o hash da sala entra na chave: troca de senha invalida as verificações antigas
+        key = hmac.new(self._secret, f"{encoded}\0{password}".encode("utf-8"), hashlib.sha256).digest()
+        now = time.monotonic()
+        expires = self._verified.get(key)
+        if expires is not None and expires > now:
+            self.auth_hits += 1
+            return True
+        self.auth_checks += 1
+        ok = await asyncio.to_thread(verify_password, password, encoded)
+        if ok:
+            self._verified[key] = now + ROOM_AUTH_CACHE_TTL
+            if len(self._verified) > 10000:
+                self._verified = {k: v for k, v in self._verified.items() if v > now}
+        return ok
+
+    # __________________________________________________________________________________________________
+
+    async def _publish(self, name: str):
+        """Avisa os outros workers que a sala mudou."""
+        if self.redis is None:
+            return
+        try:
+            await self.redis.publish(INVALIDATE_PREFIX + INVALIDATE_CHANNEL, name)
+        except Exception as e:
+            print(f"Erro ao publicar invalidação de sala: {e}")
+
+    async def _on_invalidate(self, channel: str, name: str):
+        """Descarta a sala do cache; a próxima consulta relê do MongoDB."""
+        self.invalidations += 1
+        self._rooms.pop(name, None)
+        self._missing.pop(name, None)
+
+    # __________________________________________________________________________________________________
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self._rooms),
+            "negative": len(self._missing),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "auth_hits": self.auth_hits,
+            "auth_checks": self.auth_checks,
+        }
+
+# ______________________________________________________________________________________________________
+
+_registry: Optional[RoomRegistry] = None
+
+def get_registry() -> RoomRegistry:
+    """Registro de salas compartilhado do processo."""
+    global _registry
+    if _registry is None:
+        client = redis.from_url(REDIS_URL, decode_responses=True) if ROOM_CACHE_REDIS else None
+        _registry = RoomRegistry(lambda: mongo.db["rooms"], client)
+    return _registry
@@ -2,9 +2,10 @@
 Rotas REST para mensagens (exemplo futuro).
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from models import MessageIn, MessageOut
 from database import save_message  # Supondo que essa função exista e seja async
+from ratelimit import get_limiter
 
 # ______________________________________________________________________________________________________
 
@@ -14,11 +15,16 @@ router = APIRouter()
 # ______________________________________________________________________________________________________
 
 @router.post("/messages", response_model=MessageOut)
-async def create_message(message: MessageIn):
+async def create_message(message: MessageIn, request: Request):
     """
     Endpoint para criar uma nova mensagem via REST.
     Recebe um objeto MessageIn, salva no banco e retorna MessageOut.
     """
+    # Rate limit por remetente (IP do cliente) na sala padrão "messages"
+    limiter = get_limiter()
+    if not await limiter.allow("messages", limiter.sender(request.client.host)):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
     try:
         # Salva a mensagem no banco de dados (coleção "messages")
         await save_message("messages", message.dict())
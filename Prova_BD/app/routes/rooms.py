@@ -0,0 +1,33 @@
+"""
+Rotas REST para salas (registro persistido no MongoDB, ver rooms.RoomRegistry).
+"""
+
+from fastapi import APIRouter, HTTPException
+from models import RoomCreate, RoomJoin
+from rooms import get_registry
+
+# ______________________________________________________________________________________________________
+
+# Instância do roteador para rotas relacionadas a salas
+router = APIRouter()
+
+# ______________________________________________________________________________________________________
+
+@router.post("/rooms", status_code=201)
+async def create_room(room: RoomCreate):
+    """Cria uma sala nova (a senha de sala privada é guardada como hash)."""
+    try:
+        await get_registry().create(room.name, room.is_private, room.password)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True}
+
+@router.post("/rooms/{room_name}/join")
+async def join_private_room(room_name: str, data: RoomJoin):
+    """Entra em sala (verifica senha se for privada)."""
+    access = await get_registry().check_access(room_name, data.password)
+    if access is None:
+        raise HTTPException(status_code=404, detail="Sala não encontrada")
+    if not access:
+        raise HTTPException(status_code=403, detail="Senha incorreta")
+    return {"success": True}
@@ -0,0 +1,338 @@
+"""
+Busca textual no histórico das salas.
+
+A fonte principal é o índice de texto do MongoDB ({room: 1, content: "text"}),
+consultado com `$text` e ordenado por relevância (textScore) e `_id`. Com
+SEARCH_INDEX, as salas buscadas ganham também um índice invertido em memória
+(termo -> mensagens) com as últimas SEARCH_INDEX_SIZE mensagens: é montado
+sob demanda na primeira busca da sala e atualizado a cada mensagem entregue.
+Como o histórico em cache, só vale enquanto o fan-out entrega as mensagens
+da sala a este processo (`tracked`); sem isso a busca vai ao MongoDB.
+
+Com o índice local, a busca tem duas camadas: primeiro as mensagens recentes
+(memória) e, se a sala tiver mensagens mais antigas que a janela indexada,
+o MongoDB a partir dali. O cursor é opaco e registra a camada, o limite da
+janela e a última posição (relevância, `_id`) devolvida.
+"""
+import asyncio
+import base64
+import json
+import re
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from pymongo.errors import ExecutionTimeout
+
+from config import (
+    SEARCH_INDEX,
+    SEARCH_INDEX_ROOMS,
+    SEARCH_INDEX_SIZE,
+    SEARCH_MAX_TIME_MS,
+)
+from message import Message
+from metrics import MONGO_SECONDS
+from pagination import MESSAGE_PROJECTION, parse_cursor
+
+# ______________________________________________________________________________________________________
+
+_TEXT_SEARCH_SECONDS = MONGO_SECONDS.labels("text_search")
+_INDEX_LOAD_SECONDS = MONGO_SECONDS.labels("search_index_load")
+
+_WORD = re.compile(r"\w+")
+
+class SearchTimeout(Exception):
+    """A busca no MongoDB excedeu SEARCH_MAX_TIME_MS."""
+
+# ______________________________________________________________________________________________________
+
+def tokenize(text: str) -> List[str]:
+    """Termos em minúsculas e sem acentos (mínimo de 2 caracteres)."""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [w for w in _WORD.findall(text) if len(w) > 1]
+
+def encode_cursor(tier: str, bound: Optional[str], score: Optional[float], last_id: Optional[str]) -> str:
+    raw = json.dumps([tier, bound, score, last_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(value: str) -> Tuple[str, Optional[str], Optional[float], Optional[str]]:
+    """Decodifica o cursor da busca; ValueError se for inválido."""
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        tier, bound, score, last_id = json.loads(raw)
+    except Exception:
+        raise ValueError(f"Cursor inválido em 'cursor': {value}")
+    if tier not in ("memory", "mongo"):
+        raise ValueError(f"Cursor inválido em 'cursor': {value}")
+    return tier, bound, score, last_id
+
+# ______________________________________________________________________________________________________
+
+class _RoomIndex:
+    """
+    Índice invertido de uma sala: mensagens em ordem de `_id` (as mais antigas
+    saem primeiro) e, por termo, o conjunto de `_id` que o contêm.
+    """
+    __slots__ = ("docs", "postings", "complete", "ready", "pending")
+
+    def __init__(self):
+        self.docs: "OrderedDict[str, Tuple[Message, Counter]]" = OrderedDict()
+        self.postings: Dict[str, Set[str]] = {}
+        # True enquanto o índice cobrir todo o histórico da sala
+        self.complete = True
+        self.ready: Optional[asyncio.Future] = None
+        # mensagens entregues durante o carregamento inicial
+        self.pending: List[dict] = []
+
+    @property
+    def oldest(self) -> Optional[str]:
+        return next(iter(self.docs), None)
+
+# ______________________________________________________________________________________________________
+
+class SearchIndex:
+    """Busca por sala no MongoDB com índice invertido local opcional para as salas buscadas."""
+
+    def __init__(
+        self,
+        collection: Callable,
+        enabled: bool = SEARCH_INDEX,
+        max_rooms: int = SEARCH_INDEX_ROOMS,
+        size: int = SEARCH_INDEX_SIZE,
+        max_time_ms: int = SEARCH_MAX_TIME_MS,
+        tracked: Optional[Callable[[str], bool]] = None,
+    ):
+        # Função que retorna a coleção de mensagens (cliente MongoDB compartilhado)
+        self.collection = collection
+        self.enabled = enabled
+        self.max_rooms = max_rooms
+        self.size = size
+        self.max_time_ms = max_time_ms
+        # Indica se as mensagens da sala são entregues a este processo (padrão: todas)
+        self.tracked = tracked or (lambda room: True)
+        self._rooms: "OrderedDict[str, _RoomIndex]" = OrderedDict()
+
+        # métricas acumuladas
+        self.memory_queries = 0
+        self.mongo_queries = 0
+        self.timeouts = 0
+        self.builds = 0
+        self.evictions = 0
+
+    # __________________________________________________________________________________________________
+
+    def add(self, room: str, item: Message):
+        """Indexa uma mensagem entregue, se a sala tiver índice local."""
+        entry = self._rooms.get(room)
+        if entry is None:
+            return
+        if entry.ready.done():
+            self._index(entry, item)
+        else:
+            entry.pending.append(item)
+
+    def drop(self, room: str):
+        """Descarta o índice local da sala (deixou de receber as mensagens entregues)."""
+        if self._rooms.pop(room, None) is not None:
+            self.evictions += 1
+
+    def _index(self, entry: _RoomIndex, item: Message):
+        doc_id = item.id
+        if doc_id in entry.docs:
+            return
+        terms = Counter(tokenize(item.content))
+        entry.docs[doc_id] = (item, terms)
+        for term in terms:
+            entry.postings.setdefault(term, set()).add(doc_id)
+        while len(entry.docs) > self.size:
+            old_id, (_, old_terms) = entry.docs.popitem(last=False)
+            for term in old_terms:
+                ids = entry.postings.get(term)
+                if ids is not None:
+                    ids.discard(old_id)
+                    if not ids:
+                        del entry.postings[term]
+            entry.complete = False
+
+    # __________________________________________________________________________________________________
+
+    async def _room(self, room: str) -> Optional[_RoomIndex]:
+        """
+        Índice local da sala, montado na primeira busca (uma única carga por
+        sala). Retorna None se a carga não terminar dentro do limite da busca;
+        ela continua em segundo plano e a busca segue pelo MongoDB.
+        """
+        entry = self._rooms.get(room)
+        if entry is None:
+            entry = _RoomIndex()
+            entry.ready = asyncio.ensure_future(self._build(room, entry))
+            self._rooms[room] = entry
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+                self.evictions += 1
+        self._rooms.move_to_end(room)
+        if not entry.ready.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(entry.ready), self.max_time_ms / 1000)
+            except asyncio.TimeoutError:
+                return None
+        if entry.ready.exception() is not None:
+            self._rooms.pop(room, None)
+            return None
+        return entry
+
+    async def _build(self, room: str, entry: _RoomIndex):
+        """Carrega as últimas `size` mensagens da sala e aplica as entregues no meio tempo."""
+        t0 = time.perf_counter()
+        try:
+            cursor = (
+                self.collection().find({"room": room}, MESSAGE_PROJECTION)
+                .sort("_id", -1)
+                .limit(self.size)
+            )
+            loaded = [Message.from_doc(d) async for d in cursor]
+        except Exception as e:
+            print(f"Erro ao montar índice de busca da sala {room}: {e}")
+            raise
+        finally:
+            _INDEX_LOAD_SECONDS.observe(time.perf_counter() - t0)
+        self.builds += 1
+        entry.complete = len(loaded) < self.size
+        for item in reversed(loaded):
+            self._index(entry, item)
+        for item in sorted(entry.pending, key=lambda i: i.oid):
+            self._index(entry, item)
+        entry.pending = []
+
+    # __________________________________________________________________________________________________
+
+    async def search(self, room: str, q: str, limit: int, cursor: Optional[str] = None) -> dict:
+        """
+        Uma página de resultados, do mais relevante para o menos relevante
+        (empate: mais recente primeiro). ValueError para consulta ou cursor
+        inválidos; SearchTimeout se o MongoDB exceder o limite de tempo.
+        """
+        terms = tokenize(q)
+        if not terms:
+            raise ValueError("Consulta vazia")
+
+        if cursor:
+            tier, bound, score, last_id = decode_cursor(cursor)
+        elif self.enabled:
+            tier, bound, score, last_id = "memory", None, None, None
+        else:
+            tier, bound, score, last_id = "mongo", None, None, None
+
+        if tier == "memory" and not self.tracked(room):
+            # sem assinatura o índice não veria as mensagens de outros workers
+            self.drop(room)
+            tier, score, last_id = "mongo", None, None
+
+        if tier == "memory":
+            entry = await self._room(room)
+            if entry is not None:
+                return self._search_memory(entry, terms, limit, score, last_id)
+            # índice indisponível: a busca inteira passa ao MongoDB
+            tier, score, last_id = "mongo", None, None
+
+        return await self._search_mongo(room, q, limit, bound, score, last_id)
+
+    # __________________________________________________________________________________________________
+
+    def _search_memory(
+        self, entry: _RoomIndex, terms: List[str], limit: int,
+        score: Optional[float], last_id: Optional[str],
+    ) -> dict:
+        """Relevância = ocorrências dos termos na mensagem; candidatos pela união das listas."""
+        self.memory_queries += 1
+        candidates: Set[str] = set()
+        for term in set(terms):
+            candidates |= entry.postings.get(term, set())
+        ranked = []
+        for doc_id in candidates:
+            doc_terms = entry.docs[doc_id][1]
+            key = (float(sum(doc_terms[t] for t in terms)), doc_id)
+            if score is None or key < (score, last_id):
+                ranked.append(key)
+        ranked.sort(reverse=True)
+
+        page = ranked[:limit]
+        items = [dict(entry.docs[doc_id][0].to_dict(), score=s) for s, doc_id in page]
+        if len(ranked) > limit:
+            s, doc_id = page[-1]
+            next_cursor = encode_cursor("memory", None, s, doc_id)
+        elif not entry.complete:
+            # janela esgotada: continua pelo MongoDB nas mensagens anteriores a ela
+            next_cursor = encode_cursor("mongo", entry.oldest, None, None)
+        else:
+            next_cursor = None
+        return {
+            "items": items,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
+            "source": "memory",
+        }
+
+    # __________________________________________________________________________________________________
+
+    async def _search_mongo(
+        self, room: str, q: str, limit: int, bound: Optional[str],
+        score: Optional[float], last_id: Optional[str],
+    ) -> dict:
+        """`$text` na sala (índice room + content), com limite de tempo no servidor."""
+        self.mongo_queries += 1
+        match = {"room": room, "$text": {"$search": q}}
+        if bound:
+            match["_id"] = {"$lt": parse_cursor(bound, "cursor")}
+        pipeline = [
+            {"$match": match},
+            {"$addFields": {"score": {"$meta": "textScore"}}},
+        ]
+        if score is not None:
+            after = parse_cursor(last_id, "cursor")
+            pipeline.append({"$match": {"$or": [
+                {"score": {"$lt": score}},
+                {"score": score, "_id": {"$lt": after}},
+            ]}})
+        pipeline += [
+            {"$sort": {"score": -1, "_id": -1}},
+            {"$limit": limit + 1},
+            {"$project": dict(MESSAGE_PROJECTION, score=1)},
+        ]
+
+        t0 = time.perf_counter()
+        try:
+            raw = await self.collection().aggregate(pipeline, maxTimeMS=self.max_time_ms).to_list(length=limit + 1)
+        except ExecutionTimeout:
+            self.timeouts += 1
+            raise SearchTimeout("Busca excedeu o tempo limite")
+        finally:
+            _TEXT_SEARCH_SECONDS.observe(time.perf_counter() - t0)
+
+        items = [dict(Message.from_doc(d).to_dict(), score=d["score"]) for d in raw[:limit]]
+        next_cursor = None
+        if len(raw) > limit:
+            last = raw[limit - 1]
+            next_cursor = encode_cursor("mongo", bound, last["score"], str(last["_id"]))
+        return {
+            "items": items,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
+            "source": "mongo",
+        }
+
+    # __________________________________________________________________________________________________
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "rooms": len(self._rooms),
+            "indexed_messages": sum(len(e.docs) for e in self._rooms.values()),
+            "memory_queries": self.memory_queries,
+            "mongo_queries": self.mongo_queries,
+            "timeouts": self.timeouts,
+            "builds": self.builds,
+            "evictions": self.evictions,
+        }
@@ -1,9 +1,6 @@
 // Nome da sala de chat
 const room = "sala1";
 
-// Cria conexão WebSocket com o backend na sala especificada
-const ws = new WebSocket(`ws://localhost:8000/ws/${room}`);
-
 // Seletores dos elementos da interface
 const chat = document.getElementById('chat'); // Área de mensagens
 const msg = document.getElementById('msg');   // Input de mensagem
@@ -12,25 +9,60 @@ const send = document.getElementById('send'); // Botão de envio
 // Nome do usuário (pode ser customizado)
 const username = "Você";
 
+// Reconexão com backoff exponencial (ms) e retomada a partir da última mensagem recebida
+const RECONNECT_BASE = 500;
+const RECONNECT_MAX = 30000;
+let ws = null;
+let retries = 0;
+let lastId = null;
+const seen = new Set(); // _id das mensagens já exibidas (evita duplicatas no replay)
+
+// Cria conexão WebSocket com o backend na sala especificada.
+// Na reconexão envia `last_id` e o servidor reenvia só as mensagens perdidas.
+function connect() {
+  let url = `ws://localhost:8000/ws/${room}?username=${encodeURIComponent(username)}`;
+  if (lastId) {
+    url += `&last_id=${lastId}`;
+  }
+  ws = new WebSocket(url);
+
+  // Evento de conexão aberta no WebSocket
+  ws.onopen = () => {
+    console.log("Conectado ao WebSocket!");
+    retries = 0;
+  };
+
+  ws.onmessage = onMessage;
+
+  // Conexão perdida: nova tentativa com espera crescente (com variação aleatória)
+  ws.onclose = () => {
+    const delay = Math.min(RECONNECT_MAX, RECONNECT_BASE * 2 ** retries);
+    retries += 1;
+    setTimeout(connect, delay / 2 + Math.random() * delay / 2);
+  };
+}
+
 // Evento de clique no botão de envio
 send.onclick = function() {
   if (msg.value.trim() !== "") {
-    if (ws.readyState === WebSocket.OPEN) {
+    if (ws && ws.readyState === WebSocket.OPEN) {
       ws.send(JSON.stringify({ username: username, content: msg.value }));
       msg.value = "";
     } else {
-      alert("Conexão com o chat foi perdida. Recarregue a página.");
+      addNotice("Reconectando ao chat... tente novamente em instantes.");
     }
   }
 };
 
-// Evento de conexão aberta no WebSocket
-ws.onopen = () => {
-    console.log("Conectado ao WebSocket!");
-};
+// Heartbeat periódico para manter a presença na sala
+setInterval(() => {
+  if (ws && ws.readyState === WebSocket.OPEN) {
+    ws.send(JSON.stringify({ type: "ping" }));
+  }
+}, 20000);
 
 // Evento de recebimento de mensagem do servidor
-ws.onmessage = function(event) {
+function onMessage(event) {
   try {
     const data = JSON.parse(event.data);
 
@@ -39,23 +71,50 @@ ws.onmessage = function(event) {
       for (const msg of data.items) {
         addMessage(msg);
       }
+    } else if (data.type === "replay") {
+      // Mensagens perdidas durante a desconexão
+      if (!data.complete) {
+        addNotice("Algumas mensagens antigas não foram recarregadas.");
+      }
+      for (const msg of data.items) {
+        addMessage(msg);
+      }
+    } else if (data.type === "ping") {
+      // Keepalive do servidor: responde para a conexão não ser recolhida
+      ws.send(JSON.stringify({ type: "pong" }));
+      return;
     } else if (data.type === "message") {
       // Exibe nova mensagem
       addMessage(data.item);
+    } else if (data.type === "error") {
+      // Aviso do servidor (ex.: rate limit)
+      addNotice(data.detail);
+    } else if (data.type === "batch") {
+      // Mensagens agrupadas pelo servidor (cliente lento ou sala movimentada)
+      for (const item of data.items) {
+        addMessage(item);
+      }
     }
   } catch {
     // Mensagem de sistema ou erro
-    const div = document.createElement('div');
-    div.style.color = 'gray';
-    div.textContent = event.data;
-    chat.appendChild(div);
+    addNotice(event.data);
   }
   // Scroll automático para a última mensagem
   chat.scrollTop = chat.scrollHeight;
-};
+}
 
 // Função para adicionar mensagem na interface
 function addMessage(msg) {
+  if (msg._id) {
+    if (seen.has(msg._id)) {
+      return;
+    }
+    seen.add(msg._id);
+    // _id (ObjectId) cresce com o tempo: o maior é a última mensagem recebida
+    if (!lastId || msg._id > lastId) {
+      lastId = msg._id;
+    }
+  }
   const time = new Date(msg.created_at).toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'});
   const cssClass = msg.username === username ? "user" : "other";
   const div = document.createElement('div');
@@ -64,7 +123,17 @@ function addMessage(msg) {
   chat.appendChild(div);
 }
 
+// Aviso em cinza na área de mensagens
+function addNotice(text) {
+  const div = document.createElement('div');
+  div.style.color = 'gray';
+  div.textContent = text;
+  chat.appendChild(div);
+}
+
 // Permite envio de mensagem ao pressionar Enter
 msg.addEventListener("keyup", function(e) {
   if (e.key === "Enter") send.onclick();
-});
\ No newline at end of file
+});
+
+connect();
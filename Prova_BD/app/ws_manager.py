@@ -1,63 +1,410 @@
-from typing import Dict, Set
+from typing import Callable, Dict, Optional
 from fastapi import WebSocket
 import asyncio
+import time
+
+from config import (
+    WS_SEND_QUEUE_SIZE,
+    WS_SLOW_CONSUMER_POLICY,
+    WS_BATCH,
+    WS_BATCH_THRESHOLD,
+    WS_BATCH_MIN_MS,
+    WS_BATCH_MAX_MS,
+    WS_BATCH_TARGET,
+    WS_BATCH_MAX_ITEMS,
+)
+from frames import Frame, encode_frame
+from metrics import BROADCAST_FANOUT, BROADCAST_SECONDS, SEND_FAILURES, SEND_DISCONNECTS
+
+# ______________________________________________________________________________________________________
+
+# Políticas aceitas para clientes lentos (fila de saída cheia)
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# Código de fechamento usado ao desconectar cliente lento ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# Séries das métricas usadas no caminho quente (resolvidas uma única vez)
+_FANOUT = BROADCAST_FANOUT.labels()
+_BROADCAST_SECONDS = BROADCAST_SECONDS.labels()
+_SEND_FAILURES = SEND_FAILURES.labels("ws_manager")
+_FAILURE_DISCONNECTS = SEND_DISCONNECTS.labels("send_failure")
+_SLOW_DISCONNECTS = SEND_DISCONNECTS.labels("slow_consumer")
+
+# ______________________________________________________________________________________________________
+
+class Connection:
+    """
+    Estado de uma conexão WebSocket: fila de saída limitada, tarefa escritora,
+    codec negociado (json | msgpack) e início do envio em andamento.
+    """
+    __slots__ = ("ws", "room", "queue", "task", "dropped", "codec", "sending_since")
+
+    def __init__(self, ws: WebSocket, room: str, maxsize: int, codec: str = "json"):
+        self.ws = ws
+        self.room = room
+        self.codec = codec
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.sending_since: Optional[float] = None
+
+# ______________________________________________________________________________________________________
+
+def _coalesce(frames: list) -> list:
+    """
+    Junta frames consecutivos do tipo "message"/"batch" em um único
+    frame {"type": "batch", "items": [...]}, preservando a ordem dos demais.
+    """
+    merged = []
+    items = None
+    for f in frames:
+        kind = f.payload.get("type")
+        if kind not in ("message", "batch"):
+            if items is not None:
+                merged.append(Frame({"type": "batch", "items": items}))
+                items = None
+            merged.append(f)
+            continue
+        if items is None:
+            items = []
+        if kind == "message":
+            items.append(f.payload["item"])
+        else:
+            items.extend(f.payload["items"])
+    if items is not None:
+        merged.append(Frame({"type": "batch", "items": items}))
+    return merged
+
+# ______________________________________________________________________________________________________
+
+# Intervalo (s) de medição da taxa de mensagens de cada sala
+RATE_SAMPLE_INTERVAL = 0.25
+
+class RoomWindow:
+    """
+    Janela de agrupamento de uma sala: taxa de mensagens estimada (média
+    móvel por amostras de RATE_SAMPLE_INTERVAL), frames pendentes e o
+    temporizador que os libera.
+    """
+    __slots__ = ("rate", "count", "started", "pending", "handle")
+
+    def __init__(self, now: float):
+        self.rate = 0.0
+        self.count = 0
+        self.started = now
+        self.pending: list = []
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+    def tick(self, now: float) -> float:
+        """
+        Conta uma mensagem e retorna a taxa estimada (mensagens/s). A média
+        anterior perde metade do peso a cada RATE_SAMPLE_INTERVAL decorrido,
+        de modo que, após uma rajada, uma mensagem isolada já volta à entrega
+        imediata em vez de esperar a janela longa.
+        """
+        self.count += 1
+        elapsed = now - self.started
+        if elapsed >= RATE_SAMPLE_INTERVAL:
+            keep = 0.5 ** (elapsed / RATE_SAMPLE_INTERVAL)
+            self.rate = keep * self.rate + (1 - keep) * (self.count / elapsed)
+            self.count = 0
+            self.started = now
+        return self.rate
 
 # ______________________________________________________________________________________________________
 
 class WSManager:
     """
-    Gerencia conexões WebSocket por sala, prevenindo duplicação de envio.
+    Gerencia conexões WebSocket por sala.
+
+    Cada conexão tem sua própria fila de saída limitada e uma tarefa escritora:
+    broadcast apenas enfileira e retorna, de modo que um cliente lento não
+    atrasa a entrega para os demais nem o loop de recebimento de quem envia.
+
+    Com `batch`, salas movimentadas (acima de WS_BATCH_THRESHOLD mensagens/s)
+    agrupam as mensagens que chegam dentro de uma janela de 10-50 ms em um
+    único frame {"type": "batch", "items": [...]}; salas calmas continuam
+    recebendo cada mensagem imediatamente.
     """
-    def __init__(self):
-        # rooms: dict { room_name: set of WebSockets }
-        self.rooms: Dict[str, Set[WebSocket]] = {}
-        # locks por sala para evitar envio simultâneo que cause duplicação
-        self._locks: Dict[str, asyncio.Lock] = {}
+    def __init__(
+        self,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        policy: str = WS_SLOW_CONSUMER_POLICY,
+        batch: bool = WS_BATCH,
+    ):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Política inválida para cliente lento: {policy}")
+        # rooms: dict { room_name: { WebSocket: Connection } }
+        self.rooms: Dict[str, Dict[WebSocket, Connection]] = {}
+        self.queue_size = queue_size
+        self.policy = policy
+        self.batch = batch
+        # janelas de agrupamento por sala (apenas com batch)
+        self.windows: Dict[str, RoomWindow] = {}
+        # chamada com (room, ws) quando a conexão é removida por falha de envio ou
+        # cliente lento, para o dono da conexão liberar o resto (ex.: keepalive)
+        self.on_drop: Optional[Callable[[str, WebSocket], None]] = None
+
+        # métricas acumuladas
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.send_failures = 0
+        self.slow_disconnects = 0
+        self.batches = 0
+        self.batched_messages = 0
 
     # __________________________________________________________________________________________________
 
-    async def connect(self, room: str, ws: WebSocket):
+    async def connect(self, room: str, ws: WebSocket, codec: str = "json", subprotocol: str = None):
         """
-        Aceita o WebSocket e adiciona na sala.
-        Não adiciona duplicado.
+        Aceita o WebSocket (com o subprotocolo negociado), adiciona na sala
+        e inicia sua tarefa escritora. Não adiciona duplicado.
         """
-        await ws.accept()
-        if room not in self.rooms:
-            self.rooms[room] = set()
-            self._locks[room] = asyncio.Lock()
-        if ws not in self.rooms[room]:
-            self.rooms[room].add(ws)
+        await ws.accept(subprotocol=subprotocol)
+        conns = self.rooms.setdefault(room, {})
+        if ws in conns:
+            return
+        conn = Connection(ws, room, self.queue_size, codec)
+        conn.task = asyncio.create_task(self._writer(conn))
+        conns[ws] = conn
 
     # __________________________________________________________________________________________________
 
     def disconnect(self, room: str, ws: WebSocket):
         """
-        Remove WebSocket da sala.
+        Remove WebSocket da sala e encerra sua tarefa escritora.
         """
         conns = self.rooms.get(room)
-        if conns and ws in conns:
-            conns.remove(ws)
-            if not conns:
-                # remove a sala vazia e o lock
-                self.rooms.pop(room, None)
-                self._locks.pop(room, None)
+        if not conns or ws not in conns:
+            return
+        conn = conns.pop(ws)
+        if not conns:
+            # remove a sala vazia (e a janela de agrupamento)
+            self.rooms.pop(room, None)
+            window = self.windows.pop(room, None)
+            if window is not None and window.handle is not None:
+                window.handle.cancel()
+        if conn.task is not None and conn.task is not asyncio.current_task():
+            conn.task.cancel()
+
+    # __________________________________________________________________________________________________
+
+    async def broadcast(self, room: str, payload):
+        """
+        Enfileira a mensagem para todos os WebSockets da sala e retorna
+        imediatamente; o envio acontece nas tarefas escritoras.
+        O payload é codificado uma única vez e compartilhado entre as conexões.
+        """
+        conns = self.rooms.get(room)
+        if not conns:
+            return
+        frame = encode_frame(payload)
+        if not self.batch:
+            self._deliver(conns, frame)
+            return
+
+        now = time.monotonic()
+        window = self.windows.get(room)
+        if window is None:
+            window = self.windows[room] = RoomWindow(now)
+
+        if frame.payload.get("type") != "message":
+            # outros tipos não são agrupados, mas não podem passar à frente
+            self._flush_window(room)
+            self._deliver(conns, frame)
+            return
+
+        rate = window.tick(now)
+        if rate < WS_BATCH_THRESHOLD and not window.pending:
+            # sala calma: entrega imediata, sem latência extra
+            self._deliver(conns, frame)
+            return
+
+        window.pending.append(frame)
+        if len(window.pending) >= WS_BATCH_MAX_ITEMS:
+            self._flush_window(room)
+        elif window.handle is None:
+            # janela menor quanto maior a taxa: ~WS_BATCH_TARGET mensagens por lote
+            delay = WS_BATCH_TARGET / rate if rate else WS_BATCH_MAX_MS / 1000
+            delay = min(WS_BATCH_MAX_MS, max(WS_BATCH_MIN_MS, delay * 1000)) / 1000
+            window.handle = asyncio.get_running_loop().call_later(delay, self._flush_window, room)
+
+    # __________________________________________________________________________________________________
+
+    def _flush_window(self, room: str):
+        """Entrega as mensagens pendentes da sala em um único frame "batch"."""
+        window = self.windows.get(room)
+        if window is None or not window.pending:
+            return
+        if window.handle is not None:
+            window.handle.cancel()
+            window.handle = None
+        frames, window.pending = window.pending, []
+        conns = self.rooms.get(room)
+        if not conns:
+            return
+        if len(frames) == 1:
+            self._deliver(conns, frames[0])
+            return
+        self.batches += 1
+        self.batched_messages += len(frames)
+        for merged in _coalesce(frames):
+            self._deliver(conns, merged)
+
+    def _deliver(self, conns: Dict[WebSocket, Connection], frame: Frame):
+        """Enfileira o frame em todas as conexões da sala."""
+        t0 = time.perf_counter()
+        for conn in list(conns.values()):
+            self._enqueue(conn, frame)
+        _FANOUT.observe(len(conns))
+        _BROADCAST_SECONDS.observe(time.perf_counter() - t0)
+
+    # __________________________________________________________________________________________________
+
+    async def send(self, room: str, ws: WebSocket, payload):
+        """
+        Enfileira uma mensagem para um único WebSocket da sala.
+        """
+        conn = self.rooms.get(room, {}).get(ws)
+        if conn is not None:
+            self._enqueue(conn, encode_frame(payload))
 
     # __________________________________________________________________________________________________
 
-    async def broadcast(self, room: str, payload: dict):
+    def _enqueue(self, conn: Connection, frame: Frame):
         """
-        Envia uma mensagem para todos os WebSockets da sala,
-        usando lock para evitar envio simultâneo que gere duplicação.
+        Coloca o frame na fila da conexão aplicando a política de cliente lento.
         """
-        if room not in self.rooms:
+        try:
+            conn.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == "disconnect":
+            self.slow_disconnects += 1
+            _SLOW_DISCONNECTS.value += 1
+            self._drop(conn)
+            asyncio.create_task(self._close(conn.ws, SLOW_CONSUMER_CLOSE_CODE))
+            return
+
+        if self.policy == "coalesce":
+            pending = []
+            while not conn.queue.empty():
+                pending.append(conn.queue.get_nowait())
+            merged = _coalesce(pending + [frame])
+            self.coalesced += len(pending) + 1 - len(merged)
+            # se nada pôde ser agrupado, cai para o descarte do mais antigo
+            while len(merged) > conn.queue.maxsize:
+                merged.pop(0)
+                conn.dropped += 1
+                self.dropped += 1
+            for f in merged:
+                conn.queue.put_nowait(f)
             return
-        lock = self._locks.get(room)
-        async with lock:
-            to_remove = []
-            for ws in list(self.rooms[room]):
-                try:
-                    await ws.send_json(payload)
-                except Exception:
-                    to_remove.append(ws)
-            for ws in to_remove:
-                self.disconnect(room, ws)
\ No newline at end of file
+
+        # drop_oldest
+        conn.queue.get_nowait()
+        conn.queue.put_nowait(frame)
+        conn.dropped += 1
+        self.dropped += 1
+
+    # __________________________________________________________________________________________________
+
+    async def _writer(self, conn: Connection):
+        """
+        Consome a fila da conexão e envia ao cliente; em falha de envio,
+        remove a conexão da sala.
+        """
+        try:
+            while True:
+                frame = await conn.queue.get()
+                conn.sending_since = time.monotonic()
+                if conn.codec == "msgpack":
+                    await conn.ws.send_bytes(frame.binary)
+                else:
+                    await conn.ws.send_text(frame.text)
+                conn.sending_since = None
+                self.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.send_failures += 1
+            _SEND_FAILURES.value += 1
+            _FAILURE_DISCONNECTS.value += 1
+            self._drop(conn)
+
+    def _drop(self, conn: Connection):
+        """Remove a conexão por falha/lentidão e avisa `on_drop`."""
+        self.disconnect(conn.room, conn.ws)
+        if self.on_drop is not None:
+            self.on_drop(conn.room, conn.ws)
+
+    # __________________________________________________________________________________________________
+
+    async def ping(self, room: str, ws: WebSocket, payload, stall: float):
+        """
+        Enfileira um ping de keepalive verificando antes a tarefa escritora:
+        ConnectionError se a conexão já saiu da sala (falha de envio, cliente
+        lento) e TimeoutError se um envio está parado há mais de `stall`
+        segundos (socket meio aberto, buffer TCP cheio).
+        """
+        conn = self.rooms.get(room, {}).get(ws)
+        if conn is None or conn.task is None or conn.task.done():
+            raise ConnectionError("Conexão encerrada")
+        if conn.sending_since is not None and time.monotonic() - conn.sending_since > stall:
+            raise TimeoutError("Envio parado")
+        self._enqueue(conn, encode_frame(payload))
+        if ws not in self.rooms.get(room, {}):
+            raise ConnectionError("Conexão encerrada")
+
+    # __________________________________________________________________________________________________
+
+    async def close(self, room: str, ws: WebSocket, code: int):
+        """Remove o WebSocket da sala e fecha a conexão com o código informado."""
+        self.disconnect(room, ws)
+        await self._close(ws, code)
+
+    @staticmethod
+    async def _close(ws: WebSocket, code: int):
+        """Fecha o WebSocket ignorando erros de conexão já encerrada."""
+        try:
+            await ws.close(code=code)
+        except Exception:
+            pass
+
+    # __________________________________________________________________________________________________
+
+    def stats(self) -> dict:
+        """
+        Retorna métricas das filas de saída: profundidade, descartes e envios.
+        """
+        depth_total = 0
+        depth_max = 0
+        rooms = {}
+        for room, conns in self.rooms.items():
+            room_depth = 0
+            for conn in conns.values():
+                depth = conn.queue.qsize()
+                room_depth += depth
+                depth_max = max(depth_max, depth)
+            depth_total += room_depth
+            rooms[room] = {"connections": len(conns), "queue_depth": room_depth}
+        return {
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "connections": sum(r["connections"] for r in rooms.values()),
+            "queue_depth_total": depth_total,
+            "queue_depth_max": depth_max,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "send_failures": self.send_failures,
+            "slow_disconnects": self.slow_disconnects,
+            "batch": self.batch,
+            "batches": self.batches,
+            "batched_messages": self.batched_messages,
+            "rooms": rooms,
+        }
@@ -0,0 +1,48 @@
+"""
+Protocolo WebSocket do uvicorn com permessage-deflate ajustado.
+
+O uvicorn padrão oferece permessage-deflate com os parâmetros default para
+qualquer cliente. Esta classe usa janela, nível e memLevel do ambiente e,
+com WS_DEFLATE=negotiated, só comprime conexões que pedirem (subprotocolo
+`chat.v1.*+deflate` ou `?compress=deflate`, ver frames.negotiate):
+
+    uvicorn main:app --ws ws_protocol:ChatWebSocketProtocol
+"""
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+from config import (
+    WS_DEFLATE,
+    WS_DEFLATE_LEVEL,
+    WS_DEFLATE_MEM_LEVEL,
+    WS_DEFLATE_WINDOW_BITS,
+    WS_DEFLATE_NO_CONTEXT_TAKEOVER,
+)
+from frames import negotiate
+
+# ______________________________________________________________________________________________________
+
+def deflate_factory() -> ServerPerMessageDeflateFactory:
+    """Fábrica da extensão com os parâmetros do ambiente."""
+    return ServerPerMessageDeflateFactory(
+        server_no_context_takeover=WS_DEFLATE_NO_CONTEXT_TAKEOVER,
+        server_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+        compress_settings={"level": WS_DEFLATE_LEVEL, "memLevel": WS_DEFLATE_MEM_LEVEL},
+    )
+
+# ______________________________________________________________________________________________________
+
+class ChatWebSocketProtocol(WebSocketProtocol):
+    """WebSocketProtocol do uvicorn com permessage-deflate ajustado e negociado por conexão."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.available_extensions = [deflate_factory()] if WS_DEFLATE != "off" else []
+
+    def process_extensions(self, headers, available_extensions):
+        """Aceita o deflate oferecido pelo cliente só quando a conexão o pediu."""
+        if WS_DEFLATE == "negotiated":
+            _, deflate, _ = negotiate(self.scope)
+            if not deflate:
+                return None, []
+        return super().process_extensions(headers, available_extensions)
@@ -0,0 +1,142 @@
+"""
+Benchmark do caminho Redis do `ChatManager` contra um Redis local.
+
+Compara, na mesma vazão alvo, o caminho antigo (INCR, EXPIRE, PUBLISH,
+LPUSH e LTRIM em idas separadas; SADD, EXPIRE e LRANGE no connect) com o
+novo (script Lua único no envio; no connect apenas o LRANGE, já que a
+presença é anotada em memória e gravada em lote pelo `PresenceService`).
+Reporta latência por operação (p50/p99) e vazão obtida, em JSON.
+
+    REDIS_URL=redis://localhost:6379/15 python bench/chat_redis_bench.py --ops 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import redis.asyncio as redis
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+from chat import SEND_SCRIPT, HISTORY_LEN
+from config import RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL
+
+# ______________________________________________________________________________________________________
+
+def percentile(values: list, p: float) -> float:
+    """Percentil por posição (valores já ordenados)."""
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+# ______________________________________________________________________________________________________
+# Caminho antigo: uma ida ao Redis por comando (limite fixo de 5 mensagens em 10 s)
+
+RATE_LIMIT = 5
+RATE_WINDOW = 10
+
+async def old_send(r: redis.Redis, room: str, user_id: str, msg_json: str) -> bool:
+    rate_key = f"chat:{room}:rate:{user_id}"
+    if await r.incr(rate_key) > RATE_LIMIT:
+        return False
+    await r.expire(rate_key, RATE_WINDOW)
+    await r.publish(f"chat:{room}", msg_json)
+    recent_key = f"chat:{room}:recent"
+    await r.lpush(recent_key, msg_json)
+    await r.ltrim(recent_key, 0, HISTORY_LEN - 1)
+    return True
+
+async def old_connect(r: redis.Redis, room: str, user_id: str, msg_json: str = None) -> list:
+    online_key = f"chat:{room}:online"
+    await r.sadd(online_key, user_id)
+    await r.expire(online_key, 60)
+    return await r.lrange(f"chat:{room}:recent", 0, HISTORY_LEN - 1)
+
+# ______________________________________________________________________________________________________
+# Caminho novo: script Lua no envio e leitura única no connect (mesma lógica do ChatManager)
+
+def new_paths(r: redis.Redis):
+    script = r.register_script(SEND_SCRIPT)
+
+    async def new_send(r: redis.Redis, room: str, user_id: str, msg_json: str) -> bool:
+        allowed, _ = await script(
+            keys=[f"chat:{room}:bucket:{user_id}", f"chat:{room}:recent"],
+            args=[RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL, 1, f"chat:{room}", msg_json, HISTORY_LEN],
+        )
+        return bool(int(allowed))
+
+    async def new_connect(r: redis.Redis, room: str, user_id: str, msg_json: str = None) -> list:
+        return await r.lrange(f"chat:{room}:recent", 0, HISTORY_LEN - 1)
+
+    return new_send, new_connect
+
+# ______________________________________________________________________________________________________
+
+async def measure(name: str, fn, r: redis.Redis, args) -> dict:
+    """Executa `fn` com concorrência fixa e vazão alvo, medindo cada operação."""
+    latencies = []
+    per_worker = args.ops // args.concurrency
+    interval = args.concurrency / args.rate if args.rate else 0.0
+    payload = json.dumps({"user": "bench", "text": "x" * args.size, "timestamp": "2024-01-01T00:00:00"})
+
+    async def worker(w: int):
+        for i in range(per_worker):
+            # usuário único por operação para não esbarrar no rate limit
+            user_id = f"{name}-{w}-{i}"
+            room = f"bench{i % args.rooms}"
+            t0 = time.perf_counter()
+            await fn(r, room, user_id, payload)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if interval:
+                await asyncio.sleep(max(0.0, interval - (time.perf_counter() - t0)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "path": name,
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p99": round(percentile(latencies, 99), 3),
+        },
+    }
+
+# ______________________________________________________________________________________________________
+
+async def run(args) -> dict:
+    r = redis.from_url(args.redis_url, decode_responses=True)
+    await r.ping()
+    new_send, new_connect = new_paths(r)
+    results = []
+    for name, fn in (
+        ("old_send", old_send),
+        ("new_send", new_send),
+        ("old_connect", old_connect),
+        ("new_connect", new_connect),
+    ):
+        results.append(await measure(name, fn, r, args))
+    await r.aclose()
+    return {"rate": args.rate, "concurrency": args.concurrency, "results": results}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do caminho Redis do ChatManager")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379/15"))
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=5000.0, help="operações/s alvo (0 = sem limite)")
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--size", type=int, default=200, help="tamanho do texto da mensagem")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+# ______________________________________________________________________________________________________
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Benchmark multi-worker do fan-out do WebSocket (`app/main.py`).
+
+Sobe W processos uvicorn (um por porta) com o backend de fan-out escolhido,
+distribui N clientes entre eles na mesma sala e mede, para mensagens
+enviadas por S remetentes, a vazão de entrega (mensagens/s) e a latência
+ponta a ponta (envio -> recebimento em todos os clientes).
+
+Requer MongoDB e Redis acessíveis (MONGO_URL / REDIS_URL). Exemplo:
+
+    python bench/fanout_bench.py --backend streams --workers 4 --clients 400
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import websockets
+
+# ______________________________________________________________________________________________________
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# ______________________________________________________________________________________________________
+
+def percentile(values: list, p: float) -> float:
+    """Percentil por posição (valores já ordenados)."""
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+# ______________________________________________________________________________________________________
+
+def start_workers(args) -> list:
+    """Inicia os workers uvicorn e retorna os processos."""
+    procs = []
+    for i in range(args.workers):
+        env = dict(
+            os.environ,
+            FANOUT_BACKEND=args.backend,
+            FANOUT_WORKER_ID=f"bench-{i}",
+            # rate limit aberto: todos os clientes saem do mesmo IP
+            RATE_LIMIT_CAPACITY=str(10**9),
+            RATE_LIMIT_REFILL=str(10**9),
+            # salas do benchmark fora do registro
+            ROOMS_ENFORCE="false",
+        )
+        cmd = [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--app-dir", "app",
+            "--host", "127.0.0.1",
+            "--port", str(args.port + i),
+            "--log-level", "warning",
+        ]
+        procs.append(subprocess.Popen(cmd, cwd=ROOT, env=env))
+    return procs
+
+async def wait_ready(port: int, timeout: float = 15.0):
+    """Aguarda o worker aceitar conexões TCP."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Worker na porta {port} não respondeu")
+
+# ______________________________________________________________________________________________________
+
+async def receiver(ws, latencies: list, expected: int, done: asyncio.Event, counter: dict):
+    """Recebe frames e registra a latência das mensagens do benchmark."""
+    async for raw in ws:
+        data = json.loads(raw)
+        if data.get("type") == "history":
+            continue
+        items = data.get("items", []) if data.get("type") == "batch" else [data.get("item")]
+        now = time.perf_counter_ns()
+        for item in items:
+            content = (item or {}).get("content", "")
+            if not content.startswith("bench:"):
+                continue
+            sent_ns = int(content.rsplit(":", 1)[1])
+            latencies.append((now - sent_ns) / 1e6)
+            counter["delivered"] += 1
+            if counter["delivered"] >= expected:
+                done.set()
+
+async def sender(ws, idx: int, messages: int, interval: float):
+    """Envia mensagens com o instante de envio embutido no conteúdo."""
+    for seq in range(messages):
+        content = f"bench:{idx}:{seq}:{time.perf_counter_ns()}"
+        await ws.send(json.dumps({"username": f"bench-{idx}", "content": content}))
+        if interval:
+            await asyncio.sleep(interval)
+
+# ______________________________________________________________________________________________________
+
+async def run(args) -> dict:
+    room = f"bench-{int(time.time())}"
+    clients = []
+    for i in range(args.clients):
+        port = args.port + i % args.workers
+        clients.append(await websockets.connect(f"ws://127.0.0.1:{port}/ws/{room}", max_queue=None))
+    # espera todos entrarem na sala (assinaturas/grupos criados)
+    await asyncio.sleep(1.0)
+
+    expected = args.senders * args.messages * args.clients
+    latencies: list = []
+    counter = {"delivered": 0}
+    done = asyncio.Event()
+    receivers = [
+        asyncio.create_task(receiver(ws, latencies, expected, done, counter)) for ws in clients
+    ]
+
+    interval = 1.0 / args.rate if args.rate else 0.0
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        sender(clients[i], i, args.messages, interval) for i in range(args.senders)
+    ))
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+
+    for task in receivers:
+        task.cancel()
+    for ws in clients:
+        await ws.close()
+
+    latencies.sort()
+    return {
+        "backend": args.backend,
+        "workers": args.workers,
+        "clients": args.clients,
+        "senders": args.senders,
+        "sent": args.senders * args.messages,
+        "expected": expected,
+        "delivered": counter["delivered"],
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_sec": round(counter["delivered"] / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+    }
+
+# ______________________________________________________________________________________________________
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi-worker do fan-out WebSocket")
+    parser.add_argument("--backend", default="streams", choices=("inprocess", "pubsub", "streams"))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=100, help="mensagens por remetente")
+    parser.add_argument("--rate", type=float, default=50.0, help="mensagens/s por remetente (0 = sem limite)")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    procs = start_workers(args)
+    try:
+        asyncio.run(asyncio.wait_for(
+            asyncio.gather(*(wait_ready(args.port + i) for i in range(args.workers))), 30
+        ))
+        result = asyncio.run(run(args))
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+    print(json.dumps(result, indent=2))
+
+# ______________________________________________________________________________________________________
+
+if __name__ == "__main__":
+    main()
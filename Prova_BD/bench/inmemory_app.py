@@ -0,0 +1,29 @@
+"""
+App do chat com o MongoDB substituído por `mongomock_motor` (em memória).
+
+Usado pelo `load_test.py --store memory` para medir o servidor sem MongoDB
+local; os demais backends (fan-out, rate limit, presença) seguem as
+variáveis de ambiente e, nos padrões, não usam Redis.
+
+    uvicorn inmemory_app:app --app-dir bench
+"""
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "app"))
+os.chdir(ROOT)
+os.environ.setdefault("MONGO_URL", "mongodb://in-memory")
+
+try:
+    from mongomock_motor import AsyncMongoMockClient
+except ImportError:
+    raise SystemExit("Instale mongomock-motor para usar --store memory")
+
+import database
+import main
+
+# o lifespan reutiliza o cliente já criado (sem conectar a um servidor real)
+database.mongo.client = AsyncMongoMockClient()
+app = main.app
@@ -0,0 +1,299 @@
+"""
+Gerador de carga do servidor de chat (`app/main.py`).
+
+Sobe um processo uvicorn (MongoDB/Redis locais ou MongoDB em memória),
+abre N clientes WebSocket distribuídos em M salas e, em cada sala, S
+remetentes enviam mensagens na taxa pedida. Mede:
+
+- latência de conexão (handshake + histórico inicial);
+- latência envio -> recebimento (p50/p90/p99/máx) em todos os clientes;
+- mensagens entregues por segundo;
+- CPU (%) e memória (RSS) do processo do servidor.
+
+O resultado sai em JSON (com o commit atual) para comparar execuções:
+
+    python bench/load_test.py --store memory --clients 500 --rooms 10 -o run.json
+    python bench/load_test.py --store mongo --clients 2000 --rooms 50 --rate 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import websockets
+
+try:
+    import psutil
+except ImportError:  # leitura direta de /proc como alternativa
+    psutil = None
+
+# ______________________________________________________________________________________________________
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# ______________________________________________________________________________________________________
+
+def percentile(values: list, p: float) -> float:
+    """Percentil por posição (valores já ordenados)."""
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+def summary(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p90": round(percentile(values, 90), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(values[-1], 3) if values else 0.0,
+    }
+
+def git_commit() -> str:
+    """Commit atual do repositório (vazio fora de um checkout git)."""
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+# ______________________________________________________________________________________________________
+
+def start_server(args) -> subprocess.Popen:
+    """
+    Inicia o servidor; o rate limit é aberto para não distorcer a carga e as
+    salas do teste não precisam estar no registro.
+    """
+    env = dict(
+        os.environ,
+        RATE_LIMIT_CAPACITY=str(10**9),
+        RATE_LIMIT_REFILL=str(10**9),
+        ROOMS_ENFORCE="false",
+    )
+    if args.store == "memory":
+        target, app_dir = "inmemory_app:app", "bench"
+    else:
+        target, app_dir = "main:app", "app"
+    cmd = [
+        sys.executable, "-m", "uvicorn", target,
+        "--app-dir", app_dir,
+        "--host", "127.0.0.1",
+        "--port", str(args.port),
+        "--log-level", "warning",
+    ]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env)
+
+async def wait_ready(port: int, timeout: float = 15.0):
+    """Aguarda o servidor aceitar conexões TCP."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Servidor na porta {port} não respondeu")
+
+# ______________________________________________________________________________________________________
+
+class ProcessSampler:
+    """Amostra CPU (%) e RSS (MB) de um processo em intervalos fixos."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu: list = []
+        self.rss: list = []
+        self._task = None
+        self._tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _read(self):
+        """Retorna (segundos de CPU acumulados, RSS em bytes)."""
+        if psutil is not None:
+            p = psutil.Process(self.pid)
+            t = p.cpu_times()
+            return t.user + t.system, p.memory_info().rss
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{self.pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        return (int(fields[11]) + int(fields[12])) / self._tick, rss_pages * self._page
+
+    async def _run(self):
+        last_cpu, _ = self._read()
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            cpu, rss = self._read()
+            now = time.monotonic()
+            self.cpu.append(100.0 * (cpu - last_cpu) / (now - last))
+            self.rss.append(rss / 2**20)
+            last_cpu, last = cpu, now
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> dict:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, OSError):
+                pass
+        return {
+            "cpu_percent_avg": round(sum(self.cpu) / len(self.cpu), 1) if self.cpu else 0.0,
+            "cpu_percent_max": round(max(self.cpu), 1) if self.cpu else 0.0,
+            "rss_mb_max": round(max(self.rss), 1) if self.rss else 0.0,
+        }
+
+# ______________________________________________________________________________________________________
+
+async def open_client(url: str, connect_ms: list):
+    """Conecta e aguarda o histórico inicial (fim do join do lado do servidor)."""
+    t0 = time.perf_counter()
+    ws = await websockets.connect(url, max_queue=None)
+    await ws.recv()
+    connect_ms.append((time.perf_counter() - t0) * 1000)
+    return ws
+
+async def receiver(ws, latencies: list, counter: dict, expected: int, done: asyncio.Event):
+    """Recebe frames e registra a latência das mensagens do benchmark."""
+    async for raw in ws:
+        data = json.loads(raw)
+        kind = data.get("type")
+        if kind == "batch":
+            items = data.get("items", [])
+        elif kind == "message":
+            items = [data.get("item")]
+        else:
+            continue
+        now = time.perf_counter_ns()
+        for item in items:
+            content = (item or {}).get("content", "")
+            if not content.startswith("bench:"):
+                continue
+            sent_ns = int(content.rsplit(":", 1)[1])
+            latencies.append((now - sent_ns) / 1e6)
+            counter["delivered"] += 1
+            if counter["delivered"] >= expected:
+                done.set()
+
+async def sender(ws, idx: int, messages: int, interval: float):
+    """Envia mensagens com o instante de envio embutido no conteúdo."""
+    for seq in range(messages):
+        content = f"bench:{idx}:{seq}:{time.perf_counter_ns()}"
+        await ws.send(json.dumps({"username": f"bench-{idx}", "content": content}))
+        if interval:
+            await asyncio.sleep(interval)
+
+# ______________________________________________________________________________________________________
+
+async def run(args, pid: int) -> dict:
+    prefix = f"bench-{int(time.time())}"
+    rooms = [f"{prefix}-{r}" for r in range(args.rooms)]
+
+    sampler = ProcessSampler(pid)
+    sampler.start()
+
+    # conexões em ondas de `--connect-concurrency` para não saturar o accept
+    connect_ms: list = []
+    clients: list = []
+    for start in range(0, args.clients, args.connect_concurrency):
+        wave = range(start, min(args.clients, start + args.connect_concurrency))
+        clients += await asyncio.gather(*(
+            open_client(f"ws://127.0.0.1:{args.port}/ws/{rooms[i % args.rooms]}", connect_ms)
+            for i in wave
+        ))
+
+    # clientes por sala e remetentes (os S primeiros de cada sala)
+    per_room = [0] * args.rooms
+    senders = []
+    for i, ws in enumerate(clients):
+        r = i % args.rooms
+        if per_room[r] < args.senders:
+            senders.append((i, ws))
+        per_room[r] += 1
+    expected = sum(
+        min(args.senders, n) * args.messages * n for n in per_room
+    )
+
+    latencies: list = []
+    counter = {"delivered": 0}
+    done = asyncio.Event()
+    receivers = [
+        asyncio.create_task(receiver(ws, latencies, counter, expected, done)) for ws in clients
+    ]
+
+    interval = 1.0 / args.rate if args.rate else 0.0
+    start = time.perf_counter()
+    await asyncio.gather(*(sender(ws, i, args.messages, interval) for i, ws in senders))
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    server = await sampler.stop()
+
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*(ws.close() for ws in clients), return_exceptions=True)
+
+    return {
+        "commit": git_commit(),
+        "store": args.store,
+        "clients": args.clients,
+        "rooms": args.rooms,
+        "senders_per_room": args.senders,
+        "rate_per_sender": args.rate,
+        "sent": len(senders) * args.messages,
+        "expected": expected,
+        "delivered": counter["delivered"],
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_sec": round(counter["delivered"] / elapsed, 1) if elapsed else 0.0,
+        "connect_ms": summary(connect_ms),
+        "latency_ms": summary(latencies),
+        "server": server,
+    }
+
+# ______________________________________________________________________________________________________
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerador de carga do chat via WebSocket")
+    parser.add_argument("--store", default="memory", choices=("memory", "mongo"),
+                        help="memory: MongoDB em memória | mongo: MONGO_URL do ambiente")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--senders", type=int, default=1, help="remetentes por sala")
+    parser.add_argument("--messages", type=int, default=50, help="mensagens por remetente")
+    parser.add_argument("--rate", type=float, default=10.0, help="mensagens/s por remetente (0 = sem limite)")
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("-o", "--output", help="grava o JSON também neste arquivo")
+    args = parser.parse_args()
+
+    proc = start_server(args)
+    try:
+        asyncio.run(wait_ready(args.port))
+        result = asyncio.run(run(args, proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait()
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+
+# ______________________________________________________________________________________________________
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Microbenchmarks dos trechos quentes do servidor de chat.
+
+- serialize: `Message.from_doc` + codificação JSON de um documento de mensagem
+  (forma serializada e frame completo);
+- broadcast: `WSManager.broadcast` para uma sala com K conexões (tempo da
+  chamada e tempo até todas as filas de saída esvaziarem);
+- history: página do histórico via `history_query` (primeira página e
+  páginas com cursor), no MongoDB de MONGO_URL ou em memória (mongomock).
+
+Cada caso é repetido e reportado em µs por operação (p50/p99) e ops/s, em JSON:
+
+    python bench/microbench.py --only serialize broadcast
+    MONGO_URL=mongodb://localhost:27017 python bench/microbench.py --only history
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "app"))
+os.chdir(ROOT)
+
+from bson import ObjectId
+
+from frames import dumps, encode_frame
+from pagination import history_query, MESSAGE_PROJECTION
+from ws_manager import WSManager
+
+# ______________________________________________________________________________________________________
+
+def percentile(values: list, p: float) -> float:
+    """Percentil por posição (valores já ordenados)."""
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+def report(name: str, samples_us: list, ops_per_sample: int = 1, **extra) -> dict:
+    """Resumo de amostras em µs (cada amostra cobre `ops_per_sample` operações)."""
+    samples_us = sorted(s / ops_per_sample for s in samples_us)
+    total_s = sum(samples_us) / 1e6
+    return {
+        "case": name,
+        "samples": len(samples_us),
+        "us_per_op": {
+            "p50": round(percentile(samples_us, 50), 3),
+            "p99": round(percentile(samples_us, 99), 3),
+        },
+        "ops_per_sec": round(len(samples_us) / total_s, 1) if total_s else 0.0,
+        **extra,
+    }
+
+def sample_doc(i: int = 0) -> dict:
+    return {
+        "_id": ObjectId(),
+        "room": "bench",
+        "username": f"user{i % 100}",
+        "content": "mensagem de teste " * 4,
+        "avatar": None,
+        "created_at": datetime.now(timezone.utc),
+    }
+
+# ______________________________________________________________________________________________________
+
+def bench_serialize(args) -> list:
+    from message import Message
+
+    doc = sample_doc()
+    batch = 1000
+    only, full = [], []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        for _ in range(batch):
+            Message.from_doc(doc).to_dict()
+        t1 = time.perf_counter()
+        for _ in range(batch):
+            dumps({"type": "message", "item": Message.from_doc(doc)})
+        t2 = time.perf_counter()
+        only.append((t1 - t0) * 1e6)
+        full.append((t2 - t1) * 1e6)
+    return [
+        report("serialize", only, batch),
+        report("serialize+dumps", full, batch),
+    ]
+
+# ______________________________________________________________________________________________________
+
+class NullSocket:
+    """WebSocket que descarta os envios (isola o custo do gerenciador)."""
+
+    async def accept(self, subprotocol: str = None):
+        pass
+
+    async def send_text(self, text: str):
+        pass
+
+    async def send_bytes(self, data: bytes):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+async def _broadcast(args) -> list:
+    manager = WSManager()
+    sockets = [NullSocket() for _ in range(args.connections)]
+    for ws in sockets:
+        await manager.connect("bench", ws, args.codec)
+    payload = {"type": "message", "item": {"_id": str(ObjectId()), "content": "x" * 100}}
+    frame = encode_frame(payload)
+    size = len(frame.binary) if args.codec == "msgpack" else len(frame.text.encode())
+
+    call, drain = [], []
+    conns = list(manager.rooms["bench"].values())
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        await manager.broadcast("bench", payload)
+        t1 = time.perf_counter()
+        while any(c.queue.qsize() for c in conns):
+            await asyncio.sleep(0)
+        t2 = time.perf_counter()
+        call.append((t1 - t0) * 1e6)
+        drain.append((t2 - t0) * 1e6)
+
+    for ws in sockets:
+        manager.disconnect("bench", ws)
+    await asyncio.sleep(0)
+    return [
+        report("broadcast_call", call, connections=args.connections, codec=args.codec, frame_bytes=size),
+        report("broadcast_delivered", drain, connections=args.connections, codec=args.codec, frame_bytes=size),
+    ]
+
+def bench_broadcast(args) -> list:
+    return asyncio.run(_broadcast(args))
+
+# ______________________________________________________________________________________________________
+
+async def _history(args) -> list:
+    url = os.getenv("MONGO_URL")
+    if url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client, store = AsyncIOMotorClient(url), "mongo"
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        client, store = AsyncMongoMockClient(), "memory"
+    coll = client[os.getenv("MONGO_DB", "chat_db")]["bench_messages"]
+    await coll.drop()
+    await coll.create_index([("room", 1), ("_id", -1)])
+    docs = [sample_doc(i) for i in range(args.history_docs)]
+    for start in range(0, len(docs), 1000):
+        await coll.insert_many(docs[start:start + 1000])
+
+    async def page(before_id=None):
+        query, direction = history_query("bench", before_id=before_id)
+        cursor = coll.find(query, MESSAGE_PROJECTION).sort("_id", direction).limit(args.page + 1)
+        return await cursor.to_list(length=args.page + 1)
+
+    first, deep = [], []
+    middle = str(docs[len(docs) // 2]["_id"])
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        await page()
+        t1 = time.perf_counter()
+        await page(middle)
+        t2 = time.perf_counter()
+        first.append((t1 - t0) * 1e6)
+        deep.append((t2 - t1) * 1e6)
+
+    await coll.drop()
+    extra = {"store": store, "docs": args.history_docs, "page": args.page}
+    return [
+        report("history_first_page", first, **extra),
+        report("history_cursor_page", deep, **extra),
+    ]
+
+def bench_history(args) -> list:
+    return asyncio.run(_history(args))
+
+# ______________________________________________________________________________________________________
+
+CASES = {
+    "serialize": bench_serialize,
+    "broadcast": bench_broadcast,
+    "history": bench_history,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks do servidor de chat")
+    parser.add_argument("--only", nargs="+", choices=tuple(CASES), default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--connections", type=int, default=1000, help="conexões no broadcast")
+    parser.add_argument("--codec", default="json", choices=("json", "msgpack"), help="codec das conexões no broadcast")
+    parser.add_argument("--history-docs", type=int, default=10000)
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("-o", "--output", help="grava o JSON também neste arquivo")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.only:
+        results += CASES[name](args)
+    text = json.dumps({"results": results}, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+
+# ______________________________________________________________________________________________________
+
+if __name__ == "__main__":
+    main()